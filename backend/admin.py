@@ -1,15 +1,17 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
-from django.db.models import Sum, F
 from django.db import transaction
 from django.utils.html import format_html
 from django.urls import reverse, path
 from django.utils.translation import gettext_lazy as _
 from backend.models import (User, Shop, Category, ProductInfo,
                             ProductParameter, Order, OrderItem,
-                            Contact, Product)
+                            Contact, Product, OutgoingEmail)
 from backend.signals import new_order_signal
-from backend.tasks import export_products
+from backend.export_utils import parse_export_filters
+from backend.order_utils import can_transition, transition_orders
+from backend.tasks import export_products, generate_invoices_archive
 from backend.views import ImportFromAdmin
 from django.utils.safestring import mark_safe
 
@@ -83,14 +85,8 @@ class OrderItemInline(admin.TabularInline):
 
     product_info_display.short_description = 'Товар'
 
-    def price(self, obj):
-        return obj.product_info.price if obj.product_info else 0
-
-    price.short_description = 'Цена'
-
     def sum(self, obj):
-        return obj.quantity *\
-            (obj.product_info.price if obj.product_info else 0)
+        return obj.quantity * obj.price
 
     sum.short_description = 'Сумма'
 
@@ -98,20 +94,42 @@ class OrderItemInline(admin.TabularInline):
         return False
 
 
+class OrderAdminForm(forms.ModelForm):
+    """Форма заказа с проверкой допустимости смены статуса."""
+
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def clean_state(self):
+        state = self.cleaned_data['state']
+        current_state = self.initial.get('state')
+        if self.instance.pk and state != current_state and not can_transition(current_state, state):
+            raise forms.ValidationError(
+                f'Недопустимый переход статуса: {current_state} → {state}')
+        return state
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    form = OrderAdminForm
     inlines = [OrderItemInline]
     list_display = ('get_user_email', 'state',
                     'total_sum_display', 'contact_info', 'dt')
-    list_filter = ('state', )
+    list_filter = ('state', ('dt', admin.DateFieldListFilter), 'shop_orders__shop')
     list_editable = ('state',)
 
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', OrderAdminForm)
+        return super().get_changelist_form(request, **kwargs)
+
     def get_readonly_fields(self, request, obj=None):
         readonly_fields = [field.name for field in self.model._meta.fields]
         readonly_fields.remove('state')
         readonly_fields.extend(['get_user_email',
                                 'total_sum_display',
-                                'contact_info'])
+                                'contact_info',
+                                'invoice_link'])
         return readonly_fields
 
     def get_user_email(self, obj):
@@ -120,9 +138,7 @@ class OrderAdmin(admin.ModelAdmin):
     get_user_email.short_description = 'Email пользователя'
 
     def total_sum_display(self, obj):
-        total = obj.ordered_items.aggregate(
-            total=Sum(F('quantity') * F('product_info__price')))['total'] or 0
-        return f"{total} руб."
+        return f"{obj.total_sum} руб."
 
     total_sum_display.short_description = 'Общая сумма'
 
@@ -133,6 +149,14 @@ class OrderAdmin(admin.ModelAdmin):
 
     contact_info.short_description = 'Контактные данные'
 
+    def invoice_link(self, obj):
+        if obj.pk and obj.state != 'basket':
+            return format_html('<a href="{}">Скачать накладную</a>',
+                               reverse('backend:order-invoice', args=[obj.pk]))
+        return "-"
+
+    invoice_link.short_description = 'Накладная'
+
     def has_add_permission(self, request):
         return False
 
@@ -148,17 +172,64 @@ class OrderAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         """Отправляет сигнал при изменении статуса"""
 
-        if change:
-            original = Order.objects.get(pk=obj.pk)
-            if original.state != obj.state and obj.state != 'new':
-                transaction.on_commit(lambda: new_order_signal(user_id=obj.user.id,
-                                                               state=obj.state))
+        if change and 'state' in form.changed_data and obj.state != 'new':
+            transaction.on_commit(lambda: new_order_signal(user_id=obj.user_id,
+                                                           order_id=obj.pk,
+                                                           state=obj.state))
 
         super().save_model(request, obj, form, change)
 
+    actions = ['mark_confirmed', 'mark_assembled', 'mark_sent',
+               'mark_delivered', 'mark_canceled', 'generate_invoices']
+
+    @admin.action(description=_('Сформировать накладные (ZIP)'))
+    def generate_invoices(self, request, queryset):
+        """
+        Запускает формирование архива накладных по ID выбранных заказов.
+        При выборе всех заказов queryset уже учитывает фильтры и поиск списка.
+        """
+
+        task = generate_invoices_archive.delay({'ids': list(queryset.values_list('pk', flat=True))})
+        message = f"Формируется архив накладных." \
+                  f" <a href='{reverse('backend:download-csv')}?task_id={task.id}'" \
+                  f">Скачать можно здесь</a>"
+        self.message_user(request, format_html(message), extra_tags='safe')
+
+    def change_state(self, request, queryset, state):
+        """Переводит выбранные заказы в статус state с проверкой допустимых переходов."""
+
+        changed, skipped = transition_orders(queryset, state)
+        message = f'Статус изменён у заказов: {changed}.'
+        if skipped:
+            message += f' Пропущено (недопустимый переход): {skipped}.'
+        self.message_user(request, message,
+                          messages.WARNING if skipped else messages.SUCCESS)
+
+    @admin.action(description=_('Перевести в статус «Подтвержден»'))
+    def mark_confirmed(self, request, queryset):
+        self.change_state(request, queryset, 'confirmed')
+
+    @admin.action(description=_('Перевести в статус «Собран»'))
+    def mark_assembled(self, request, queryset):
+        self.change_state(request, queryset, 'assembled')
+
+    @admin.action(description=_('Перевести в статус «Отправлен»'))
+    def mark_sent(self, request, queryset):
+        self.change_state(request, queryset, 'sent')
+
+    @admin.action(description=_('Перевести в статус «Доставлен»'))
+    def mark_delivered(self, request, queryset):
+        self.change_state(request, queryset, 'delivered')
+
+    @admin.action(description=_('Перевести в статус «Отменен»'))
+    def mark_canceled(self, request, queryset):
+        self.change_state(request, queryset, 'canceled')
+
     def save_formset(self, request, form, formset, change):
-        """Обрабатывает сохранение связанных объектов (OrderItem)"""
+        """Обрабатывает сохранение связанных объектов (OrderItem) и пересчитывает суммы заказа"""
         super().save_formset(request, form, formset, change)
+        if formset.model is OrderItem:
+            form.instance.update_totals()
 
 
 @admin.register(Shop)
@@ -223,20 +294,45 @@ class ProductInfoAdmin(admin.ModelAdmin):
 
     product_image_preview.short_description = 'Изображение товара'
 
-    actions = ['export_selected_products']
+    actions = ['export_selected_products', 'export_selected_products_csv',
+               'export_selected_products_jsonl']
 
-    @admin.action(description=_('Экспортировать выбранные товары'))
-    def export_selected_products(self, request, queryset):
+    def get_export_filters(self, request, queryset):
+        """
+        Фильтры экспорта для выбранных товаров.
+        При выборе всех объектов передаются фильтры списка, а не ID товаров.
+        """
+
+        if request.POST.get('select_across') == '1':
+            return parse_export_filters({
+                'shop_id': request.GET.get('shop__id__exact'),
+                'category_id': request.GET.get('product__category__id__exact'),
+                'search': request.GET.get('q'),
+            })
+        return {'ids': list(queryset.values_list('pk', flat=True))}
+
+    def start_export(self, request, queryset, file_format):
         if not queryset.exists():
             self.message_user(request, 'Нужно выбрать продукты.')
             return
-        product_ids = list(queryset.values_list('pk', flat=True))
-        task = export_products.delay(product_ids)
-        message = f"Сформирован Excel-экспорт товаров." \
+        task = export_products.delay(self.get_export_filters(request, queryset), file_format)
+        message = f"Сформирован экспорт товаров ({file_format})." \
                   f" <a href='{reverse('backend:download-csv')}?task_id={task.id}'" \
                   f">Скачать можно здесь</a>"
         self.message_user(request, format_html(message), extra_tags='safe')
 
+    @admin.action(description=_('Экспортировать выбранные товары'))
+    def export_selected_products(self, request, queryset):
+        self.start_export(request, queryset, 'xlsx')
+
+    @admin.action(description=_('Экспортировать выбранные товары (CSV, gzip)'))
+    def export_selected_products_csv(self, request, queryset):
+        self.start_export(request, queryset, 'csv')
+
+    @admin.action(description=_('Экспортировать выбранные товары (JSON Lines)'))
+    def export_selected_products_jsonl(self, request, queryset):
+        self.start_export(request, queryset, 'jsonl')
+
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -248,3 +344,11 @@ class ProductAdmin(admin.ModelAdmin):
         return "Нет фото"
 
     image_preview.short_description = 'Изображение товара'
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
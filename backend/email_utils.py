@@ -0,0 +1,169 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from backend.models import OutgoingEmail
+
+
+def queue_email(subject, message, to, from_email=None, coalesce_key='',
+                attachment=None, attachment_name='', schedule=True):
+    """
+    Ставит письма в очередь отправки (по одному на получателя).
+
+    Письма с ключом coalesce_key откладываются на EMAIL_COALESCE_DELAY секунд:
+    если за это время тому же получателю ставится письмо с тем же ключом,
+    оно заменяет ещё не отправленное, и уходит только последнее.
+    Отложенные письма отправляет периодическая задача send_outbox_emails;
+    для срочных она запускается сразу, если в очереди нет других готовых
+    к отправке писем (иначе их уже ждёт запущенная задача).
+    Вызывающий код, который ставит несколько писем подряд, может передать
+    schedule=False и один раз запустить send_outbox_emails сам.
+
+    :param subject: Тема письма
+    :param message: Текст письма
+    :param to: Список получателей
+    :param from_email: Email отправителя (по умолчанию EMAIL_HOST_USER)
+    :param coalesce_key: Ключ объединения, например "order_state:15"
+    :param attachment: Содержимое вложения (bytes)
+    :param attachment_name: Имя файла вложения
+    :param schedule: Запускать ли отправку срочных писем после фиксации
+    """
+
+    from_email = from_email or settings.EMAIL_HOST_USER or ''
+    now = timezone.now()
+    delay = settings.EMAIL_COALESCE_DELAY if coalesce_key else 0
+    fields = {'from_email': from_email,
+              'subject': subject,
+              'body': message,
+              'attachment_name': attachment_name,
+              'send_after': now + timedelta(seconds=delay)}
+    queued_ids = []
+
+    with transaction.atomic():
+        for recipient in to:
+            if coalesce_key and OutgoingEmail.objects.filter(
+                    to=recipient, coalesce_key=coalesce_key, status='pending'
+            ).update(**fields):
+                continue
+
+            email = OutgoingEmail(to=recipient, coalesce_key=coalesce_key, **fields)
+            if attachment is not None:
+                email.attachment.save(attachment_name, ContentFile(attachment), save=False)
+            email.save()
+            queued_ids.append(email.id)
+
+    if delay or not schedule:
+        return
+
+    def schedule_sending():
+        # импорт здесь, чтобы избежать циклического импорта с backend.tasks
+        from backend.tasks import send_outbox_emails
+
+        if not OutgoingEmail.objects.filter(
+                status='pending', send_after__lte=now
+        ).exclude(id__in=queued_ids).exists():
+            send_outbox_emails.delay()
+
+    transaction.on_commit(schedule_sending)
+
+
+def retry_delay(attempts):
+    """Задержка перед повторной отправкой: растёт экспоненциально, но не больше часа."""
+
+    return min(settings.EMAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1), 60 * 60)
+
+
+def build_message(email, connection):
+    """Собирает EmailMessage из записи очереди."""
+
+    message = EmailMessage(subject=email.subject,
+                           body=email.body,
+                           from_email=email.from_email or None,
+                           to=[email.to],
+                           connection=connection)
+    if email.attachment:
+        with email.attachment.open('rb') as file:
+            message.attach(email.attachment_name, file.read())
+    return message
+
+
+def claim_outbox_batch(batch_size):
+    """
+    Забирает порцию готовых к отправке писем: помечает их статусом sending
+    и фиксирует транзакцию, чтобы блокировки строк не удерживались на время
+    отправки. Строки выбираются с SKIP LOCKED, поэтому несколько воркеров
+    не заберут одно письмо дважды. Письма, которые воркер не отправил за
+    EMAIL_CLAIM_TIMEOUT секунд (например, при его падении), забираются снова.
+
+    :param batch_size: Максимальное количество писем в порции
+    :return: Список писем (OutgoingEmail)
+    """
+
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True).filter(
+            status__in=['pending', 'sending'],
+            send_after__lte=now
+        ).order_by('send_after', 'id')[:batch_size])
+
+        OutgoingEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            status='sending',
+            send_after=now + timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+        )
+
+    return emails
+
+
+def send_outbox_batch(batch_size):
+    """
+    Отправляет одну порцию писем из очереди через одно SMTP-соединение.
+    Отправка выполняется вне транзакции (см. claim_outbox_batch).
+    Вложения отправленных писем удаляются из хранилища.
+
+    :param batch_size: Максимальное количество писем в порции
+    :return: Кортеж (отправлено, ошибок)
+    """
+
+    sent = failed = 0
+    emails = claim_outbox_batch(batch_size)
+    if not emails:
+        return sent, failed
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception:
+        # SMTP-сервер недоступен: письма возвращаются в очередь без учёта попытки
+        OutgoingEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            status='pending', send_after=timezone.now())
+        raise
+
+    try:
+        for email in emails:
+            try:
+                build_message(email, connection).send()
+            except Exception as error:
+                email.attempts += 1
+                email.last_error = str(error)
+                if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                    email.status = 'failed'
+                else:
+                    email.status = 'pending'
+                    email.send_after = timezone.now() + timedelta(
+                        seconds=retry_delay(email.attempts))
+                failed += 1
+            else:
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                if email.attachment:
+                    email.attachment.delete(save=False)
+                sent += 1
+    finally:
+        connection.close()
+        OutgoingEmail.objects.bulk_update(
+            emails, ['status', 'attempts', 'last_error', 'send_after', 'sent_at', 'attachment']
+        )
+
+    return sent, failed
@@ -1,125 +1,385 @@
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from io import BytesIO
+from zipfile import ZipFile, ZIP_STORED
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import Cell
 from openpyxl.styles import Font, Alignment, Border, Side
-from io import BytesIO
 from openpyxl.utils import get_column_letter
-from openpyxl.cell.cell import MergedCell
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from backend.models import Order, OrderItem
+
+InvoiceLine = namedtuple('InvoiceLine', ('shop', 'product', 'quantity', 'price'))
+
+# Данные накладной без моделей Django, чтобы передавать их в другие процессы
+InvoiceContact = namedtuple('InvoiceContact', ('city', 'street', 'phone'))
+InvoiceOrder = namedtuple('InvoiceOrder', ('id', 'dt', 'contact'))
+InvoiceUser = namedtuple('InvoiceUser', ('email',))
+
+# Количество заказов, данные которых загружаются из БД за раз
+INVOICE_BATCH_SIZE = 500
+
+# Каталог сохранённых накладных в хранилище. Версию макета нужно
+# увеличить при изменении generate_invoice_excel, чтобы сбросить сохранённые файлы.
+INVOICES_DIR = 'invoices'
+INVOICE_LAYOUT_VERSION = 1
+
+# Стили создаются один раз и переиспользуются всеми ячейками
+HEADER_FONT = Font(bold=True, size=12)
+TITLE_FONT = Font(bold=True, size=14)
+THIN_BORDER = Border(left=Side(style='thin'),
+                     right=Side(style='thin'),
+                     top=Side(style='thin'),
+                     bottom=Side(style='thin'))
+CENTER_ALIGNMENT = Alignment(horizontal='center')
+NUMBER_STYLE = '0'  # Формат для целых чисел
+MONEY_STYLE = '#,##0.00'  # Формат для денежных значений без "руб"
+TOTAL_MONEY_STYLE = '#,##0.00" руб"'  # Формат для итоговой суммы с "руб"
+
+
+class StreamingSheetWriter:
+    """
+    Потоковая запись листа Excel в режиме write-only openpyxl.
+
+    Строки не хранятся в памяти, а сразу сбрасываются во временный файл.
+    Ширина столбцов считается по мере добавления строк. В xlsx она
+    записывается перед строками, поэтому фиксируется по первым
+    sample_size строкам, после чего буфер сбрасывается.
+    """
+
+    def __init__(self, title, columns, sample_size=1000):
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title=title)
+        self.widths = [0] * columns
+        self.sample_size = sample_size
+        self.row_count = 0
+        self._buffer = []
+        self._flushed = False
+
+    def cell(self, value, font=None, border=None, alignment=None, number_format=None):
+        """Создаёт ячейку со стилем для записи в лист."""
+
+        cell = WriteOnlyCell(self.sheet, value=value)
+        if font:
+            cell.font = font
+        if border:
+            cell.border = border
+        if alignment:
+            cell.alignment = alignment
+        if number_format:
+            cell.number_format = number_format
+        return cell
+
+    def append(self, values):
+        """
+        Добавляет строку (значения или ячейки из cell()).
+
+        :return: Номер добавленной строки
+        """
+
+        for idx, value in enumerate(values[:len(self.widths)]):
+            if isinstance(value, Cell):
+                value = value.value
+            if value is not None:
+                self.widths[idx] = max(self.widths[idx], len(str(value)))
+
+        self.row_count += 1
+        if self._flushed:
+            self.sheet.append(values)
+        else:
+            self._buffer.append(values)
+            if len(self._buffer) >= self.sample_size:
+                self._flush()
+        return self.row_count
+
+    def merge(self, row, first_column, last_column):
+        """Объединяет ячейки строки row в диапазоне столбцов."""
+
+        self.sheet.merged_cells.add(f'{get_column_letter(first_column)}{row}:'
+                                    f'{get_column_letter(last_column)}{row}')
+
+    def _flush(self):
+        for idx, width in enumerate(self.widths, 1):
+            self.sheet.column_dimensions[get_column_letter(idx)].width = (width + 2) * 1.2
+        for values in self._buffer:
+            self.sheet.append(values)
+        self._buffer = []
+        self._flushed = True
+
+    def save(self, output):
+        """
+        Сохраняет книгу.
 
+        :param output: Путь к файлу или файловый объект
+        """
 
-def generate_invoice_excel(order, user, shops_items):
+        if not self._flushed:
+            self._flush()
+        self.workbook.save(output)
+
+
+def save_workbook(writer, output=None):
+    """
+    Сохраняет книгу в output или, если он не указан, возвращает байты файла.
+    """
+
+    if output is not None:
+        writer.save(output)
+        return output
+
+    excel_file = BytesIO()
+    writer.save(excel_file)
+    return excel_file.getvalue()
+
+
+def get_invoice_lines(order_id):
+    """
+    Получает позиции накладной одним запросом
+    и группирует их по магазинам.
+
+    :param order_id: ID заказа
+    :return: Список пар (название магазина, список InvoiceLine)
+    """
+
+    rows = OrderItem.objects.filter(order_id=order_id).order_by(
+        'product_info__shop__name', 'id'
+    ).values_list(
+        'product_info__shop__name', 'product_info__product__name',
+        'quantity', 'price'
+    )
+    lines = [InvoiceLine(*row) for row in rows]
+    return [(shop_name, list(shop_lines))
+            for shop_name, shop_lines in groupby(lines, key=lambda line: line.shop)]
+
+
+def generate_invoice_excel(order, user, shops_lines, output=None):
     """
     Генерирует Excel-файл
 
     :param order: Объект заказа
     :param user: Объект пользователя
-    :param shops_items: Словарь с товарами, сгруппированными по магазинам
-    :return: Байты сгенерированного Excel-файла
-    """
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Накладная №{order.id}"
-
-    # Настройка стилей
-    header_font = Font(bold=True, size=12)
-    title_font = Font(bold=True, size=14)
-    border = Border(left=Side(style='thin'),
-                    right=Side(style='thin'),
-                    top=Side(style='thin'),
-                    bottom=Side(style='thin'))
-    center_alignment = Alignment(horizontal='center')
-    number_style = '0'  # Формат для целых чисел
-    money_style = '#,##0.00'  # Формат для денежных значений без "руб"
-    total_money_style = '#,##0.00" руб"'  # Формат для итоговой суммы с "руб"
+    :param shops_lines: Позиции, сгруппированные по магазинам (см. get_invoice_lines)
+    :param output: Путь или файловый объект для записи (по умолчанию в память)
+    :return: Байты сгенерированного Excel-файла или output, если он указан
+    """
+
+    writer = StreamingSheetWriter(f"Накладная №{order.id}", columns=5)
+    cell = writer.cell
 
     # 1. Заголовок накладной
-    ws.merge_cells('A1:E1')
-    ws['A1'] = f"НАКЛАДНАЯ №{order.id}"
-    ws['A1'].font = title_font
-    ws['A1'].alignment = center_alignment
+    row_num = writer.append([cell(f"НАКЛАДНАЯ №{order.id}",
+                                  font=TITLE_FONT, alignment=CENTER_ALIGNMENT)])
+    writer.merge(row_num, 1, 5)
 
     # 2. Информация о заказе
-    ws.append(["Дата:", order.dt.strftime('%H:%M %d.%m.%Y '), "", "", ""])
-    ws.append(["Клиент:", user.email, "", "", ""])
+    writer.append(["Дата:", order.dt.strftime('%H:%M %d.%m.%Y '), "", "", ""])
+    writer.append(["Клиент:", user.email, "", "", ""])
     if order.contact:
-        ws.append(["Город:", order.contact.city, "", "", ""])
-        ws.append(["Улица:", order.contact.street, "", "", ""])
-        ws.append(["Телефон:", order.contact.phone, "", "", ""])
+        writer.append(["Город:", order.contact.city, "", "", ""])
+        writer.append(["Улица:", order.contact.street, "", "", ""])
+        writer.append(["Телефон:", order.contact.phone, "", "", ""])
 
     # 3. Пустая строка
-    ws.append([])
+    writer.append([])
 
     # 4. Заголовок таблицы товаров (с "руб" в названиях столбцов)
     headers = ["Магазин", "Товар", "Количество", "Цена, руб", "Сумма, руб"]
-    ws.append(headers)
-    for col in range(1, 6):
-        cell = ws.cell(row=ws.max_row, column=col)
-        cell.font = header_font
-        cell.border = border
+    writer.append([cell(header, font=HEADER_FONT, border=THIN_BORDER)
+                   for header in headers])
 
     # 5. Товары по магазинам
-    for shop_name, products in shops_items.items():
+    total = 0
+    for shop_name, lines in shops_lines:
         # Заголовок магазина
-        row_num = ws.max_row + 1
-        ws.merge_cells(start_row=row_num, start_column=1, end_row=row_num, end_column=5)
-        ws.cell(row=row_num, column=1, value=shop_name).font = header_font
+        row_num = writer.append([cell(shop_name, font=HEADER_FONT, border=THIN_BORDER)])
+        writer.merge(row_num, 1, 5)
 
         # Добавляем товары
-        for item in order.ordered_items.filter(product_info__shop__name=shop_name):
-            product_name = item.product_info.product.name
-            row = [
-                "",
-                product_name,
-                item.quantity,
-                item.product_info.price,
-                item.quantity * item.product_info.price
-            ]
-            ws.append(row)
-
-            # Форматируем количество (целое число)
-            ws.cell(row=ws.max_row, column=3).number_format = number_style
-            # Форматируем цену и сумму (деньги без "руб")
-            ws.cell(row=ws.max_row, column=4).number_format = money_style
-            ws.cell(row=ws.max_row, column=5).number_format = money_style
+        shop_total = 0
+        for line in lines:
+            line_sum = line.quantity * line.price
+            shop_total += line_sum
+            writer.append([
+                cell("", border=THIN_BORDER),
+                cell(line.product, border=THIN_BORDER),
+                cell(line.quantity, border=THIN_BORDER, number_format=NUMBER_STYLE),
+                cell(line.price, border=THIN_BORDER, number_format=MONEY_STYLE),
+                cell(line_sum, border=THIN_BORDER, number_format=MONEY_STYLE),
+            ])
 
         # Итого по магазину
-        shop_total = sum(item.product_info.price * item.quantity
-                         for item in order.ordered_items.all()
-                         if item.product_info.shop.name == shop_name)
-        ws.append(["", "Итого по магазину:", "", "", shop_total])
-        ws[f'E{ws.max_row}'].font = header_font
-        ws[f'E{ws.max_row}'].number_format = money_style
-
-    # 6. Форматирование таблицы
-    for row in ws.iter_rows(min_row=7, max_row=ws.max_row):
-        for cell in row:
-            if cell.value is not None and not isinstance(cell, MergedCell):
-                cell.border = border
-
-    # 7. Общая сумма (с "руб")
-    ws.append([])
-    total = sum(item.product_info.price * item.quantity for item in order.ordered_items.all())
-    ws.append(["", "", "", "ОБЩАЯ СУММА:", total])
-    ws[f'D{ws.max_row}'].font = header_font
-    ws[f'E{ws.max_row}'].font = Font(bold=True, size=12)
-    ws[f'E{ws.max_row}'].number_format = total_money_style
-
-    # 8. Автоматическая ширина столбцов
-    for col_idx in range(1, 6):
-        max_length = 0
-        column_letter = get_column_letter(col_idx)
-
-        for cell in ws[column_letter]:
-            try:
-                if not isinstance(cell, MergedCell) and cell.value is not None:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
-
-        ws.column_dimensions[column_letter].width = (max_length + 2) * 1.2
-
-    # Сохраняем в BytesIO
-    excel_file = BytesIO()
-    wb.save(excel_file)
-    excel_file.seek(0)
+        total += shop_total
+        writer.append([
+            cell("", border=THIN_BORDER),
+            cell("Итого по магазину:", border=THIN_BORDER),
+            cell("", border=THIN_BORDER),
+            cell("", border=THIN_BORDER),
+            cell(shop_total, font=HEADER_FONT, border=THIN_BORDER, number_format=MONEY_STYLE),
+        ])
 
-    return excel_file.getvalue()
+    # 6. Общая сумма (с "руб")
+    writer.append([])
+    writer.append(["", "", "",
+                   cell("ОБЩАЯ СУММА:", font=HEADER_FONT),
+                   cell(total, font=HEADER_FONT, number_format=TOTAL_MONEY_STYLE)])
+
+    return save_workbook(writer, output)
+
+
+def invoice_version(order, user, shops_lines):
+    """
+    Вычисляет версию содержимого накладной: хэш всех данных, попадающих в файл.
+    Любое изменение заказа, контакта или позиций даёт новую версию.
+
+    :return: Шестнадцатеричная строка SHA-1
+    """
+
+    contact = order.contact
+    content = repr((INVOICE_LAYOUT_VERSION, order.id, order.dt.isoformat(), user.email,
+                    (contact.city, contact.street, contact.phone) if contact else None,
+                    [(shop_name, [tuple(line) for line in lines])
+                     for shop_name, lines in shops_lines]))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def get_invoice_file(order, user, shops_lines=None):
+    """
+    Возвращает сохранённый файл накладной, формируя его только
+    при первом запросе или после изменения заказа.
+
+    :param order: Объект заказа
+    :param user: Объект пользователя
+    :param shops_lines: Позиции по магазинам (если не переданы, загружаются)
+    :return: Путь к файлу накладной в хранилище
+    """
+
+    if shops_lines is None:
+        shops_lines = get_invoice_lines(order.id)
+
+    directory = os.path.join(INVOICES_DIR, str(order.id))
+    path = os.path.join(directory, f'{invoice_version(order, user, shops_lines)}.xlsx')
+    if default_storage.exists(path):
+        return path
+
+    delete_invoice_files(order.id)
+    return default_storage.save(path, ContentFile(generate_invoice_excel(order, user, shops_lines)))
+
+
+def delete_invoice_files(order_id):
+    """Удаляет сохранённые файлы накладной заказа."""
+
+    directory = os.path.join(INVOICES_DIR, str(order_id))
+    if not default_storage.exists(directory):
+        return
+    _, files = default_storage.listdir(directory)
+    for name in files:
+        default_storage.delete(os.path.join(directory, name))
+
+
+def invoice_orders_queryset(filters):
+    """
+    Отбирает оформленные заказы для пакетной выгрузки накладных.
+
+    :param filters: Словарь с необязательными полями date_from, date_to
+                    (даты в формате ISO), shop_id, state и ids
+    :return: QuerySet заказов, упорядоченный по ID
+    """
+
+    orders = Order.objects.nocache().exclude(state='basket')
+    if filters.get('ids') is not None:
+        orders = orders.filter(id__in=filters['ids'])
+    if filters.get('date_from'):
+        orders = orders.filter(dt__date__gte=filters['date_from'])
+    if filters.get('date_to'):
+        orders = orders.filter(dt__date__lte=filters['date_to'])
+    if filters.get('shop_id'):
+        orders = orders.filter(shop_orders__shop_id=filters['shop_id'])
+    if filters.get('state'):
+        orders = orders.filter(state=filters['state'])
+    return orders.order_by('id')
+
+
+def get_invoices_data(order_ids):
+    """
+    Загружает данные накладных для списка заказов двумя запросами.
+
+    :param order_ids: Список ID заказов
+    :return: Список кортежей (InvoiceOrder, InvoiceUser, позиции по магазинам)
+    """
+
+    orders = Order.objects.nocache().filter(id__in=order_ids).order_by('id').values_list(
+        'id', 'dt', 'user__email', 'contact_id',
+        'contact__city', 'contact__street', 'contact__phone'
+    )
+    rows = OrderItem.objects.nocache().filter(order_id__in=order_ids).order_by(
+        'order_id', 'product_info__shop__name', 'id'
+    ).values_list(
+        'order_id', 'product_info__shop__name', 'product_info__product__name',
+        'quantity', 'price'
+    )
+
+    lines_by_order = {}
+    for order_id, order_rows in groupby(rows, key=lambda row: row[0]):
+        lines = [InvoiceLine(*row[1:]) for row in order_rows]
+        lines_by_order[order_id] = [
+            (shop_name, list(shop_lines))
+            for shop_name, shop_lines in groupby(lines, key=lambda line: line.shop)
+        ]
+
+    return [(InvoiceOrder(order_id, dt,
+                          InvoiceContact(city, street, phone) if contact_id else None),
+             InvoiceUser(email),
+             lines_by_order.get(order_id, []))
+            for order_id, dt, email, contact_id, city, street, phone in orders]
+
+
+def render_invoice(invoice):
+    """
+    Формирует файл накладной (выполняется в процессе пула).
+
+    :param invoice: Кортеж из get_invoices_data
+    :return: Кортеж (имя файла, байты Excel-файла)
+    """
+
+    order, user, shops_lines = invoice
+    return f'invoice_{order.id}.xlsx', generate_invoice_excel(order, user, shops_lines)
+
+
+def write_invoices_archive(order_ids, output, workers=None):
+    """
+    Формирует накладные по заказам и записывает их в ZIP-архив.
+    Данные загружаются порциями по INVOICE_BATCH_SIZE заказов,
+    а файлы формируются параллельно в пуле процессов.
+
+    :param order_ids: Итерируемый набор ID заказов
+    :param output: Путь или файловый объект для архива
+    :param workers: Количество процессов (по умолчанию по числу ядер, 1 - без пула)
+    :return: Количество накладных в архиве
+    """
+
+    order_ids = list(order_ids)
+    count = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+
+    try:
+        # xlsx уже сжат, поэтому файлы добавляются в архив без сжатия
+        with ZipFile(output, 'w', ZIP_STORED) as archive:
+            for start in range(0, len(order_ids), INVOICE_BATCH_SIZE):
+                invoices = get_invoices_data(order_ids[start:start + INVOICE_BATCH_SIZE])
+                if executor:
+                    results = executor.map(render_invoice, invoices, chunksize=16)
+                else:
+                    results = map(render_invoice, invoices)
+                for filename, data in results:
+                    archive.writestr(filename, data)
+                    count += 1
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return count
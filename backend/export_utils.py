@@ -0,0 +1,241 @@
+import csv
+import gzip
+import hashlib
+import json
+import os
+from datetime import timedelta
+from uuid import uuid4
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from backend.excel_utils import StreamingSheetWriter
+from backend.models import ProductInfo, ProductParameter
+
+CHECKSUM_CHUNK_SIZE = 64 * 1024
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_HEADERS = [
+    'ID', 'Модель', 'Продукт', 'Магазин',
+    'Количество', 'Цена', 'РРЦ', 'Параметры'
+]
+EXPORT_FIELDS = [
+    'id', 'model', 'product', 'shop',
+    'quantity', 'price', 'price_rrc', 'parameters'
+]
+
+# Формат экспорта: (расширение файла, content type)
+EXPORT_FORMATS = {
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('csv.gz', 'application/gzip'),
+    'jsonl': ('jsonl', 'application/x-ndjson'),
+    'zip': ('zip', 'application/zip'),
+}
+
+
+def parse_export_filters(data):
+    """
+    Проверяет и нормализует параметры выборки товаров для экспорта.
+
+    :param data: Словарь с полями shop_id, category_id, price_min,
+                 price_max, updated_since, search, ids (все необязательные)
+    :return: Словарь фильтров, пригодный для передачи в Celery
+    """
+
+    filters = {}
+    for name in ('shop_id', 'category_id', 'price_min', 'price_max'):
+        value = data.get(name)
+        if value in (None, ''):
+            continue
+        try:
+            filters[name] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'Поле "{name}" должно быть числом.')
+
+    updated_since = data.get('updated_since')
+    if updated_since:
+        parsed = parse_datetime(str(updated_since))
+        if parsed is None:
+            raise ValueError('Поле "updated_since" должно быть датой в формате ISO 8601.')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        filters['updated_since'] = parsed.isoformat()
+
+    if data.get('search'):
+        filters['search'] = str(data['search'])
+
+    if data.get('ids') is not None:
+        try:
+            filters['ids'] = [int(pk) for pk in data['ids']]
+        except (TypeError, ValueError):
+            raise ValueError('Поле "ids" должно быть списком чисел.')
+
+    return filters
+
+
+def export_queryset(filters):
+    """
+    Формирует выборку товаров по фильтрам из parse_export_filters.
+
+    :param filters: Словарь фильтров
+    :return: QuerySet ProductInfo, упорядоченный по ID
+    """
+
+    query = Q()
+    if 'ids' in filters:
+        query &= Q(id__in=filters['ids'])
+    if 'shop_id' in filters:
+        query &= Q(shop_id=filters['shop_id'])
+    if 'category_id' in filters:
+        query &= Q(product__category_id=filters['category_id'])
+    if 'price_min' in filters:
+        query &= Q(price__gte=filters['price_min'])
+    if 'price_max' in filters:
+        query &= Q(price__lte=filters['price_max'])
+    if 'updated_since' in filters:
+        query &= Q(updated_at__gte=parse_datetime(filters['updated_since']))
+    if 'search' in filters:
+        query &= Q(product__name__icontains=filters['search']) | \
+                 Q(model__icontains=filters['search'])
+
+    # выборка разовая и может быть большой, поэтому кэш cacheops не используется
+    return ProductInfo.objects.nocache().filter(query).select_related(
+        'product', 'shop'
+    ).prefetch_related(
+        Prefetch('product_parameters',
+                 queryset=ProductParameter.objects.nocache().select_related('parameter'))
+    ).order_by('id')
+
+
+def iter_export_items(queryset):
+    """
+    Читает товары из БД порциями (курсором на стороне сервера).
+
+    :return: Генератор словарей с полями EXPORT_FIELDS
+    """
+
+    for item in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {
+            'id': item.id,
+            'model': item.model,
+            'product': item.product.name,
+            'shop': item.shop.name,
+            'quantity': item.quantity,
+            'price': item.price,
+            'price_rrc': item.price_rrc,
+            'parameters': {param.parameter.name: param.value
+                           for param in item.product_parameters.all()},
+        }
+
+
+def format_parameters(parameters):
+    """Преобразует параметры товара в одну строку для табличных форматов."""
+
+    return ', '.join(f'{name}: {value}' for name, value in parameters.items()).replace('\n', ' ')
+
+
+def write_xlsx(items, file):
+    """Записывает товары в файл Excel."""
+
+    writer = StreamingSheetWriter("Экспорт товаров", columns=len(EXPORT_HEADERS))
+    writer.append(EXPORT_HEADERS)
+    for item in items:
+        item['parameters'] = format_parameters(item['parameters'])
+        writer.append([item[field] for field in EXPORT_FIELDS])
+    writer.save(file)
+
+
+def write_csv(items, file):
+    """Записывает товары в CSV, сжатый gzip."""
+
+    with gzip.open(file, 'wt', encoding='utf-8', newline='') as gzip_file:
+        writer = csv.writer(gzip_file)
+        writer.writerow(EXPORT_FIELDS)
+        for item in items:
+            item['parameters'] = format_parameters(item['parameters'])
+            writer.writerow([item[field] for field in EXPORT_FIELDS])
+
+
+def write_jsonl(items, file):
+    """Записывает товары в формате JSON Lines (по объекту на строку)."""
+
+    for item in items:
+        file.write(json.dumps(item, ensure_ascii=False).encode('utf-8'))
+        file.write(b'\n')
+
+
+EXPORT_WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+}
+
+
+def file_checksum(file):
+    """
+    Считает SHA-256 файла, читая его блоками.
+
+    :param file: Открытый на чтение файловый объект
+    :return: Шестнадцатеричная строка контрольной суммы
+    """
+
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHECKSUM_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def save_export_artifact(file, file_format, name='products_export'):
+    """
+    Сохраняет готовый файл экспорта в хранилище.
+
+    :param file: Открытый на чтение файловый объект с результатом
+    :param file_format: Формат файла (ключ EXPORT_FORMATS)
+    :param name: Имя файла для скачивания (без расширения)
+    :return: Метаданные файла: путь, имя, формат, размер, контрольная сумма и срок хранения
+    """
+
+    extension, _ = EXPORT_FORMATS[file_format]
+    checksum = file_checksum(file)
+    path = os.path.join(settings.EXPORT_ARTIFACTS_DIR, f'{uuid4().hex}.{extension}')
+    path = default_storage.save(path, File(file))
+    expires_at = timezone.now() + timedelta(seconds=settings.EXPORT_ARTIFACT_TTL)
+
+    return {'path': path,
+            'filename': f'{name}.{extension}',
+            'format': file_format,
+            'size': default_storage.size(path),
+            'checksum': checksum,
+            'expires_at': expires_at.isoformat()}
+
+
+def is_artifact_expired(artifact):
+    """Проверяет, истёк ли срок хранения файла экспорта."""
+
+    return parse_datetime(artifact['expires_at']) <= timezone.now()
+
+
+def cleanup_export_artifacts():
+    """
+    Удаляет из хранилища файлы экспорта старше срока хранения.
+
+    :return: Количество удалённых файлов
+    """
+
+    directory = settings.EXPORT_ARTIFACTS_DIR
+    if not default_storage.exists(directory):
+        return 0
+
+    expired_before = timezone.now() - timedelta(seconds=settings.EXPORT_ARTIFACT_TTL)
+    _, files = default_storage.listdir(directory)
+    deleted = 0
+    for name in files:
+        path = os.path.join(directory, name)
+        if default_storage.get_modified_time(path) <= expired_before:
+            default_storage.delete(path)
+            deleted += 1
+    return deleted
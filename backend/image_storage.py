@@ -0,0 +1,66 @@
+import hashlib
+import os
+import re
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+from django.utils import timezone
+
+CHECKSUM_CHUNK_SIZE = 64 * 1024
+# Имя файла в адресуемом по содержимому хранилище: <каталог>/<ab>/<sha256>.<расширение>
+CONTENT_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/(\1[0-9a-f]{62})\.[0-9a-z]+$')
+
+
+def content_digest(name):
+    """
+    Хэш содержимого, если файл сохранён в адресуемом по содержимому хранилище.
+
+    :param name: Имя файла в хранилище
+    :return: sha256 содержимого или None для файлов с обычными именами
+    """
+
+    match = CONTENT_NAME_RE.search(name or '')
+    return match.group(2) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла - хэш его содержимого.
+    Одинаковые файлы хранятся один раз: повторное сохранение
+    возвращает имя уже существующего файла.
+    """
+
+    def save(self, name, content, max_length=None):
+        # импорт здесь, чтобы избежать циклического импорта с backend.models
+        from backend.models import ImageBlob
+
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest = hashlib.sha256()
+        for chunk in content.chunks(CHECKSUM_CHUNK_SIZE):
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        content.seek(0)
+
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        name = os.path.join(directory, digest[:2], f'{digest}{extension}')
+        # UPDATE блокирует строку файла: если collect_unused_images удаляет его
+        # прямо сейчас, запрос дождётся конца удаления, и файл запишется заново.
+        # Новая отметка времени не даёт сборщику удалить файл без ссылок,
+        # пока ссылка на него не сохранена в БД (см. acquire_image)
+        ImageBlob.objects.filter(name=name).update(updated_at=timezone.now())
+        if self.exists(name):
+            # Отметка времени защищает файл от сборки мусора (см. collect_orphaned_media),
+            # пока ссылка на него не сохранена в БД
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+
+def get_image_storage():
+    """Хранилище оригиналов изображений товаров и аватаров."""
+
+    return storages['images']
@@ -1,59 +1,647 @@
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
 from io import BytesIO
-from PIL import Image
-from django.core.files.storage import default_storage
+from PIL import Image, features
+from pilkit.processors import ResizeToFit
+from cacheops.invalidation import invalidate_model
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, storages
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from backend.image_storage import content_digest, get_image_storage
+from backend.models import ImageBlob, Product, User
 
+PRODUCT_THUMBNAIL_SIZES = [(400, 400), (200, 200), (100, 100)]
+AVATAR_THUMBNAIL_SIZES = [(200, 200), (100, 100), (50, 50)]
+# Размер, к которому приводится загруженный оригинал
+PRODUCT_IMAGE_SIZE = (800, 800)
+AVATAR_IMAGE_SIZE = (500, 500)
+# Форматы миниатюр: имя -> (формат Pillow, MIME-тип, параметры сохранения).
+# JPEG строится всегда и отдаётся клиентам, не принимающим остальные форматы.
+THUMBNAIL_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'avif': ('AVIF', 'image/avif', {'quality': 60, 'speed': 8}),
+}
+FALLBACK_THUMBNAIL_FORMAT = 'jpeg'
+# Форматы, которые поддерживает установленный Pillow
+SUPPORTED_THUMBNAIL_FORMATS = [name for name in THUMBNAIL_FORMATS
+                               if name == FALLBACK_THUMBNAIL_FORMAT or features.check(name)]
+# Версию нужно увеличить при изменении способа построения миниатюр,
+# чтобы команда backfill_thumbnails перестроила их
+THUMBNAIL_RENDER_VERSION = 2
+# Количество объектов, загружаемых из БД за раз при массовой генерации
+THUMBNAIL_BATCH_SIZE = 500
+# Каталог миниатюр изображений из адресуемого по содержимому хранилища:
+# они общие для всех объектов с одинаковым изображением
+SHARED_THUMBNAILS_DIR = 'thumbnails'
 
-def generate_and_save_thumbnails(instance, image_field_name, thumbnails_field_name, sizes):
+# Описание поля изображения модели для массовой генерации миниатюр
+ThumbnailTarget = namedtuple('ThumbnailTarget', ('model', 'image_field_name',
+                                                 'thumbnails_field_name',
+                                                 'source_field_name', 'sizes',
+                                                 'state_field_name', 'image_size'))
+THUMBNAIL_TARGETS = {
+    'product': ThumbnailTarget(Product, 'image', 'thumbnails',
+                               'thumbnails_source', PRODUCT_THUMBNAIL_SIZES,
+                               'image_state', PRODUCT_IMAGE_SIZE),
+    'user': ThumbnailTarget(User, 'avatar', 'avatar_thumbnails',
+                            'avatar_thumbnails_source', AVATAR_THUMBNAIL_SIZES,
+                            'avatar_state', AVATAR_IMAGE_SIZE),
+}
+# Данные объекта без моделей Django, чтобы передавать их в другие процессы
+ThumbnailJob = namedtuple('ThumbnailJob', ('id', 'image_name', 'thumbnails', 'source'))
+# Во сколько раз декодированное изображение должно оставаться больше
+# наибольшей миниатюры, прежде чем его сгладит thumbnail()
+REDUCING_GAP = 2
+
+
+def get_thumbnail_storage():
+    """Хранилище миниатюр: файлы с тем же именем перезаписываются."""
+
+    return storages['thumbnails']
+
+
+def open_reduced(file, size):
     """
-    Универсальная функция для генерации миниатюр
+    Декодирует изображение один раз в уменьшенном масштабе.
+
+    Для JPEG draft() масштабирует изображение при декодировании (1/2 - 1/8),
+    затем reduce() уменьшает его в целое число раз, оставляя запас REDUCING_GAP
+    относительно наибольшей миниатюры.
+
+    :param file: Путь или файловый объект с изображением
+    :param size: Наибольший размер миниатюры (width, height)
+    :return: Загруженное изображение Image
+    """
+
+    width, height = size
+    img = Image.open(file)
+    img.draft('RGB', (width * REDUCING_GAP, height * REDUCING_GAP))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img.load()
+
+    factor = int(max(img.width / width, img.height / height) / REDUCING_GAP)
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+
+def iter_thumbnails(file, sizes):
+    """
+    Каскадно строит миниатюры по убыванию размера: каждая следующая
+    получается из предыдущей, а не из полноразмерного изображения.
+
+    Изображение уменьшается на месте, поэтому его нужно сохранить
+    до получения следующего элемента.
+
+    :param file: Путь или файловый объект с изображением
+    :param sizes: Список размеров [(width, height), ...]
+    :return: Генератор пар ((width, height), Image)
+    """
+
+    sizes = sorted(set(sizes), key=lambda size: size[0] * size[1], reverse=True)
+    if not sizes:
+        return
+
+    img = open_reduced(file, sizes[0])
+    for size in sizes:
+        img.thumbnail(size)
+        yield size, img
+
+
+def encode_thumbnail(img, image_format=FALLBACK_THUMBNAIL_FORMAT):
+    """
+    Кодирует миниатюру в указанный формат.
+
+    :param img: Изображение Image
+    :param image_format: Имя формата из THUMBNAIL_FORMATS
+    :return: Содержимое файла (bytes)
+    """
+
+    pillow_format, _, options = THUMBNAIL_FORMATS[image_format]
+    buffer = BytesIO()
+    img.save(buffer, format=pillow_format, **options)
+    return buffer.getvalue()
+
+
+def process_original(instance, target):
+    """
+    Приводит загруженный оригинал к размеру target.image_size в JPEG
+    и подменяет им файл в объекте. Исходный файл освобождается
+    и удаляется collect_unused_images.
+
+    :param instance: Экземпляр модели
+    :param target: Описание поля изображения (ThumbnailTarget)
+    :return: True, если оригинал обработан; False, если изображение уже заменено
+    """
+
+    original_image = getattr(instance, target.image_field_name)
+    raw_name = original_image.name
+    with original_image.open('rb') as file:
+        img = ResizeToFit(*target.image_size).process(open_reduced(file, target.image_size))
+    data = encode_thumbnail(img)
+
+    upload_to = instance._meta.get_field(target.image_field_name).upload_to
+    name = original_image.storage.save(f'{upload_to}{target.image_field_name}.jpg',
+                                       ContentFile(data))
+    acquire_image(name)
+    updated = (target.model.objects
+               .filter(id=instance.id, **{target.image_field_name: raw_name})
+               .invalidated_update(**{target.image_field_name: name}))
+    release_image(raw_name if updated else name)
+    if updated:
+        # Новый FieldFile: открытый файл прежнего оригинала не должен переиспользоваться
+        setattr(instance, target.image_field_name, name)
+    return bool(updated)
+
+
+def render_variants(data, size):
+    """
+    Строит одну миниатюру во всех поддерживаемых форматах за одно декодирование.
+
+    :param data: Содержимое файла оригинала
+    :param size: Размер миниатюры (width, height)
+    :return: Словарь {формат: содержимое файла}
+    """
+
+    (_, img), = iter_thumbnails(BytesIO(data), [size])
+    return {image_format: encode_thumbnail(img, image_format)
+            for image_format in SUPPORTED_THUMBNAIL_FORMATS}
+
+
+def thumbnail_path(instance_id, image_field_name, image_name, size,
+                   image_format=FALLBACK_THUMBNAIL_FORMAT):
+    """
+    Путь миниатюры в хранилище: <поле>/thumbnails/<id>/<размер>_<имя оригинала>.
+    Для форматов, кроме JPEG, расширение имени заменяется на имя формата.
+    Миниатюры оригиналов, сохранённых под хэшем содержимого, общие:
+    thumbnails/<ab>/<хэш>/<размер>.<расширение>.
+
+    :param instance_id: Id объекта модели
+    :param image_field_name: Имя поля с оригинальным изображением
+    :param image_name: Имя файла оригинала в хранилище
+    :param size: Размер миниатюры (width, height)
+    :param image_format: Имя формата из THUMBNAIL_FORMATS
+    :return: Путь к файлу
+    """
+
+    width, height = size
+    digest = content_digest(image_name)
+    if digest:
+        extension = 'jpg' if image_format == FALLBACK_THUMBNAIL_FORMAT else image_format
+        return f'{SHARED_THUMBNAILS_DIR}/{digest[:2]}/{digest}/{width}x{height}.{extension}'
+
+    filename = f'{width}x{height}_{image_name.split("/")[-1]}'
+    if image_format != FALLBACK_THUMBNAIL_FORMAT:
+        filename = f'{filename.rsplit(".", 1)[0]}.{image_format}'
+    return f'{image_field_name}/thumbnails/{instance_id}/{filename}'
+
+
+def get_variants(value):
+    """
+    Варианты одной миниатюры по форматам. Миниатюры, построенные до появления
+    вариантов, хранятся строкой пути к JPEG.
+
+    :param value: Значение из JSON миниатюр для одного размера
+    :return: Словарь {формат: {'path': путь, 'bytes': размер файла}}
+    """
+
+    if isinstance(value, str):
+        return {FALLBACK_THUMBNAIL_FORMAT: {'path': value}} if value else {}
+    return value or {}
+
+
+def iter_thumbnail_paths(thumbnails):
+    """
+    Пути всех файлов миниатюр во всех форматах.
+
+    :param thumbnails: JSON миниатюр объекта
+    :return: Генератор путей
+    """
+
+    for value in (thumbnails or {}).values():
+        for variant in get_variants(value).values():
+            yield variant['path']
+
+
+def thumbnails_up_to_date(instance, image_field_name, thumbnails_field_name, sizes):
+    """
+    Построены ли уже миниатюры всех размеров и форматов для текущего изображения.
 
     :param instance: Объект модели (Product или User)
     :param image_field_name: Имя поля с оригинальным изображением
     :param thumbnails_field_name: Имя поля для хранения путей миниатюр
     :param sizes: Список размеров [(width, height), ...]
-    :return: Словарь с путями миниатюр
+    :return: True, если пути миниатюр соответствуют текущему изображению
     """
 
-    original_image = getattr(instance, image_field_name)
-    if not original_image:
-        return {}
+    image_name = getattr(instance, image_field_name).name
+    if not image_name:
+        return False
 
-    thumbnails = {}
+    expected = {f'{width}x{height}': {image_format: thumbnail_path(instance.id, image_field_name,
+                                                                   image_name, (width, height),
+                                                                   image_format)
+                                      for image_format in SUPPORTED_THUMBNAIL_FORMATS}
+                for width, height in sizes}
+    actual = {size: {image_format: variant['path']
+                     for image_format, variant in get_variants(value).items()}
+              for size, value in getattr(instance, thumbnails_field_name).items()}
+    return actual == expected
 
-    try:
-        img = Image.open(original_image.path)
 
-        for width, height in sizes:
-            try:
-                # Генерация имени файла: размер_оригинальное_имя
-                filename = f'{width}x{height}_{original_image.name.split("/")[-1]}'
-                thumbnail_path = f'{image_field_name}/thumbnails/{instance.id}/{filename}'
+def accepted_image_formats(accept):
+    """
+    Форматы миниатюр, которые клиент явно принимает по заголовку Accept.
+    JPEG считается принимаемым всегда.
 
-                if default_storage.exists(thumbnail_path):
-                    thumbnails[f'{width}x{height}'] = thumbnail_path
-                    continue
+    :param accept: Значение заголовка Accept
+    :return: Множество имён форматов
+    """
+
+    mime_types = {mime_type: name for name, (_, mime_type, _) in THUMBNAIL_FORMATS.items()}
+    accepted = {FALLBACK_THUMBNAIL_FORMAT}
+    for item in (accept or '').split(','):
+        mime_type, *params = item.split(';')
+        name = mime_types.get(mime_type.strip().lower())
+        if not name:
+            continue
+
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(name)
+    return accepted
+
+
+def choose_variant(variants, accepted):
+    """
+    Выбирает самый маленький вариант миниатюры из принимаемых клиентом форматов.
+
+    :param variants: Варианты миниатюры (см. get_variants)
+    :param accepted: Принимаемые форматы (см. accepted_image_formats)
+    :return: (формат, вариант) или (None, None), если подходящего варианта нет
+    """
+
+    candidates = [(variant.get('bytes', float('inf')), image_format != FALLBACK_THUMBNAIL_FORMAT,
+                   image_format)
+                  for image_format, variant in variants.items() if image_format in accepted]
+    if not candidates:
+        return None, None
+    image_format = min(candidates)[2]
+    return image_format, variants[image_format]
+
+
+def thumbnail_variants(path):
+    """
+    Варианты миниатюры в поддерживаемых форматах, лежащие рядом с её JPEG-файлом
+    (имена различаются только расширением, см. thumbnail_path).
+
+    :param path: Путь JPEG-варианта миниатюры в хранилище
+    :return: Словарь {формат: {'path': путь, 'bytes': размер}} существующих файлов
+    """
+
+    storage = get_thumbnail_storage()
+    stem = path.rsplit('.', 1)[0]
+    variants = {}
+    for image_format in SUPPORTED_THUMBNAIL_FORMATS:
+        variant_path = path if image_format == FALLBACK_THUMBNAIL_FORMAT else f'{stem}.{image_format}'
+        try:
+            variants[image_format] = {'path': variant_path, 'bytes': storage.size(variant_path)}
+        except OSError:
+            continue
+    return variants
+
+
+def thumbnails_version(sizes):
+    """
+    Версия набора миниатюр: меняется вместе с набором размеров,
+    форматом и THUMBNAIL_RENDER_VERSION.
+
+    :param sizes: Список размеров [(width, height), ...]
+    :return: Строка версии
+    """
 
-                # Обработка изображения
-                img_copy = img.copy()
-                img_copy.thumbnail((width, height))
+    formats = {name: THUMBNAIL_FORMATS[name] for name in SUPPORTED_THUMBNAIL_FORMATS}
+    key = repr((sorted(tuple(size) for size in sizes), formats, THUMBNAIL_RENDER_VERSION))
+    return hashlib.sha1(key.encode()).hexdigest()[:8]
 
-                # Сохранение в буфер
-                buffer = BytesIO()
-                img_copy.save(buffer, format='JPEG', quality=85, optimize=True)
-                buffer.seek(0)
 
-                # Сохранение миниатюры
-                default_storage.save(thumbnail_path, ContentFile(buffer.getvalue()))
-                thumbnails[f'{width}x{height}'] = thumbnail_path
+def thumbnails_source(data, sizes):
+    """
+    Отпечаток исходных данных миниатюр: версия набора и хэш содержимого оригинала.
+
+    :param data: Содержимое файла оригинала
+    :param sizes: Список размеров [(width, height), ...]
+    :return: Строка вида <версия>:<sha256>
+    """
+
+    return f'{thumbnails_version(sizes)}:{hashlib.sha256(data).hexdigest()}'
+
+
+def save_thumbnails(data, instance_id, image_field_name, image_name, sizes):
+    """
+    Строит миниатюры из содержимого оригинала и сохраняет их в хранилище
+    во всех поддерживаемых форматах за одно декодирование.
+    Ошибка сохранения одного размера или формата не прерывает остальные.
+
+    :param data: Содержимое файла оригинала
+    :param instance_id: Id объекта модели
+    :param image_field_name: Имя поля с оригинальным изображением
+    :param image_name: Имя файла оригинала в хранилище
+    :param sizes: Список размеров [(width, height), ...]
+    :return: Словарь {размер: {формат: {'path': путь, 'bytes': размер файла}}}
+    """
 
+    storage = get_thumbnail_storage()
+    thumbnails = {}
+
+    for (width, height), img in iter_thumbnails(BytesIO(data), sizes):
+        variants = {}
+        for image_format in SUPPORTED_THUMBNAIL_FORMATS:
+            try:
+                path = thumbnail_path(instance_id, image_field_name, image_name,
+                                      (width, height), image_format)
+                content = encode_thumbnail(img, image_format)
+                variants[image_format] = {'path': storage.save(path, ContentFile(content)),
+                                          'bytes': len(content)}
             except Exception:
                 continue
+        if variants:
+            thumbnails[f'{width}x{height}'] = variants
+
+    return thumbnails
+
+
+def generate_and_save_thumbnails(instance, image_field_name, thumbnails_field_name, sizes,
+                                 source_field_name=None):
+    """
+    Универсальная функция для генерации миниатюр
+
+    Оригинал декодируется один раз, миниатюры строятся каскадом
+    (см. iter_thumbnails) и сохраняются с перезаписью существующих файлов.
+
+    :param instance: Объект модели (Product или User)
+    :param image_field_name: Имя поля с оригинальным изображением
+    :param thumbnails_field_name: Имя поля для хранения путей миниатюр
+    :param sizes: Список размеров [(width, height), ...]
+    :param source_field_name: Имя поля для отпечатка оригинала (см. thumbnails_source)
+    :return: Словарь с путями миниатюр
+    """
+
+    original_image = getattr(instance, image_field_name)
+    if not original_image:
+        return {}
+
+    try:
+        # Миниатюры одинаковых изображений строятся один раз и берутся из ImageBlob
+        digest = content_digest(original_image.name)
+        blob = ImageBlob.objects.filter(name=original_image.name).first() if digest else None
+        storage = get_thumbnail_storage()
+        if (blob and blob.thumbnails
+                and blob.thumbnails_source == f'{thumbnails_version(sizes)}:{digest}'
+                and all(storage.exists(path) for path in iter_thumbnail_paths(blob.thumbnails))):
+            thumbnails, source = blob.thumbnails, blob.thumbnails_source
+        else:
+            with original_image.open('rb') as file:
+                data = file.read()
+            thumbnails = save_thumbnails(data, instance.id, image_field_name,
+                                         original_image.name, sizes)
+            source = thumbnails_source(data, sizes)
+            if blob:
+                ImageBlob.objects.filter(id=blob.id).update(thumbnails=thumbnails,
+                                                            thumbnails_source=source)
 
         # Обновление модели
         update_data = {thumbnails_field_name: thumbnails}
-        instance.__class__.objects.filter(id=instance.id).update(**update_data)
+        if source_field_name:
+            update_data[source_field_name] = source
+        instance.__class__.objects.filter(id=instance.id).invalidated_update(**update_data)
 
         return thumbnails
     except Exception:
         return {}
+
+
+def process_image(instance, target):
+    """
+    Обрабатывает загруженный оригинал, если он ещё не обработан,
+    строит миниатюры и отмечает изображение готовым.
+
+    :param instance: Экземпляр модели
+    :param target: Описание поля изображения (ThumbnailTarget)
+    :return: Словарь миниатюр или None, если изображение уже заменено
+    :raises ValueError: Если оригинал не удалось обработать
+    """
+
+    model = target.model
+    state = getattr(instance, target.state_field_name)
+    if state == 'processing':
+        raw_name = getattr(instance, target.image_field_name).name
+        try:
+            if not process_original(instance, target):
+                return None
+        except Exception:
+            model.objects.filter(id=instance.id, **{target.image_field_name: raw_name})\
+                .invalidated_update(**{target.state_field_name: 'failed'})
+            raise ValueError('Не удалось обработать изображение')
+
+    thumbnails = generate_and_save_thumbnails(instance, target.image_field_name,
+                                              target.thumbnails_field_name, target.sizes,
+                                              target.source_field_name)
+    if state != 'ready':
+        image_name = getattr(instance, target.image_field_name).name
+        model.objects.filter(id=instance.id, **{target.image_field_name: image_name})\
+            .invalidated_update(**{target.state_field_name: 'ready'})
+    return thumbnails
+
+
+def backfill_job(job, image_field_name, sizes, force=False):
+    """
+    Перестраивает миниатюры одного объекта, если изменился оригинал,
+    набор размеров или пропали файлы миниатюр. Выполняется в пуле процессов.
+
+    :param job: Данные объекта (ThumbnailJob)
+    :param image_field_name: Имя поля с оригинальным изображением
+    :param sizes: Список размеров [(width, height), ...]
+    :param force: Перестроить без проверки актуальности
+    :return: (id, миниатюры, отпечаток); миниатюры None, если перестраивать не нужно,
+             и отпечаток None, если оригинал не удалось прочитать
+    """
+
+    try:
+        with default_storage.open(job.image_name, 'rb') as file:
+            data = file.read()
+        source = thumbnails_source(data, sizes)
+
+        storage = get_thumbnail_storage()
+        if (not force and source == job.source and len(job.thumbnails) == len(sizes)
+                and all(storage.exists(path) for path in iter_thumbnail_paths(job.thumbnails))):
+            return job.id, None, source
+
+        return job.id, save_thumbnails(data, job.id, image_field_name, job.image_name, sizes), source
+    except Exception:
+        return job.id, None, None
+
+
+def image_job_key(job):
+    """Ключ, по которому одинаковые изображения обрабатываются один раз."""
+
+    return job.image_name if content_digest(job.image_name) else job.id
+
+
+def backfill_thumbnails(target, workers=None, force=False, batch_size=THUMBNAIL_BATCH_SIZE):
+    """
+    Массово перестраивает миниатюры всех объектов модели с изображением.
+    Объекты загружаются порциями по id, изображения обрабатываются
+    в пуле процессов, результаты записываются через bulk_update.
+
+    :param target: Описание поля изображения (ThumbnailTarget)
+    :param workers: Количество процессов (по умолчанию по числу ядер, 1 - без пула)
+    :param force: Перестроить миниатюры без проверки актуальности
+    :param batch_size: Количество объектов в порции
+    :return: Словарь со счётчиками updated, skipped, failed
+    """
+
+    model = target.model
+    fields = ('id', target.image_field_name, target.thumbnails_field_name, target.source_field_name)
+    queryset = (model.objects.nocache()
+                .exclude(**{f'{target.image_field_name}__isnull': True})
+                .exclude(**{target.image_field_name: ''})
+                .order_by('id'))
+    render = partial(backfill_job, image_field_name=target.image_field_name,
+                     sizes=target.sizes, force=force)
+    stats = {'updated': 0, 'skipped': 0, 'failed': 0}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+
+    try:
+        last_id = 0
+        while True:
+            jobs = [ThumbnailJob(*row) for row in
+                    queryset.filter(id__gt=last_id).values_list(*fields)[:batch_size]]
+            if not jobs:
+                break
+            last_id = jobs[-1].id
+
+            # Одинаковые изображения обрабатываются один раз на порцию
+            # (миниатюры общие только у файлов из адресуемого по содержимому хранилища)
+            unique_jobs = list({image_job_key(job): job for job in reversed(jobs)}.values())
+            results = (executor.map(render, unique_jobs, chunksize=16) if executor
+                       else map(render, unique_jobs))
+            rendered = {image_job_key(job): (job, thumbnails, source)
+                        for job, (_, thumbnails, source) in zip(unique_jobs, results)}
+
+            updated = []
+            for job in jobs:
+                rendered_job, thumbnails, source = rendered[image_job_key(job)]
+                if source is None:
+                    stats['failed'] += 1
+                    continue
+                if thumbnails is None:
+                    thumbnails = rendered_job.thumbnails
+                    if job.source == source and job.thumbnails == thumbnails:
+                        stats['skipped'] += 1
+                        continue
+                updated.append(model(**{'id': job.id,
+                                        target.thumbnails_field_name: thumbnails,
+                                        target.source_field_name: source}))
+
+            if updated:
+                model.objects.bulk_update(updated, [target.thumbnails_field_name,
+                                                    target.source_field_name])
+                stats['updated'] += len(updated)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    if stats['updated']:
+        invalidate_model(model)
+    return stats
+
+
+def acquire_image(name):
+    """
+    Увеличивает количество ссылок на файл изображения из адресуемого
+    по содержимому хранилища.
+
+    :param name: Имя файла в хранилище
+    """
+
+    if not content_digest(name):
+        return
+
+    updated = ImageBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1,
+                                                         updated_at=timezone.now())
+    if not updated:
+        try:
+            with transaction.atomic():
+                ImageBlob.objects.create(name=name, ref_count=1)
+        except IntegrityError:
+            # Запись одновременно создал другой процесс
+            ImageBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1,
+                                                       updated_at=timezone.now())
+
+
+def release_image(name):
+    """
+    Уменьшает количество ссылок на файл изображения. Файл без ссылок
+    удаляется задачей collect_unused_images через IMAGE_GC_DELAY.
+
+    :param name: Имя файла в хранилище
+    """
+
+    if not content_digest(name):
+        return
+
+    ImageBlob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1,
+                                                                updated_at=timezone.now())
+
+
+def collect_unused_images(batch_size=THUMBNAIL_BATCH_SIZE):
+    """
+    Удаляет файлы изображений без ссылок дольше IMAGE_GC_DELAY
+    вместе с их общими миниатюрами.
+
+    :param batch_size: Количество файлов, удаляемых за одну транзакцию
+    :return: Количество удалённых файлов изображений
+    """
+
+    storage = get_image_storage()
+    thumbnail_storage = get_thumbnail_storage()
+    removed = 0
+
+    while True:
+        threshold = timezone.now() - timedelta(seconds=settings.IMAGE_GC_DELAY)
+        with transaction.atomic():
+            blobs = list(ImageBlob.objects.select_for_update(skip_locked=True)
+                         .filter(ref_count=0, updated_at__lt=threshold)
+                         .order_by('updated_at')[:batch_size])
+            if not blobs:
+                break
+
+            # Строки заблокированы с проверкой ref_count=0: до конца транзакции
+            # на эти файлы не появятся новые ссылки (см. ContentAddressedStorage.save)
+            for blob in blobs:
+                storage.delete(blob.name)
+                digest = content_digest(blob.name)
+                directory = f'{SHARED_THUMBNAILS_DIR}/{digest[:2]}/{digest}'
+                if thumbnail_storage.exists(directory):
+                    for filename in thumbnail_storage.listdir(directory)[1]:
+                        thumbnail_storage.delete(f'{directory}/{filename}')
+            ImageBlob.objects.filter(id__in=[blob.id for blob in blobs]).delete()
+        removed += len(blobs)
+
+    return removed
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from backend.image_utils import THUMBNAIL_BATCH_SIZE, THUMBNAIL_TARGETS, backfill_thumbnails
+
+
+class Command(BaseCommand):
+    """Массовая генерация миниатюр товаров и аватаров без постановки задач Celery."""
+
+    help = ('Перестраивает миниатюры товаров и аватаров, у которых изменился оригинал,'
+            ' набор размеров или пропали файлы миниатюр')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=[*THUMBNAIL_TARGETS, 'all'], default='all',
+                            help='Модель, миниатюры которой нужно перестроить')
+        parser.add_argument('--workers', type=int,
+                            help='Количество процессов (по умолчанию по числу ядер)')
+        parser.add_argument('--batch-size', type=int, default=THUMBNAIL_BATCH_SIZE,
+                            help='Количество объектов, загружаемых из БД за раз')
+        parser.add_argument('--force', action='store_true',
+                            help='Перестроить все миниатюры без проверки актуальности')
+
+    def handle(self, *args, **options):
+        names = list(THUMBNAIL_TARGETS) if options['model'] == 'all' else [options['model']]
+
+        for name in names:
+            started = time.monotonic()
+            stats = backfill_thumbnails(THUMBNAIL_TARGETS[name], workers=options['workers'],
+                                        force=options['force'],
+                                        batch_size=options['batch_size'])
+            elapsed = time.monotonic() - started
+            count = sum(stats.values())
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: обновлено {stats["updated"]}, актуальных {stats["skipped"]},'
+                f' ошибок {stats["failed"]} за {elapsed:.1f} с'
+                f' ({count / elapsed if elapsed else 0:.0f} изображений в секунду)'
+            ))
@@ -0,0 +1,91 @@
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from django.core.management.base import BaseCommand
+from PIL import Image
+from backend.image_utils import SUPPORTED_THUMBNAIL_FORMATS, encode_thumbnail, iter_thumbnails
+
+DEFAULT_SIZES = [(400, 400), (200, 200), (100, 100)]
+
+
+def legacy_thumbnails(data, sizes):
+    """Прежний способ: копия полноразмерного изображения на каждый размер."""
+
+    img = Image.open(BytesIO(data))
+    for size in sizes:
+        img_copy = img.copy()
+        img_copy.thumbnail(size)
+        encode_thumbnail(img_copy)
+
+
+def cascade_thumbnails(data, sizes):
+    """Текущий способ: однократное уменьшенное декодирование и каскад."""
+
+    for _, img in iter_thumbnails(BytesIO(data), sizes):
+        encode_thumbnail(img)
+
+
+def measure(method, data, sizes, repeat):
+    """
+    Выполняется в отдельном процессе, чтобы пик памяти не зависел
+    от предыдущих замеров.
+
+    :return: (процессорное время на изображение в мс, прирост пика памяти в КБ)
+    """
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.process_time()
+    for _ in range(repeat):
+        method(data, sizes)
+    cpu_ms = (time.process_time() - started) * 1000 / repeat
+    return cpu_ms, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss
+
+
+class Command(BaseCommand):
+    """Сравнение затрат CPU и памяти на построение миниатюр одного изображения."""
+
+    help = 'Сравнивает прежнюю и каскадную генерацию миниатюр по CPU и памяти на изображение'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', help='Путь к изображению (по умолчанию синтетический JPEG)')
+        parser.add_argument('--width', type=int, default=4000,
+                            help='Ширина синтетического изображения')
+        parser.add_argument('--height', type=int, default=3000,
+                            help='Высота синтетического изображения')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов')
+
+    def handle(self, *args, **options):
+        if options['image']:
+            with open(options['image'], 'rb') as file:
+                data = file.read()
+        else:
+            buffer = BytesIO()
+            noise = Image.effect_noise((options['width'], options['height']), 64)
+            noise.convert('RGB').save(buffer, format='JPEG', quality=90)
+            data = buffer.getvalue()
+
+        results = {}
+        context = multiprocessing.get_context('fork')
+        for name, method in (('прежний', legacy_thumbnails), ('каскадный', cascade_thumbnails)):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[name] = executor.submit(measure, method, data, DEFAULT_SIZES,
+                                                options['repeat']).result()
+            cpu_ms, memory_kb = results[name]
+            self.stdout.write(f'{name}: CPU {cpu_ms:.1f} мс, пик памяти +{memory_kb / 1024:.1f} МБ')
+
+        (old_cpu, old_memory), (new_cpu, new_memory) = results.values()
+        self.stdout.write(self.style.SUCCESS(
+            f'Экономия на изображение: CPU {old_cpu - new_cpu:.1f} мс'
+            f' ({old_cpu / new_cpu if new_cpu else 0:.1f}x),'
+            f' память {(old_memory - new_memory) / 1024:.1f} МБ'
+        ))
+
+        totals = dict.fromkeys(SUPPORTED_THUMBNAIL_FORMATS, 0)
+        for _, img in iter_thumbnails(BytesIO(data), DEFAULT_SIZES):
+            for image_format in totals:
+                totals[image_format] += len(encode_thumbnail(img, image_format))
+        self.stdout.write('Размер миниатюр на изображение: ' + ', '.join(
+            f'{image_format} {total / 1024:.1f} КБ' for image_format, total in totals.items()
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from backend.media_utils import MEDIA_GC_BATCH_SIZE, collect_orphaned_media
+
+
+class Command(BaseCommand):
+    """Удаление файлов изображений и миниатюр, на которые не ссылается БД."""
+
+    help = ('Удаляет из MEDIA_ROOT заменённые оригиналы и устаревшие миниатюры,'
+            ' на которые не ссылается БД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=MEDIA_GC_BATCH_SIZE,
+                            help='Количество файлов, удаляемых за один проход')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только подсчитать файлы без ссылок')
+
+    def handle(self, *args, **options):
+        stats = collect_orphaned_media(batch_size=options['batch_size'],
+                                       dry_run=options['dry_run'])
+
+        action = 'найдено' if options['dry_run'] else 'удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Просмотрено файлов: {stats["scanned"]}, {action} без ссылок: {stats["deleted"]}'
+            f' ({stats["bytes"] / 1024 / 1024:.1f} МБ)'
+        ))
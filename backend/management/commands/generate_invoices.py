@@ -0,0 +1,47 @@
+import time
+from datetime import date
+from tempfile import NamedTemporaryFile
+from django.core.management.base import BaseCommand, CommandError
+from backend.excel_utils import invoice_orders_queryset, write_invoices_archive
+from backend.export_utils import save_export_artifact
+
+
+class Command(BaseCommand):
+    """Пакетное формирование накладных за период или по магазину в ZIP-архив."""
+
+    help = 'Формирует накладные по заказам за период и/или магазина и сохраняет их в ZIP-архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=date.fromisoformat,
+                            help='Начало периода (ГГГГ-ММ-ДД)')
+        parser.add_argument('--date-to', type=date.fromisoformat,
+                            help='Конец периода включительно (ГГГГ-ММ-ДД)')
+        parser.add_argument('--shop', type=int, help='ID магазина')
+        parser.add_argument('--workers', type=int,
+                            help='Количество процессов (по умолчанию по числу ядер)')
+        parser.add_argument('--output',
+                            help='Путь к ZIP-файлу (по умолчанию архив сохраняется в хранилище)')
+
+    def handle(self, *args, **options):
+        if not (options['date_from'] or options['date_to'] or options['shop']):
+            raise CommandError('Укажите период (--date-from/--date-to) и/или магазин (--shop)')
+
+        filters = {'date_from': options['date_from'] and options['date_from'].isoformat(),
+                   'date_to': options['date_to'] and options['date_to'].isoformat(),
+                   'shop_id': options['shop']}
+        order_ids = invoice_orders_queryset(filters).values_list('id', flat=True).distinct()
+
+        started = time.monotonic()
+        if options['output']:
+            count = write_invoices_archive(order_ids, options['output'], options['workers'])
+            path = options['output']
+        else:
+            with NamedTemporaryFile() as archive:
+                count = write_invoices_archive(order_ids, archive, options['workers'])
+                path = save_export_artifact(archive, 'zip', name='invoices')['path']
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Сформировано накладных: {count} за {elapsed:.1f} с'
+            f' ({count / elapsed if elapsed else 0:.0f} в секунду). Архив: {path}'
+        ))
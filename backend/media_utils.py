@@ -0,0 +1,178 @@
+import os
+import time
+from django.conf import settings
+from django.db import connection
+from backend.image_utils import SHARED_THUMBNAILS_DIR, THUMBNAIL_TARGETS
+from backend.models import ImageBlob
+
+# Количество файлов, удаляемых за один проход, и строк, читаемых из курсора за раз
+MEDIA_GC_BATCH_SIZE = 1000
+
+
+def image_media_directories():
+    """
+    Каталоги MEDIA_ROOT с изображениями, на которые ссылается БД: оригиналы,
+    миниатюры объектов и общие миниатюры. Эти файлы публичные; остальные
+    каталоги (экспорт, накладные) сборщик не просматривает, а media_view
+    отдаёт только персоналу.
+
+    :return: Отсортированный список относительных путей с '/' на конце
+    """
+
+    directories = {f'{SHARED_THUMBNAILS_DIR}/'}
+    for target in THUMBNAIL_TARGETS.values():
+        directories.add(target.model._meta.get_field(target.image_field_name).upload_to)
+        directories.add(f'{target.image_field_name}/thumbnails/')
+    return sorted(directories)
+
+
+def thumbnail_paths_sql(table, column):
+    """
+    Запрос путей миниатюр из JSON-поля. Миниатюры в старом формате
+    хранят путь строкой, в новом - словарём форматов.
+    """
+
+    return f"""
+            SELECT CASE jsonb_typeof(size.value)
+                       WHEN 'string' THEN size.value #>> '{{}}'
+                       ELSE variant.value ->> 'path'
+                   END
+            FROM {table}
+            CROSS JOIN LATERAL jsonb_each({column}) AS size
+            LEFT JOIN LATERAL jsonb_each(
+                CASE jsonb_typeof(size.value) WHEN 'object' THEN size.value END
+            ) AS variant ON TRUE"""
+
+
+def referenced_media_sql():
+    """
+    Запрос всех путей файлов, на которые ссылается БД, в порядке байтов
+    (COLLATE "C" совпадает с порядком сравнения строк в Python).
+    Общие миниатюры ImageBlob учитываются, пока запись существует:
+    они переиспользуются при повторной загрузке того же изображения.
+    """
+
+    blobs = ImageBlob._meta
+    queries = [f'SELECT name AS path FROM {blobs.db_table}',
+               thumbnail_paths_sql(blobs.db_table, blobs.get_field('thumbnails').column)]
+    for target in THUMBNAIL_TARGETS.values():
+        meta = target.model._meta
+        image = meta.get_field(target.image_field_name).column
+        thumbnails = meta.get_field(target.thumbnails_field_name).column
+        queries.append(f"SELECT {image} FROM {meta.db_table} WHERE {image} <> ''")
+        queries.append(thumbnail_paths_sql(meta.db_table, thumbnails))
+
+    union = '\n    UNION ALL '.join(queries)
+    return f"""
+    SELECT path FROM ({union}) AS referenced
+    WHERE path IS NOT NULL
+    ORDER BY path COLLATE "C"
+"""
+
+
+REFERENCED_MEDIA_SQL = referenced_media_sql()
+
+
+def iter_referenced_media(chunk_size=MEDIA_GC_BATCH_SIZE):
+    """
+    Пути файлов, на которые ссылается БД, по возрастанию.
+    Строки читаются серверным курсором порциями, а не загружаются целиком.
+
+    :return: Генератор путей (возможны повторы)
+    """
+
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(REFERENCED_MEDIA_SQL)
+        while rows := cursor.fetchmany(chunk_size):
+            for path, in rows:
+                yield path
+
+
+def iter_media_files(root, directories):
+    """
+    Файлы каталогов directories внутри root по возрастанию относительного пути.
+    Записи каталога сортируются по имени с '/' для подкаталогов, поэтому порядок
+    совпадает с порядком полных путей; в памяти хранится только текущий каталог.
+
+    :param root: Корневой каталог (MEDIA_ROOT)
+    :param directories: Отсортированные относительные пути каталогов с '/' на конце
+    :return: Генератор (относительный путь, os.stat_result)
+    """
+
+    def walk(path, prefix):
+        try:
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            return
+        entries.sort(key=lambda entry: entry.name + '/' if entry.is_dir(follow_symlinks=False)
+                     else entry.name)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path, f'{prefix}{entry.name}/')
+            elif entry.is_file(follow_symlinks=False):
+                yield f'{prefix}{entry.name}', entry.stat(follow_symlinks=False)
+
+    for directory in directories:
+        yield from walk(os.path.join(root, directory), directory)
+
+
+def iter_orphaned_media(files, referenced):
+    """
+    Разность двух отсортированных потоков: файлы, которых нет среди путей из БД.
+
+    :param files: Генератор (путь, stat) по возрастанию пути
+    :param referenced: Генератор путей из БД по возрастанию
+    :return: Генератор (путь, stat) файлов без ссылок
+    """
+
+    current = next(referenced, None)
+    for path, stat in files:
+        while current is not None and current < path:
+            current = next(referenced, None)
+        if current != path:
+            yield path, stat
+
+
+def collect_orphaned_media(batch_size=MEDIA_GC_BATCH_SIZE, dry_run=False):
+    """
+    Удаляет из MEDIA_ROOT файлы изображений и миниатюр, на которые не ссылается БД:
+    заменённые оригиналы и миниатюры прежних изображений и наборов размеров.
+    Файлы моложе IMAGE_GC_DELAY не удаляются: ссылка на них может быть
+    ещё не сохранена.
+
+    :param batch_size: Количество файлов, удаляемых за один проход
+    :param dry_run: Только подсчитать файлы без ссылок
+    :return: Словарь со счётчиками scanned, deleted и bytes (освобождённый объём)
+    """
+
+    root = settings.MEDIA_ROOT
+    stats = {'scanned': 0, 'deleted': 0, 'bytes': 0}
+    created_before = time.time() - settings.IMAGE_GC_DELAY
+
+    def scanned(files):
+        for item in files:
+            stats['scanned'] += 1
+            yield item
+
+    def delete(batch):
+        for path, size in batch:
+            if not dry_run:
+                try:
+                    os.remove(os.path.join(root, path))
+                except FileNotFoundError:
+                    continue
+            stats['deleted'] += 1
+            stats['bytes'] += size
+
+    files = scanned(iter_media_files(root, image_media_directories()))
+    batch = []
+    for path, stat in iter_orphaned_media(files, iter_referenced_media(batch_size)):
+        if stat.st_mtime >= created_before:
+            continue
+        batch.append((path, stat.st_size))
+        if len(batch) >= batch_size:
+            delete(batch)
+            batch = []
+    delete(batch)
+
+    return stats
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+FILL_PRICES_AND_TOTALS_SQL = """
+    UPDATE backend_orderitem AS item
+    SET price = product_info.price
+    FROM backend_productinfo AS product_info
+    WHERE item.product_info_id = product_info.id;
+
+    UPDATE backend_order AS ord
+    SET total_sum = totals.total_sum,
+        shop_totals = totals.shop_totals
+    FROM (
+        SELECT order_id,
+               SUM(shop_total) AS total_sum,
+               jsonb_object_agg(shop_id::text, shop_total) AS shop_totals
+        FROM (
+            SELECT item.order_id,
+                   product_info.shop_id,
+                   SUM(item.quantity * item.price) AS shop_total
+            FROM backend_orderitem AS item
+            JOIN backend_productinfo AS product_info
+                ON product_info.id = item.product_info_id
+            GROUP BY item.order_id, product_info.shop_id
+        ) AS per_shop
+        GROUP BY order_id
+    ) AS totals
+    WHERE ord.id = totals.order_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_product_image_product_thumbnails_user_avatar_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(default=0, verbose_name='Цена'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='Общая сумма'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='shop_totals',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Суммы по магазинам'),
+        ),
+        migrations.RunSQL(FILL_PRICES_AND_TOTALS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-19 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+SPLIT_PLACED_ORDERS_SQL = """
+    INSERT INTO backend_shoporder (order_id, shop_id, dt, total_sum)
+    SELECT item.order_id,
+           product_info.shop_id,
+           ord.dt,
+           SUM(item.quantity * item.price)
+    FROM backend_orderitem AS item
+    JOIN backend_productinfo AS product_info
+        ON product_info.id = item.product_info_id
+    JOIN backend_order AS ord ON ord.id = item.order_id
+    WHERE ord.state <> 'basket'
+    GROUP BY item.order_id, product_info.shop_id, ord.dt;
+
+    UPDATE backend_orderitem AS item
+    SET shop_order_id = shop_order.id
+    FROM backend_productinfo AS product_info, backend_shoporder AS shop_order
+    WHERE product_info.id = item.product_info_id
+      AND shop_order.order_id = item.order_id
+      AND shop_order.shop_id = product_info.shop_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_orderitem_price_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dt', models.DateTimeField(auto_now_add=True, verbose_name='Дата оформления')),
+                ('total_sum', models.PositiveIntegerField(default=0, verbose_name='Сумма по магазину')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='backend.order', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Поставка магазина',
+                'verbose_name_plural': 'Список поставок магазинов',
+                'ordering': ('-dt',),
+                'indexes': [models.Index(fields=['shop', '-dt'], name='shop_order_shop_dt_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'shop'), name='unique_shop_order')],
+            },
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='items', to='backend.shoporder', verbose_name='Поставка магазина'),
+        ),
+        migrations.RunSQL(SPLIT_PLACED_ORDERS_SQL, migrations.RunSQL.noop),
+    ]
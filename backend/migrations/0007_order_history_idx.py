@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-19 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0006_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('state', 'basket'), _negated=True), fields=['user', '-dt', '-id'], name='order_history_idx'),
+        ),
+    ]
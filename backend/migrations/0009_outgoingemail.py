@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_productinfo_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to', models.EmailField(max_length=254, verbose_name='Получатель')),
+                ('from_email', models.CharField(blank=True, max_length=254, verbose_name='Отправитель')),
+                ('subject', models.CharField(max_length=255, verbose_name='Тема')),
+                ('body', models.TextField(verbose_name='Текст письма')),
+                ('attachment', models.FileField(blank=True, null=True, upload_to='outbox', verbose_name='Вложение')),
+                ('attachment_name', models.CharField(blank=True, max_length=255, verbose_name='Имя вложения')),
+                ('coalesce_key', models.CharField(blank=True, default='', max_length=100, verbose_name='Ключ объединения')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sent', 'Отправлено'), ('failed', 'Ошибка отправки')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток отправки')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('send_after', models.DateTimeField(verbose_name='Отправить после')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+            ],
+            options={
+                'verbose_name': 'Исходящее письмо',
+                'verbose_name_plural': 'Очередь исходящих писем',
+                'ordering': ('id',),
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['send_after', 'id'], name='outbox_pending_idx'), models.Index(condition=models.Q(('status', 'pending')), fields=['to', 'coalesce_key'], name='outbox_coalesce_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:00
+
+import backend.image_storage
+import imagekit.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_thumbnails_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('thumbnails', models.JSONField(default=dict, editable=False)),
+                ('thumbnails_source', models.CharField(blank=True, editable=False, max_length=80)),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+                'ordering': ('id',),
+                'indexes': [models.Index(condition=models.Q(('ref_count', 0)), fields=['updated_at'], name='imageblob_unused_idx')],
+            },
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=imagekit.models.fields.ProcessedImageField(blank=True, null=True, storage=backend.image_storage.get_image_storage, upload_to='products/', verbose_name='Изображение товара'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=imagekit.models.fields.ProcessedImageField(blank=True, null=True, storage=backend.image_storage.get_image_storage, upload_to='avatars/', verbose_name='Аватар'),
+        ),
+    ]
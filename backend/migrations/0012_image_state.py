@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:00
+
+import backend.image_storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_imageblob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=backend.image_storage.get_image_storage, upload_to='products/', verbose_name='Изображение товара'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=backend.image_storage.get_image_storage, upload_to='avatars/', verbose_name='Аватар'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_state',
+            field=models.CharField(choices=[('processing', 'Обрабатывается'), ('ready', 'Готово'), ('failed', 'Ошибка обработки')], default='ready', editable=False, max_length=10, verbose_name='Состояние изображения'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar_state',
+            field=models.CharField(choices=[('processing', 'Обрабатывается'), ('ready', 'Готово'), ('failed', 'Ошибка обработки')], default='ready', editable=False, max_length=10, verbose_name='Состояние аватара'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_image_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_source',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+    ]
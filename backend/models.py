@@ -1,12 +1,11 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.core.files.storage import default_storage
 from django.db import models
+from django.db.models import Case, F, Sum, When
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
-from imagekit.models import ProcessedImageField
-from pilkit.processors import ResizeToFit
+from backend.image_storage import get_image_storage
 
 STATE_CHOICES = (
     ('basket', 'Статус корзины'),
@@ -18,6 +17,29 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+# Допустимые переходы между статусами заказа
+ORDER_TRANSITIONS = {
+    'new': ('confirmed', 'canceled'),
+    'confirmed': ('assembled', 'canceled'),
+    'assembled': ('sent', 'canceled'),
+    'sent': ('delivered',),
+    'delivered': (),
+    'canceled': (),
+}
+
+EMAIL_STATUS_CHOICES = (
+    ('pending', 'Ожидает отправки'),
+    ('sending', 'Отправляется'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Ошибка отправки'),
+)
+
+IMAGE_STATE_CHOICES = (
+    ('processing', 'Обрабатывается'),
+    ('ready', 'Готово'),
+    ('failed', 'Ошибка обработки'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -25,6 +47,69 @@ USER_TYPE_CHOICES = (
 )
 
 
+class ImageChangeTrackingMixin:
+    """
+    Запоминает имена файлов изображений в момент загрузки из БД и после
+    каждого сохранения, чтобы обработчики post_save могли определить,
+    изменилось ли изображение, без повторного запроса к БД.
+
+    tracked_image_fields - словарь {поле изображения: поле состояния обработки}.
+    Новое изображение сохраняется как есть и получает состояние processing,
+    пока задача Celery не обработает оригинал и не построит миниатюры.
+    """
+
+    tracked_image_fields = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_image_names()
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        for field_name, state_field_name in self.tracked_image_fields.items():
+            if update_fields is not None and field_name not in update_fields:
+                continue
+            if self.image_changed(field_name):
+                setattr(self, state_field_name,
+                        'processing' if getattr(self, field_name) else 'ready')
+                if update_fields is not None:
+                    kwargs['update_fields'] = [*kwargs['update_fields'], state_field_name]
+        super().save(*args, **kwargs)
+        self.remember_image_names()
+
+    def remember_image_names(self):
+        deferred = self.get_deferred_fields()
+        self._saved_image_names = {name: getattr(self, name).name or None
+                                   for name in self.tracked_image_fields
+                                   if name not in deferred}
+
+    def previous_image_name(self, field_name):
+        """
+        Имя файла изображения на момент загрузки или последнего сохранения.
+
+        :param field_name: Имя поля изображения
+        :return: Имя файла или None
+        """
+
+        return getattr(self, '_saved_image_names', {}).get(field_name)
+
+    def image_changed(self, field_name):
+        """
+        Изменилось ли изображение с момента загрузки или последнего сохранения.
+
+        :param field_name: Имя поля изображения
+        :return: True, если имя файла отличается от сохранённого
+        """
+
+        current = getattr(self, field_name).name or None
+        saved_names = getattr(self, '_saved_image_names', {})
+        if field_name not in saved_names:
+            return current is not None
+        return saved_names[field_name] != current
+
+
 class UserManager(BaseUserManager):
     """Миксин для управления пользователями."""
 
@@ -66,10 +151,11 @@ class UserManager(BaseUserManager):
         return self._create_user(email, password, **extra_fields)
 
 
-class User(AbstractUser):
+class User(ImageChangeTrackingMixin, AbstractUser):
     """Кастомная модель пользователя с email-авторизацией."""
 
     REQUIRED_FIELDS = []
+    tracked_image_fields = {'avatar': 'avatar_state'}
     objects = UserManager()
     USERNAME_FIELD = 'email'
     email = models.EmailField(_('email address'), unique=True)
@@ -97,19 +183,25 @@ class User(AbstractUser):
                             choices=USER_TYPE_CHOICES,
                             max_length=5,
                             default='buyer')
-    avatar = ProcessedImageField(upload_to='avatars/',
-                                 blank=True,
-                                 null=True,
-                                 processors=[ResizeToFit(500, 500)],
-                                 format='JPEG',
-                                 verbose_name='Аватар',
-                                 options={'quality': 85})
+    # Загруженный файл сохраняется как есть, уменьшается задачей generate_user_thumbnails
+    avatar = models.ImageField(upload_to='avatars/',
+                               storage=get_image_storage,
+                               blank=True,
+                               null=True,
+                               verbose_name='Аватар')
+    avatar_state = models.CharField(verbose_name='Состояние аватара',
+                                    choices=IMAGE_STATE_CHOICES,
+                                    max_length=10,
+                                    default='ready',
+                                    editable=False)
     avatar_thumbnails = models.JSONField(default=dict, editable=False)
+    # Версия набора размеров и хэш оригинала, из которого построены миниатюры
+    avatar_thumbnails_source = models.CharField(max_length=80, blank=True, editable=False)
 
     def clear_thumbnails(self):
+        """Сбрасывает миниатюры аватара; файлы удаляет collect_orphaned_media."""
+
         if self.avatar_thumbnails:
-            for path in self.avatar_thumbnails.values():
-                default_storage.delete(path)
             self.avatar_thumbnails = {}
             self.save(update_fields=['avatar_thumbnails'])
 
@@ -162,31 +254,40 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(ImageChangeTrackingMixin, models.Model):
     """
     Модель продукта, которая содержит основную информацию
     о продукте и связь с категорией.
     """
 
     objects = models.manager.Manager()
+    tracked_image_fields = {'image': 'image_state'}
     name = models.CharField(max_length=80, verbose_name='Название')
     category = models.ForeignKey(Category, verbose_name='Категория',
                                  related_name='products', blank=True,
                                  on_delete=models.CASCADE)
-    image = ProcessedImageField(upload_to='products/',
-                                blank=True,
-                                null=True,
-                                processors=[ResizeToFit(width=800, height=800)],
-                                format='JPEG',
-                                options={'quality': 85},
-                                verbose_name='Изображение товара')
+    # Загруженный файл сохраняется как есть, уменьшается задачей generate_product_thumbnails
+    image = models.ImageField(upload_to='products/',
+                              storage=get_image_storage,
+                              blank=True,
+                              null=True,
+                              verbose_name='Изображение товара')
+    image_state = models.CharField(verbose_name='Состояние изображения',
+                                   choices=IMAGE_STATE_CHOICES,
+                                   max_length=10,
+                                   default='ready',
+                                   editable=False)
     thumbnails = models.JSONField(default=dict, editable=False)
+    # Версия набора размеров и хэш оригинала, из которого построены миниатюры
+    thumbnails_source = models.CharField(max_length=80, blank=True, editable=False)
+    # Ссылка из прайса партнёра, ETag и Last-Modified ответа и sha256 загруженного файла
+    image_source = models.JSONField(default=dict, editable=False)
 
     def clear_products_thumbnails(self):
+        """Сбрасывает миниатюры товара; файлы удаляет collect_orphaned_media."""
+
         if self.thumbnails:
-            for path in self.thumbnails.values():
-                default_storage.delete(path)
-            self.avatar_thumbnails = {}
+            self.thumbnails = {}
             self.save(update_fields=['thumbnails'])
 
     class Meta:
@@ -216,6 +317,7 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'Информация о продукте'
@@ -299,19 +401,110 @@ class Order(models.Model):
                              related_name='orders', blank=True,
                              on_delete=models.CASCADE)
     dt = models.DateTimeField(auto_now_add=True, verbose_name='Дата заказа')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True,
+                                      verbose_name='Дата изменения')
     state = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=15)
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    total_sum = models.PositiveIntegerField(verbose_name='Общая сумма', default=0)
+    shop_totals = models.JSONField(verbose_name='Суммы по магазинам',
+                                   default=dict, editable=False)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказ"
         ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['user', '-dt', '-id'],
+                         condition=~models.Q(state='basket'),
+                         name='order_history_idx'),
+        ]
 
     def __str__(self):
         return str(self.dt)
 
+    def update_totals(self):
+        """
+        Пересчитывает общую сумму заказа и суммы по магазинам
+        по зафиксированным в позициях ценам. У оформленного заказа
+        обновляются и суммы поставок (ShopOrder); в ленту магазинов
+        они попадают через сигнал сохранения заказа.
+        Вызывается один раз после изменения позиций (корзина, админ-панель),
+        а не при сохранении каждой позиции.
+        """
+
+        rows = OrderItem.objects.filter(order_id=self.id).values(
+            'product_info__shop_id'
+        ).annotate(
+            total=Sum(F('quantity') * F('price'))
+        ).order_by()
+
+        self.shop_totals = {str(row['product_info__shop_id']): row['total']
+                            for row in rows}
+        self.total_sum = sum(self.shop_totals.values())
+        self.save(update_fields=['total_sum', 'shop_totals'])
+
+        if self.state != 'basket':
+            ShopOrder.objects.filter(order_id=self.id).invalidated_update(
+                total_sum=Case(*(When(shop_id=int(shop_id), then=total)
+                                 for shop_id, total in self.shop_totals.items()),
+                               default=0)
+            )
+
+    def split_by_shops(self):
+        """
+        Разбивает оформленный заказ на поставки по магазинам
+        и привязывает к ним позиции заказа.
+
+        :return: Список созданных поставок (ShopOrder)
+        """
+
+        shop_orders = ShopOrder.objects.bulk_create([
+            ShopOrder(order=self, shop_id=int(shop_id), total_sum=total)
+            for shop_id, total in self.shop_totals.items()
+        ])
+        for shop_order in shop_orders:
+            OrderItem.objects.filter(
+                order_id=self.id,
+                product_info__shop_id=shop_order.shop_id
+            ).invalidated_update(shop_order=shop_order)
+        return shop_orders
+
+
+class ShopOrder(models.Model):
+    """
+    Модель поставки: часть оформленного заказа,
+    которую исполняет один магазин.
+    """
+
+    objects = models.manager.Manager()
+    order = models.ForeignKey(Order, verbose_name='Заказ',
+                              related_name='shop_orders',
+                              on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин',
+                             related_name='shop_orders',
+                             on_delete=models.CASCADE)
+    dt = models.DateTimeField(auto_now_add=True, verbose_name='Дата оформления')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    total_sum = models.PositiveIntegerField(verbose_name='Сумма по магазину', default=0)
+
+    class Meta:
+        verbose_name = 'Поставка магазина'
+        verbose_name_plural = "Список поставок магазинов"
+        ordering = ('-dt',)
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'shop'],
+                                    name='unique_shop_order'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', '-dt'], name='shop_order_shop_dt_idx'),
+            models.Index(fields=['shop', 'updated_at', 'id'], name='shop_order_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.order_id} - {self.shop_id}'
+
 
 class OrderItem(models.Model):
     """
@@ -328,7 +521,12 @@ class OrderItem(models.Model):
                                      related_name='ordered_items',
                                      blank=True,
                                      on_delete=models.CASCADE)
+    shop_order = models.ForeignKey(ShopOrder, verbose_name='Поставка магазина',
+                                   related_name='items',
+                                   blank=True, null=True,
+                                   on_delete=models.SET_NULL)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена')
 
     class Meta:
         verbose_name = 'Заказанная позиция'
@@ -338,6 +536,13 @@ class OrderItem(models.Model):
                                     name='unique_order_item'),
         ]
 
+    def save(self, *args, **kwargs):
+        """Фиксирует цену товара на момент резервирования."""
+
+        if self.price is None:
+            self.price = self.product_info.price
+        return super().save(*args, **kwargs)
+
 
 class ConfirmEmailToken(models.Model):
     """Модель токена для подтверждения email пользователя."""
@@ -370,3 +575,72 @@ class ConfirmEmailToken(models.Model):
 
     def __str__(self):
         return "Password reset token for user {user}".format(user=self.user)
+
+
+class OutgoingEmail(models.Model):
+    """
+    Модель исходящего письма (очередь отправки).
+    Письма отправляются пакетами задачей send_outbox_emails.
+    """
+
+    objects = models.manager.Manager()
+    to = models.EmailField(verbose_name='Получатель')
+    from_email = models.CharField(max_length=254, verbose_name='Отправитель', blank=True)
+    subject = models.CharField(max_length=255, verbose_name='Тема')
+    body = models.TextField(verbose_name='Текст письма')
+    attachment = models.FileField(upload_to='outbox', verbose_name='Вложение',
+                                  blank=True, null=True)
+    attachment_name = models.CharField(max_length=255, verbose_name='Имя вложения', blank=True)
+    coalesce_key = models.CharField(max_length=100, verbose_name='Ключ объединения',
+                                    blank=True, default='')
+    status = models.CharField(verbose_name='Статус', choices=EMAIL_STATUS_CHOICES,
+                              max_length=10, default='pending')
+    attempts = models.PositiveSmallIntegerField(verbose_name='Попыток отправки', default=0)
+    last_error = models.TextField(verbose_name='Последняя ошибка', blank=True)
+    send_after = models.DateTimeField(verbose_name='Отправить после')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    sent_at = models.DateTimeField(verbose_name='Дата отправки', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Очередь исходящих писем'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['send_after', 'id'],
+                         condition=models.Q(status__in=['pending', 'sending']),
+                         name='outbox_due_idx'),
+            models.Index(fields=['to', 'coalesce_key'],
+                         condition=models.Q(status='pending'),
+                         name='outbox_coalesce_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.to}: {self.subject}'
+
+
+class ImageBlob(models.Model):
+    """
+    Файл изображения в адресуемом по содержимому хранилище.
+    Один файл может использоваться несколькими товарами и пользователями;
+    ref_count - количество ссылок, файлы без ссылок удаляет collect_unused_images.
+    Миниатюры строятся один раз на файл и копируются в объекты, которые на него ссылаются.
+    """
+
+    objects = models.manager.Manager()
+    name = models.CharField(max_length=255, unique=True, verbose_name='Имя файла')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')
+    thumbnails = models.JSONField(default=dict, editable=False)
+    thumbnails_source = models.CharField(max_length=80, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['updated_at'], condition=models.Q(ref_count=0),
+                         name='imageblob_unused_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
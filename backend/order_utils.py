@@ -0,0 +1,55 @@
+from collections import defaultdict
+from cacheops.invalidation import invalidate_model
+from django.db import transaction
+from django.utils import timezone
+from backend.models import ORDER_TRANSITIONS, Order, ShopOrder
+from backend.tasks import send_order_state_notifications
+
+
+def can_transition(current_state, new_state):
+    """Проверяет, допустим ли переход заказа из current_state в new_state."""
+
+    return new_state in ORDER_TRANSITIONS.get(current_state, ())
+
+
+def transition_orders(queryset, state):
+    """
+    Переводит заказы в новый статус одним запросом.
+    Заказы, для которых переход недопустим, пропускаются.
+    После фиксации транзакции ставится по одной задаче уведомления
+    на каждого пользователя со всеми изменениями его заказов.
+
+    :param queryset: Выборка заказов
+    :param state: Новый статус
+    :return: Кортеж (изменено, пропущено)
+    """
+
+    allowed_from = [source for source, targets in ORDER_TRANSITIONS.items()
+                    if state in targets]
+
+    with transaction.atomic():
+        selected = queryset.nocache().count()
+        rows = list(queryset.nocache().filter(
+            state__in=allowed_from
+        ).order_by('id').select_for_update(of=('self',)).values_list('id', 'user__email'))
+
+        order_ids = [order_id for order_id, _ in rows]
+        if order_ids:
+            now = timezone.now()
+            Order.objects.filter(id__in=order_ids).update(state=state, updated_at=now)
+            # поставки тоже отмечаются изменёнными для ленты магазинов
+            ShopOrder.objects.filter(order_id__in=order_ids).update(updated_at=now)
+            invalidate_model(Order)
+            invalidate_model(ShopOrder)
+
+        changes = defaultdict(list)
+        for order_id, email in rows:
+            changes[email].append((order_id, state))
+
+        def notify():
+            for email, user_changes in changes.items():
+                send_order_state_notifications.delay(email, user_changes)
+
+        transaction.on_commit(notify)
+
+    return len(order_ids), selected - len(order_ids)
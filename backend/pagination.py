@@ -0,0 +1,41 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """Постраничный вывод заказов по ключу (дата оформления)."""
+
+    ordering = ('-dt', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+def encode_feed_cursor(updated_at, pk):
+    """
+    Кодирует позицию в ленте изменений в непрозрачную строку.
+
+    :param updated_at: Дата изменения последней выданной записи
+    :param pk: ID последней выданной записи
+    :return: Строка курсора
+    """
+
+    raw = f'{updated_at.isoformat()}|{pk}'
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_feed_cursor(cursor):
+    """
+    Декодирует курсор ленты изменений.
+
+    :param cursor: Строка курсора
+    :return: Кортеж (дата изменения, ID)
+    :raises ValueError: Если курсор повреждён
+    """
+
+    try:
+        updated_at, pk = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(updated_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('Некорректный курсор')
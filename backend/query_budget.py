@@ -0,0 +1,70 @@
+import logging
+import re
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+SAVEPOINT_SQL = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.I)
+
+
+class QueryBudgetExceeded(Exception):
+    """Задача выполнила больше запросов к БД, чем было заявлено."""
+
+
+class QueryCounter:
+    """
+    Обёртка выполнения запросов, подсчитывающая их количество.
+    Точки сохранения транзакций не считаются: их число зависит
+    от вложенности atomic, а не от работы задачи.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not SAVEPOINT_SQL.match(sql):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def query_budget(max_queries, name):
+    """
+    Ограничивает количество запросов к БД внутри блока.
+
+    При превышении в тестах (QUERY_BUDGET_STRICT=True) выбрасывает
+    QueryBudgetExceeded, иначе пишет предупреждение в лог.
+
+    :param max_queries: Допустимое количество запросов
+    :param name: Имя блока для сообщения об ошибке
+    """
+
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+    if counter.count > max_queries:
+        message = f'{name}: выполнено {counter.count} запросов к БД при бюджете {max_queries}'
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def with_query_budget(max_queries):
+    """
+    Декоратор задачи Celery, ограничивающий количество запросов к БД.
+    Применяется под декоратором @shared_task.
+
+    :param max_queries: Допустимое количество запросов за одно выполнение
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with query_budget(max_queries, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
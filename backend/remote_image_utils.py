@@ -0,0 +1,148 @@
+import hashlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from io import BytesIO
+from urllib.parse import urlsplit
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from requests import Session
+from requests.exceptions import RequestException
+from backend.models import Product
+
+# Загруженное изображение и валидаторы для следующего условного запроса
+RemoteImage = namedtuple('RemoteImage', ('data', 'etag', 'last_modified'))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_local = threading.local()
+
+
+def get_session():
+    """Сессия requests потока: соединения с хостом переиспользуются между запросами."""
+
+    if not hasattr(_local, 'session'):
+        _local.session = Session()
+    return _local.session
+
+
+class HostLimiter:
+    """Ограничивает количество одновременных запросов к одному хосту."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            semaphore = self.semaphores.setdefault(host, threading.BoundedSemaphore(self.limit))
+        with semaphore:
+            yield
+
+
+def fetch_image(url, source, limiter):
+    """
+    Загружает изображение по ссылке. Если ссылка не изменилась с прошлой
+    загрузки, запрос условный (If-None-Match / If-Modified-Since).
+    Выполняется в пуле потоков и не обращается к БД.
+
+    :param url: Ссылка на изображение
+    :param source: Данные прошлой загрузки (Product.image_source)
+    :param limiter: Ограничение запросов к хосту (HostLimiter)
+    :return: RemoteImage или None, если изображение не изменилось
+    :raises RequestException: При ошибке запроса
+    :raises ValueError: Если файл больше IMAGE_FETCH_MAX_BYTES
+    """
+
+    headers = {}
+    if source.get('url') == url:
+        if source.get('etag'):
+            headers['If-None-Match'] = source['etag']
+        if source.get('last_modified'):
+            headers['If-Modified-Since'] = source['last_modified']
+
+    with limiter.acquire(url):
+        with get_session().get(url, headers=headers, stream=True,
+                               timeout=settings.IMAGE_FETCH_TIMEOUT) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+
+            buffer = BytesIO()
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+                if buffer.tell() > settings.IMAGE_FETCH_MAX_BYTES:
+                    raise ValueError('Изображение слишком большое')
+
+    return RemoteImage(buffer.getvalue(), response.headers.get('ETag', ''),
+                       response.headers.get('Last-Modified', ''))
+
+
+def save_remote_image(product, url, remote):
+    """
+    Сохраняет загруженное изображение товара. Сохранение модели ставит
+    задачу обработки оригинала и построения миниатюр (см. signals).
+
+    :param product: Товар
+    :param url: Ссылка на изображение
+    :param remote: Загруженное изображение (RemoteImage)
+    :return: True, если изображение товара заменено
+    :raises ValueError: Если файл не является изображением
+    """
+
+    source = {'url': url, 'etag': remote.etag, 'last_modified': remote.last_modified,
+              'sha256': hashlib.sha256(remote.data).hexdigest()}
+    if product.image and product.image_source.get('sha256') == source['sha256']:
+        Product.objects.filter(id=product.id).invalidated_update(image_source=source)
+        return False
+
+    try:
+        with Image.open(BytesIO(remote.data)) as img:
+            image_format = img.format.lower()
+            img.verify()
+    except Exception:
+        raise ValueError('Файл не является изображением')
+
+    product.image.save(f'image.{image_format}', ContentFile(remote.data), save=False)
+    product.image_source = source
+    product.save(update_fields=['image', 'image_source'])
+    return True
+
+
+def fetch_product_images(images):
+    """
+    Загружает изображения товаров по ссылкам из прайса партнёра.
+    Запросы выполняются пулом из IMAGE_FETCH_WORKERS потоков, не более
+    IMAGE_FETCH_PER_HOST одновременно к одному хосту; изображения
+    сохраняются по мере загрузки.
+
+    :param images: Список пар [id товара, ссылка]
+    :return: Словарь со счётчиками updated, not_modified, failed
+    """
+
+    products = Product.objects.nocache().in_bulk([product_id for product_id, _ in images])
+    limiter = HostLimiter(settings.IMAGE_FETCH_PER_HOST)
+    stats = {'updated': 0, 'not_modified': 0, 'failed': 0}
+
+    with ThreadPoolExecutor(max_workers=settings.IMAGE_FETCH_WORKERS) as executor:
+        futures = {executor.submit(fetch_image, url, products[product_id].image_source, limiter):
+                   (products[product_id], url)
+                   for product_id, url in images if product_id in products}
+
+        for future in as_completed(futures):
+            # Загруженные данные освобождаются сразу после сохранения
+            product, url = futures.pop(future)
+            try:
+                remote = future.result()
+                if remote is None or not save_remote_image(product, url, remote):
+                    stats['not_modified'] += 1
+                else:
+                    stats['updated'] += 1
+            except (RequestException, ValueError):
+                stats['failed'] += 1
+
+    return stats
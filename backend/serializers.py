@@ -1,8 +1,50 @@
 from django.core.files.storage import default_storage
 from rest_framework import serializers
+from backend.image_utils import accepted_image_formats, choose_variant, get_variants
 from backend.models import (User, Category, Shop, ProductInfo,
                             Product, ProductParameter, OrderItem,
-                            Order, Contact)
+                            Order, Contact, ShopOrder)
+
+
+def serialize_thumbnails(thumbnails, request):
+    """
+    Ссылки на миниатюры. Для каждого размера выбирается самый маленький
+    файл среди форматов, которые клиент принимает по заголовку Accept;
+    ссылки на все форматы отдаются в 'formats' (например, для <picture>).
+
+    :param thumbnails: JSON миниатюр объекта
+    :param request: Текущий запрос или None
+    :return: Словарь {размер: {'url', 'dimensions', 'format', 'formats'}}
+    """
+
+    if not thumbnails:
+        return {}
+
+    def build_url(path):
+        url = default_storage.url(path)
+        return request.build_absolute_uri(url) if request else url
+
+    accepted = accepted_image_formats(request.META.get('HTTP_ACCEPT') if request else None)
+    result = {}
+
+    for size, value in thumbnails.items():
+        variants = get_variants(value)
+        image_format, variant = choose_variant(variants, accepted)
+        if not variant:
+            continue
+
+        try:
+            if default_storage.exists(variant['path']):
+                result[size] = {
+                    'url': build_url(variant['path']),
+                    'dimensions': size,
+                    'format': image_format,
+                    'formats': {name: build_url(item['path']) for name, item in variants.items()}
+                }
+        except (ValueError, NotImplementedError):
+            continue
+
+    return result
 
 
 class ContactSerializer(serializers.ModelSerializer):
@@ -25,8 +67,8 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('id', 'first_name', 'last_name',
                   'email', 'company', 'position', 'contacts',
-                  'avatar', 'avatar_thumbnails')
-        read_only_fields = ('id',)
+                  'avatar', 'avatar_state', 'avatar_thumbnails')
+        read_only_fields = ('id', 'avatar_state')
 
     def get_avatar(self, obj):
         if not obj.avatar:
@@ -46,21 +88,8 @@ class UserSerializer(serializers.ModelSerializer):
         return avatar_data
 
     def get_avatar_thumbnails(self, obj):
-        if not hasattr(obj, 'avatar_thumbnails') or not obj.avatar_thumbnails:
-            return {}
-
-        request = self.context.get('request')
-        result = {}
-
-        for size, path in obj.avatar_thumbnails.items():
-            if default_storage.exists(path):
-                url = default_storage.url(path)
-                result[size] = {
-                    'url': request.build_absolute_uri(url) if request else url,
-                    'dimensions': size
-                }
-
-        return result
+        return serialize_thumbnails(getattr(obj, 'avatar_thumbnails', None),
+                                    self.context.get('request'))
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -84,7 +113,7 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ('name', 'category', 'image', 'thumbnails')
+        fields = ('name', 'category', 'image', 'image_state', 'thumbnails')
 
     def get_image(self, obj):
         if not obj.image:
@@ -106,26 +135,8 @@ class ProductSerializer(serializers.ModelSerializer):
         return image_data
 
     def get_thumbnails(self, obj):
-        if not hasattr(obj, 'thumbnails') or not obj.thumbnails:
-            return {}
-
-        request = self.context.get("request")
-        result = {}
-
-        for size, path in obj.thumbnails.items():
-            if not path:
-                continue
-
-            try:
-                if default_storage.exists(path):
-                    storage_url = default_storage.url(path)
-                    result[size] = {
-                        'url': request.build_absolute_uri(storage_url) if request else storage_url,
-                        'dimensions': size
-                    }
-            except (ValueError, NotImplementedError):
-                continue
-        return result
+        return serialize_thumbnails(getattr(obj, 'thumbnails', None),
+                                    self.context.get('request'))
 
 
 class ProductParameterSerializer(serializers.ModelSerializer):
@@ -151,7 +162,7 @@ class ProductInfoSerializer(serializers.ModelSerializer):
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
-        fields = ('id', 'product_info', 'quantity', 'order',)
+        fields = ('id', 'product_info', 'quantity', 'price', 'order',)
         read_only_fields = ('id',)
         extra_kwargs = {
             'order': {'write_only': True}
@@ -165,36 +176,73 @@ class OrderItemCreateSerializer(OrderItemSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True,
                                               many=True)
-
-    total_sum = serializers.IntegerField()
     contact = ContactSerializer(read_only=True)
 
     class Meta:
         model = Order
         fields = ('id', 'ordered_items', 'state',
                   'dt', 'total_sum', 'contact',)
+        read_only_fields = ('id', 'total_sum',)
+
+
+class OrderItemSummarySerializer(serializers.ModelSerializer):
+    product = serializers.CharField(source='product_info.product.name', read_only=True)
+    shop = serializers.CharField(source='product_info.shop.name', read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ('id', 'product_info', 'product', 'shop', 'quantity', 'price',)
         read_only_fields = ('id',)
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    ordered_items = OrderItemSummarySerializer(read_only=True, many=True)
+    contact = ContactSerializer(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ('id', 'ordered_items', 'state',
+                  'dt', 'total_sum', 'contact',)
+        read_only_fields = ('id', 'total_sum',)
+
+
 class PartnerOrderItemSerializer(serializers.ModelSerializer):
     product_info = ProductInfoSerializer(read_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ('id', 'product_info', 'quantity',)
+        fields = ('id', 'product_info', 'quantity', 'price',)
         read_only_fields = ('id',)
 
 
+class PartnerFeedItemSerializer(serializers.ModelSerializer):
+    external_id = serializers.IntegerField(source='product_info.external_id', read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ('product_info', 'external_id', 'quantity', 'price',)
+
+
+class PartnerFeedSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='order_id', read_only=True)
+    state = serializers.CharField(source='order.state', read_only=True)
+    contact = serializers.IntegerField(source='order.contact_id', read_only=True)
+    items = PartnerFeedItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ShopOrder
+        fields = ('id', 'state', 'dt', 'updated_at',
+                  'total_sum', 'contact', 'items',)
+
+
 class PartnerOrderSerializer(serializers.ModelSerializer):
-    ordered_items = PartnerOrderItemSerializer(many=True, read_only=True)
-    total_sum = serializers.SerializerMethodField()
-    contact = ContactSerializer(read_only=True)
+    id = serializers.IntegerField(source='order_id', read_only=True)
+    ordered_items = PartnerOrderItemSerializer(source='items', many=True, read_only=True)
+    state = serializers.CharField(source='order.state', read_only=True)
+    contact = ContactSerializer(source='order.contact', read_only=True)
 
     class Meta:
-        model = Order
+        model = ShopOrder
         fields = ('id', 'ordered_items', 'state',
                   'dt', 'total_sum', 'contact',)
         read_only_fields = ('id',)
-
-    def get_total_sum(self, obj):
-        return obj.partner_sum
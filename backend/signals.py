@@ -1,14 +1,18 @@
-import os
 from typing import Type
 
-from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver, Signal
+from django.utils import timezone
 from django_rest_passwordreset.signals import reset_password_token_created
-from backend.tasks import (send_email, send_email_with_attachment,
+from backend.email_utils import queue_email
+from backend.excel_utils import delete_invoice_files
+from backend.image_utils import (AVATAR_THUMBNAIL_SIZES, PRODUCT_THUMBNAIL_SIZES,
+                                 acquire_image, release_image)
+from backend.tasks import (ORDER_STATE_MESSAGES, send_new_order_notifications,
                            generate_product_thumbnails, generate_user_thumbnails)
-from backend.models import ConfirmEmailToken, User, Order, Product
-from backend.excel_utils import generate_invoice_excel
+from backend.models import (ConfirmEmailToken, User, Order, OrderItem, Product, ProductInfo,
+                            ShopOrder)
 
 new_user_registered = Signal()
 
@@ -19,7 +23,7 @@ new_order = Signal()
 def password_reset_token_created(sender, instance, reset_password_token, **kwargs):
     """
     Сигнальная функция, автоматически вызываемая при создании токена сброса пароля.
-    Использует Celery для асинхронной отправки email.
+    Ставит письмо в очередь отправки.
 
     :param sender: Класс представления, который отправил сигнал
     :param instance: Экземпляр представления, отправившего сигнал
@@ -28,10 +32,9 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
     :return: None
     """
 
-    send_email.delay(
+    queue_email(
         subject=f"Сброс пароля для {reset_password_token.user.email}",
         message=f"Ваш токен для сброса: {reset_password_token.key}",
-        from_email=settings.EMAIL_HOST_USER,
         to=[reset_password_token.user.email]
     )
 
@@ -42,7 +45,7 @@ def new_user_registered_signal(sender: Type[User], instance: User, created: bool
      Сигнальный обработчик, который:
     - Срабатывает при создании нового пользователя (created=True)
     - Отправляет токен подтверждения email, если пользователь неактивен
-    - Использует асинхронную отправку через Celery
+    - Ставит письмо в очередь отправки
 
     :param sender: Класс модели User
     :param instance: Экземпляр пользователя, который был сохранен
@@ -54,10 +57,9 @@ def new_user_registered_signal(sender: Type[User], instance: User, created: bool
     if created and not instance.is_active:
 
         token, _ = ConfirmEmailToken.objects.get_or_create(user_id=instance.pk)
-        send_email.delay(
+        queue_email(
             subject=f"Подтверждение email {instance.email}",
             message=f"Ваш токен подтверждения: {token.key}",
-            from_email=settings.EMAIL_HOST_USER,
             to=[instance.email]
         )
 
@@ -67,152 +69,129 @@ def new_order_signal(user_id, **kwargs):
     """
     Обрабатывает изменение статуса заказа, и
     отправляет уведомление пользователю и администратору.
+    Для нового заказа после фиксации транзакции ставится одна задача,
+    которая отправляет уведомление и накладную.
 
     :param user_id: ID пользователя, оформившего заказ
-    :param kwargs: Дополнительные параметры
+    :param kwargs: Дополнительные параметры (state, order_id)
     :return: None
     """
 
-    user = User.objects.get(id=user_id)
     state = kwargs.get('state', 'new')
 
-    state_messages = {
-        'new': 'Заказ сформирован',
-        'confirmed': 'Заказ подтвержден',
-        'assembled': 'Заказ собран',
-        'sent': 'Заказ отправлен',
-        'delivered': 'Заказ доставлен',
-        'canceled': 'Заказ отменен'
-
-    }
+    if state == 'new':
+        order_id = kwargs['order_id']
+        transaction.on_commit(lambda: send_new_order_notifications.delay(order_id))
+        return
 
-    send_email.delay(
+    # частые смены статуса одного заказа объединяются в одно письмо
+    user = User.objects.get(id=user_id)
+    queue_email(
         subject=f"Статус заказа: {state}",
-        message=state_messages.get(state, 'Статус вашего заказа изменен'),
-        from_email=settings.EMAIL_HOST_USER,
-        to=[user.email]
+        message=ORDER_STATE_MESSAGES.get(state, 'Статус вашего заказа изменен'),
+        to=[user.email],
+        coalesce_key=f"order_state:{kwargs.get('order_id', '')}"
     )
 
-    if state == 'new':
-        _handle_new_order(user_id, user)
 
+@receiver(pre_delete, sender=ProductInfo)
+def collect_orders_on_product_info_delete(sender, instance, **kwargs):
+    """Запоминает заказы, позиции которых будут удалены вместе с товаром магазина."""
 
-def _handle_new_order(user_id, user):
-    """
-    Обрабатывает новый заказ и
-    отправляет накладную администратору
+    instance.affected_order_ids = list(
+        OrderItem.objects.filter(product_info_id=instance.id).values_list('order_id', flat=True)
+    )
 
-    :param user_id: ID пользователя, оформившего заказ
-    :param user: Объект пользователя (User)
+
+@receiver(post_delete, sender=ProductInfo)
+def update_order_totals_on_product_info_delete(sender, instance, **kwargs):
     """
+    Пересчитывает суммы заказов, потерявших позиции при удалении товара магазина.
+    Остальные изменения позиций пересчитывают суммы один раз на операцию
+    (корзина, админ-панель) вызовом Order.update_totals.
+    """
+
+    for order in Order.objects.filter(id__in=getattr(instance, 'affected_order_ids', [])):
+        order.update_totals()
 
-    order = Order.objects.filter(user_id=user_id,
-                                 state='new'
-                                 ).prefetch_related(
-        'ordered_items',
-        'ordered_items__product_info',
-        'ordered_items__product_info__product',
-        'ordered_items__product_info__shop'
-    ).first()
 
-    if not order:
+@receiver(post_save, sender=Order)
+def touch_shop_orders_on_order_change(sender, instance, **kwargs):
+    """
+    Отмечает поставки изменёнными, чтобы они попали в ленту магазинов.
+    Время берётся текущее: при save(update_fields=...) без updated_at
+    (например, в Order.update_totals) поле заказа не обновляется.
+    """
+
+    if instance.state == 'basket':
         return
 
-    # Подготовка данных о товарах по магазинам
-    shops_items = {}
-    for item in order.ordered_items.all():
-        shop_name = item.product_info.shop.name
-        product_name = item.product_info.product.name
-        item_info = f"{product_name} - {item.quantity} шт." \
-                    f" x {item.product_info.price} руб."
-
-        if shop_name not in shops_items:
-            shops_items[shop_name] = []
-        shops_items[shop_name].append(item_info)
-
-    # Формирование списка товаров для email
-    items_list = []
-    for shop_name, products in shops_items.items():
-        items_list.append(f"\n--- Магазин: {shop_name} ---")
-        items_list.extend(products)
-
-        shop_total = sum(
-            item.product_info.price * item.quantity
-            for item in order.ordered_items.all()
-            if item.product_info.shop.name == shop_name
-        )
-        items_list.append(f"Итого по магазину: {shop_total} руб.")
-
-    # Формирование тела письма
-    email_body = f"""
-        НАКЛАДНАЯ №{order.id}
-        Дата: {order.dt.strftime('%H:%M %d.%m.%Y')}
-        Клиент: {user.email}
-        Контакт: Город {order.contact.city},
-                Улица {order.contact.street},
-                Телефон {order.contact.phone}
-
-        Состав заказа:
-        {chr(10).join(items_list)}
-
-        Итого к оплате: {sum(item.product_info.price * item.quantity
-                             for item in order.ordered_items.all())} руб.
-        """
-
-    # Генерация и отправка Excel-файла
-    excel_data = generate_invoice_excel(order, user, shops_items)
-    send_email_with_attachment.delay(
-        subject=f"Накладная по заказу №{order.id}",
-        message=email_body,
-        from_email=settings.EMAIL_HOST_USER,
-        to_email=[os.getenv("EMAIL_HOST_USER")],
-        excel_data=excel_data,
-        filename=f"invoice_{order.id}.xlsx"
+    ShopOrder.objects.filter(order_id=instance.id).invalidated_update(
+        updated_at=timezone.now()
     )
 
 
+@receiver(post_delete, sender=Order)
+def delete_invoice_files_on_order_delete(sender, instance, **kwargs):
+    """Удаляет сохранённые накладные удалённого заказа."""
+
+    delete_invoice_files(instance.id)
+
+
 @receiver(post_save, sender=Product)
-def process_product_image_on_save(sender, instance, created, **kwargs):
-    """Сигнал для обработки изображений товаров после сохранения."""
+def process_product_image_on_save(sender, instance, **kwargs):
+    """
+    Сигнал для обработки изображений товаров после сохранения.
+    Миниатюры перестраиваются, только если изменилось само изображение.
+    """
 
-    if not instance.image:
-        if hasattr(instance, 'clear_products_thumbnails'):
-            instance.clear_products_thumbnails()
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if not instance.image_changed('image'):
         return
 
-    if not created:
-        try:
-            old = Product.objects.get(id=instance.id)
-            if old.image.name != instance.image.name:
-                if hasattr(old, 'clear_products_thumbnails'):
-                    old.clear_products_thumbnails()
-        except Product.DoesNotExist:
-            pass
-
-    sizes = [(400, 400), (200, 200), (100, 100)]
-    generate_product_thumbnails.delay(instance.id, sizes)
+    release_image(instance.previous_image_name('image'))
+    acquire_image(instance.image.name)
+    instance.clear_products_thumbnails()
+    if instance.image:
+        image_name = instance.image.name
+        transaction.on_commit(lambda: generate_product_thumbnails.delay(
+            instance.id, PRODUCT_THUMBNAIL_SIZES, image_name=image_name))
 
 
 @receiver(post_save, sender=User)
-def process_user_avatar_on_save(sender, instance, created, **kwargs):
-    """Сигнал для обработки аватара пользователя после сохранения."""
+def process_user_avatar_on_save(sender, instance, **kwargs):
+    """
+    Сигнал для обработки аватара пользователя после сохранения.
+    Вход в систему, смена пароля и другие сохранения без замены
+    аватара задачу не ставят.
+    """
 
-    if not instance.avatar:
-        if hasattr(instance, 'clear_thumbnails'):
-            instance.clear_thumbnails()
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'avatar' not in update_fields:
         return
+    if not instance.image_changed('avatar'):
+        return
+
+    release_image(instance.previous_image_name('avatar'))
+    acquire_image(instance.avatar.name)
+    instance.clear_thumbnails()
+    if instance.avatar:
+        image_name = instance.avatar.name
+        transaction.on_commit(lambda: generate_user_thumbnails.delay(
+            user_id=instance.id, sizes=AVATAR_THUMBNAIL_SIZES, image_name=image_name))
+
+
+@receiver(post_delete, sender=Product)
+def release_product_image_on_delete(sender, instance, **kwargs):
+    """Освобождает ссылку удалённого товара на файл изображения."""
+
+    release_image(instance.previous_image_name('image'))
 
-    if not created:
-        try:
-            old_user = User.objects.get(id=instance.id)
-            if old_user.avatar.name != instance.avatar.name:
-                if hasattr(old_user, 'clear_thumbnails'):
-                    old_user.clear_thumbnails()
-        except User.DoesNotExist:
-            pass
 
-    avatar_sizes = [(200, 200), (100, 100), (50, 50)]
+@receiver(post_delete, sender=User)
+def release_user_avatar_on_delete(sender, instance, **kwargs):
+    """Освобождает ссылку удалённого пользователя на файл аватара."""
 
-    # Запуск асинхронной задачи
-    generate_user_thumbnails.delay(user_id=instance.id,
-                                   sizes=avatar_sizes)
+    release_image(instance.previous_image_name('avatar'))
@@ -1,69 +1,172 @@
-from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
+from tempfile import NamedTemporaryFile
 from celery import shared_task
-from django.core.mail import EmailMultiAlternatives, EmailMessage
+from django.conf import settings
+from django.core.files.storage import default_storage
+from smtplib import SMTPException
 from typing import Union
 from yaml import safe_load, YAMLError
 from requests import get
 from requests.exceptions import RequestException
 from django.db import transaction
-from backend.image_utils import generate_and_save_thumbnails
+from backend.excel_utils import (get_invoice_file, get_invoice_lines,
+                                 invoice_orders_queryset, write_invoices_archive)
+from backend.email_utils import queue_email, retry_delay, send_outbox_batch
+from backend.export_utils import (EXPORT_WRITERS, cleanup_export_artifacts, export_queryset,
+                                  iter_export_items, save_export_artifact)
+from backend.media_utils import collect_orphaned_media
+from backend.query_budget import with_query_budget
+from backend.remote_image_utils import fetch_product_images
+from backend.image_utils import (AVATAR_THUMBNAIL_SIZES, PRODUCT_THUMBNAIL_SIZES,
+                                 THUMBNAIL_TARGETS, collect_unused_images, process_image,
+                                 thumbnails_up_to_date)
 from backend.models import (Shop, Category, Product, ProductInfo,
-                            Parameter, ProductParameter, User)
+                            Parameter, ProductParameter, User, Order)
+
+ORDER_STATE_MESSAGES = {
+    'new': 'Заказ сформирован',
+    'confirmed': 'Заказ подтвержден',
+    'assembled': 'Заказ собран',
+    'sent': 'Заказ отправлен',
+    'delivered': 'Заказ доставлен',
+    'canceled': 'Заказ отменен'
+}
+
+# Бюджеты запросов к БД для задач (см. with_query_budget).
+# Заказ с пользователем и контактом, строки накладной, два письма в очередь
+# (отправка запускается один раз, без проверки очереди).
+NOTIFICATION_QUERY_BUDGET = 4
+# Курсор по товарам и по одному запросу параметров на каждую порцию
+# из EXPORT_CHUNK_SIZE товаров: хватает на 2 млн товаров.
+EXPORT_QUERY_BUDGET = 1000
+
+
+@shared_task(bind=True, name="send_outbox_emails", max_retries=5)
+def send_outbox_emails(self):
+    """
+    Отправляет письма из очереди OutgoingEmail порциями по
+    EMAIL_OUTBOX_BATCH_SIZE, пока готовые к отправке письма не закончатся.
+    Если SMTP-сервер недоступен, задача повторяется с растущей задержкой.
+
+    :return: Количество отправленных писем и ошибок
+    """
+
+    batch_size = settings.EMAIL_OUTBOX_BATCH_SIZE
+    total_sent = total_failed = 0
+    try:
+        while True:
+            sent, failed = send_outbox_batch(batch_size)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < batch_size:
+                break
+    except (SMTPException, OSError) as error:
+        raise self.retry(exc=error, countdown=retry_delay(self.request.retries + 1))
 
+    return {'sent': total_sent, 'failed': total_failed}
 
-@shared_task
-def send_email(subject, message, from_email, to):
+
+@shared_task(name="send_order_state_notifications")
+def send_order_state_notifications(email, changes):
     """
-    Отправляет электронное письмо асинхронно через Celery.
+    Ставит в очередь одно письмо пользователю со всеми изменениями
+    статусов его заказов.
 
-    :param subject: Тема письма
-    :param message: Текст письма
-    :param from_email: Email отправителя
-    :param to: Email получателя или список получателей
+    :param email: Email пользователя
+    :param changes: Список пар (ID заказа, новый статус)
     """
 
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=message,
-        from_email=from_email,
-        to=to
+    if len(changes) == 1:
+        (order_id, state), = changes
+        queue_email(
+            subject=f"Статус заказа: {state}",
+            message=ORDER_STATE_MESSAGES.get(state, 'Статус вашего заказа изменен'),
+            to=[email],
+            coalesce_key=f"order_state:{order_id}"
+        )
+        return
+
+    lines = [f"Заказ №{order_id}: {ORDER_STATE_MESSAGES.get(state, state)}"
+             for order_id, state in changes]
+    queue_email(
+        subject="Изменение статуса заказов",
+        message='\n'.join(lines),
+        to=[email]
     )
-    msg.send()
 
 
-@shared_task
-def send_email_with_attachment(subject, message, from_email,
-                               to_email, excel_data, filename):
+@shared_task(name="send_new_order_notifications")
+@with_query_budget(NOTIFICATION_QUERY_BUDGET)
+def send_new_order_notifications(order_id):
     """
-    Отправляет электронное письмо с вложением асинхронно через Celery.
+    Отправляет покупателю уведомление о новом заказе,
+    а администратору — накладную с Excel-файлом.
 
-    :param subject: Тема письма
-    :param message: Текст письма
-    :param from_email: Email отправителя
-    :param to_email: Email получателя или список получателей
-    :param excel_data: Данные для Excel файла, которые будут вложены
-    :param filename: Имя файла для вложения (например, 'invoice.xlsx')
+    :param order_id: ID оформленного заказа
     """
-    email = EmailMessage(
-        subject=subject,
-        body=message,
-        from_email=from_email,
-        to=to_email,
-    )
 
-    email.attach(filename=filename,
-                 content=excel_data,
-                 mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    order = Order.objects.filter(id=order_id).select_related(
+        'user', 'contact'
+    ).first()
+
+    if not order:
+        return
+
+    user = order.user
+    queue_email(
+        subject="Статус заказа: new",
+        message=ORDER_STATE_MESSAGES['new'],
+        to=[user.email],
+        schedule=False
+    )
 
-    email.send()
+    # Позиции заказа, сгруппированные по магазинам (один запрос)
+    shops_lines = get_invoice_lines(order.id)
+
+    # Формирование списка товаров для email
+    items_list = []
+    for shop_name, lines in shops_lines:
+        items_list.append(f"\n--- Магазин: {shop_name} ---")
+        items_list.extend(f"{line.product} - {line.quantity} шт. x {line.price} руб."
+                          for line in lines)
+
+        shop_total = sum(line.quantity * line.price for line in lines)
+        items_list.append(f"Итого по магазину: {shop_total} руб.")
+
+    # Формирование тела письма
+    email_body = f"""
+        НАКЛАДНАЯ №{order.id}
+        Дата: {order.dt.strftime('%H:%M %d.%m.%Y')}
+        Клиент: {user.email}
+        Контакт: Город {order.contact.city},
+                Улица {order.contact.street},
+                Телефон {order.contact.phone}
+
+        Состав заказа:
+        {chr(10).join(items_list)}
+
+        Итого к оплате: {order.total_sum} руб.
+        """
+
+    # Генерация (или повторное использование сохранённого) и отправка Excel-файла
+    with default_storage.open(get_invoice_file(order, user, shops_lines), 'rb') as invoice:
+        excel_data = invoice.read()
+    queue_email(
+        subject=f"Накладная по заказу №{order.id}",
+        message=email_body,
+        to=[settings.EMAIL_HOST_USER],
+        attachment=excel_data,
+        attachment_name=f"invoice_{order.id}.xlsx",
+        schedule=False
+    )
+    send_outbox_emails.delay()
 
 
 @shared_task(bind=True)
 def do_import(self, source: Union[str, bytes], user_id: int) -> None:
     """
     Асинхронно импортирует данные партнёра из YAML-файла.
+    Изображения товаров из необязательного поля image загружаются
+    отдельной задачей после фиксации транзакции импорта.
 
     :param self: Экземпляр задачи Celery (доступен благодаря bind=True)
     :param source: Данные для импорта
@@ -80,6 +183,7 @@ def do_import(self, source: Union[str, bytes], user_id: int) -> None:
             stream = source
 
         data = safe_load(stream)
+        images = {}
 
         with transaction.atomic():
             shop, _ = Shop.objects.get_or_create(name=data['shop'],
@@ -94,6 +198,8 @@ def do_import(self, source: Union[str, bytes], user_id: int) -> None:
             for item in data['goods']:
                 product, _ = Product.objects.get_or_create(name=item['name'],
                                                            category_id=item['category'])
+                if item.get('image'):
+                    images[product.id] = item['image']
 
                 product_info, created = ProductInfo.objects.get_or_create(
                     product_id=product.id,
@@ -130,6 +236,10 @@ def do_import(self, source: Union[str, bytes], user_id: int) -> None:
                         product_param.value = value
                         product_param.save()
 
+            if images:
+                transaction.on_commit(
+                    lambda: fetch_product_images_task.delay(list(images.items())))
+
     except RequestException as e:
         self.retry(exc=e, countdown=60)
     except YAMLError as e:
@@ -141,114 +251,150 @@ def do_import(self, source: Union[str, bytes], user_id: int) -> None:
 
 
 @shared_task()
-def export_products(product_ids):
-    """Формирование Excel-файла с информацией о продуктах"""
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Экспорт товаров"
-
-    headers = [
-        'ID', 'Модель', 'Продукт', 'Магазин',
-        'Количество', 'Цена', 'РРЦ', 'Параметры'
-    ]
-    ws.append(headers)
-
-    queryset = ProductInfo.objects.filter(
-        id__in=product_ids
-    ).select_related('product', 'shop'
-                     ).prefetch_related('product_parameters')
-
-    for item in queryset:
-        params = ', '.join(
-            f'{param.parameter.name}: {param.value}'
-            for param in item.product_parameters.all()
-        )
+@with_query_budget(EXPORT_QUERY_BUDGET)
+def export_products(filters, file_format='xlsx'):
+    """
+    Формирование файла экспорта товаров, отобранных по фильтрам.
+    Файл сохраняется в хранилище, через Celery передаются только его метаданные.
+
+    :param filters: Фильтры выборки (см. parse_export_filters)
+    :param file_format: Формат файла: xlsx, csv (gzip) или jsonl
+    :return: Метаданные файла (см. save_export_artifact)
+    """
+
+    items = iter_export_items(export_queryset(filters))
+
+    with NamedTemporaryFile() as export_file:
+        EXPORT_WRITERS[file_format](items, export_file)
+        return save_export_artifact(export_file, file_format)
+
 
-        row = [
-            item.id,
-            item.model,
-            item.product.name,
-            item.shop.name,
-            item.quantity,
-            item.price,
-            item.price_rrc,
-            params.replace('\n', ' ')
-        ]
+@shared_task(name="generate_invoices_archive")
+def generate_invoices_archive(filters):
+    """
+    Формирует ZIP-архив накладных по заказам, отобранным по фильтрам,
+    и сохраняет его в хранилище.
+
+    :param filters: Фильтры заказов (см. invoice_orders_queryset)
+    :return: Метаданные файла (см. save_export_artifact)
+    """
+
+    order_ids = invoice_orders_queryset(filters).values_list('id', flat=True).distinct()
+
+    with NamedTemporaryFile() as archive:
+        write_invoices_archive(order_ids, archive, workers=settings.INVOICE_WORKERS)
+        return save_export_artifact(archive, 'zip', name='invoices')
+
+
+@shared_task(name="cleanup_export_artifacts")
+def cleanup_expired_exports():
+    """Периодическое удаление файлов экспорта с истёкшим сроком хранения."""
+
+    return {'deleted': cleanup_export_artifacts()}
+
+
+@shared_task(name="collect_unused_images")
+def collect_unused_images_task():
+    """Удаляет файлы изображений, на которые больше не ссылаются товары и пользователи."""
 
-        ws.append(row)
+    return {'deleted': collect_unused_images()}
 
-    # настройка ширины столбцов
-    for col_idx, _ in enumerate(headers, 1):
-        max_length = 0
-        column_letter = get_column_letter(col_idx)
 
-        for cell in ws[column_letter]:
-            try:
-                if cell.value is not None:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
+@shared_task(name="fetch_product_images")
+def fetch_product_images_task(images):
+    """
+    Загружает изображения товаров по ссылкам из прайса партнёра.
+
+    :param images: Список пар [id товара, ссылка]
+    :return: Количество обновлённых, неизменившихся и незагруженных изображений
+    """
+
+    return fetch_product_images(images)
+
 
-        ws.column_dimensions[column_letter].width = (max_length + 2) * 1.2
+@shared_task(name="collect_orphaned_media")
+def collect_orphaned_media_task():
+    """
+    Удаляет файлы изображений и миниатюр, на которые не ссылается БД.
 
-    # сохраняем в BytesIO
-    excel_file = BytesIO()
-    wb.save(excel_file)
-    excel_file.seek(0)
+    :return: Количество просмотренных и удалённых файлов и освобождённый объём в байтах
+    """
 
-    return excel_file.getvalue()
+    return collect_orphaned_media()
 
 
 @shared_task(bind=True, name="generate_product_thumbnails")
-def generate_product_thumbnails(self, product_id, sizes=None):
+def generate_product_thumbnails(self, product_id, sizes=None, image_name=None):
     """
-    Асинхронная генерация миниатюр изображения товара.
+    Асинхронная обработка изображения товара: загруженный оригинал
+    уменьшается до PRODUCT_IMAGE_SIZE, затем строятся миниатюры.
+
+    Задача пропускается, если изображение уже заменено более новым
+    (для него поставлена своя задача) или миниатюры уже построены.
 
     :param product_id: Id продукта
     :param sizes: список размеров (кортежи ширина x высота)
+    :param image_name: Имя файла изображения, для которого поставлена задача
     :return: Словарь с результатами выполнения
     """
 
     if sizes is None:
-        sizes = [(400, 400), (200, 200), (100, 100)]
+        sizes = PRODUCT_THUMBNAIL_SIZES
 
     try:
         product = Product.objects.get(id=product_id)
-        thumbnails = generate_and_save_thumbnails(instance=product,
-                                                  image_field_name='image',
-                                                  thumbnails_field_name='thumbnails',
-                                                  sizes=sizes)
+        if image_name is not None and product.image.name != image_name:
+            return {'status': 'skipped', 'reason': 'Изображение заменено', 'model': 'Product'}
+        if (product.image_state != 'processing'
+                and thumbnails_up_to_date(product, 'image', 'thumbnails', sizes)):
+            return {'status': 'skipped', 'reason': 'Миниатюры актуальны', 'model': 'Product'}
+
+        thumbnails = process_image(product, THUMBNAIL_TARGETS['product']._replace(sizes=sizes))
+        if thumbnails is None:
+            return {'status': 'skipped', 'reason': 'Изображение заменено', 'model': 'Product'}
         return {'status': 'success',
                 'generated': list(thumbnails.keys()),
                 'model': 'Product'}
     except Product.DoesNotExist:
         return {'status': 'error', 'reason': 'Товар не найден'}
+    except ValueError as e:
+        return {'status': 'error', 'reason': str(e), 'model': 'Product'}
 
 
 @shared_task(bind=True, name="generate_user_thumbnails")
-def generate_user_thumbnails(self, user_id, sizes=None):
+def generate_user_thumbnails(self, user_id, sizes=None, image_name=None):
     """
-    Асинхронная генерация миниатюр изображения товара.
+    Асинхронная обработка аватара пользователя: загруженный оригинал
+    уменьшается до AVATAR_IMAGE_SIZE, затем строятся миниатюры.
+
+    Задача пропускается, если аватар уже заменён более новым
+    (для него поставлена своя задача) или миниатюры уже построены.
 
     :param user_id: Id пользователя
     :param sizes: список размеров (кортежи ширина x высота)
+    :param image_name: Имя файла аватара, для которого поставлена задача
     :return: Словарь с результатами выполнения
     """
 
     if sizes is None:
-        sizes = [(200, 200), (100, 100), (50, 50)]
+        sizes = AVATAR_THUMBNAIL_SIZES
 
     try:
         user = User.objects.get(id=user_id)
-        thumbnails = generate_and_save_thumbnails(instance=user,
-                                                  image_field_name='avatar',
-                                                  thumbnails_field_name='avatar_thumbnails',
-                                                  sizes=sizes)
-
+        if image_name is not None and user.avatar.name != image_name:
+            return {'status': 'skipped', 'reason': 'Изображение заменено', 'model': 'User'}
+        if (user.avatar_state != 'processing'
+                and thumbnails_up_to_date(user, 'avatar', 'avatar_thumbnails', sizes)):
+            return {'status': 'skipped', 'reason': 'Миниатюры актуальны', 'model': 'User'}
+
+        thumbnails = process_image(user, THUMBNAIL_TARGETS['user']._replace(sizes=sizes))
+        if thumbnails is None:
+            return {'status': 'skipped', 'reason': 'Изображение заменено', 'model': 'User'}
         return {'status': 'success',
                 'generated': list(thumbnails.keys()),
                 'model': 'User'}
 
     except User.DoesNotExist:
         return {'status': 'error', 'reason': 'Пользователь не найден'}
+    except ValueError as e:
+        return {'status': 'error', 'reason': str(e), 'model': 'User'}
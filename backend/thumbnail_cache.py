@@ -0,0 +1,194 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+
+META_FILENAME = 'meta.json'
+LOCK_FILENAME = '.lock'
+# Вытеснение освобождает место с запасом (до 90% лимита), чтобы полный обход
+# кэша выполнялся не при каждом промахе после первого переполнения
+EVICTION_LOW_WATER = 0.9
+
+
+@contextmanager
+def locked(path, blocking=True):
+    """
+    Межпроцессная блокировка на файле path (flock).
+
+    :param path: Путь к файлу блокировки
+    :param blocking: Ждать освобождения блокировки
+    :return: True, если блокировка получена
+    """
+
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ThumbnailDiskCache:
+    """
+    Ограниченный по размеру дисковый кэш миниатюр с вытеснением давно
+    не использованных записей (LRU).
+
+    Запись - каталог с файлами миниатюры в разных форматах и meta.json
+    с их размерами. Время последнего обращения хранится в mtime каталога.
+    Построение записи защищено блокировкой на ключ, поэтому одновременные
+    запросы холодной миниатюры строят её один раз, в том числе из разных
+    процессов.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or settings.THUMBNAIL_CACHE_DIR
+        self.max_bytes = max_bytes or settings.THUMBNAIL_CACHE_MAX_BYTES
+        # Приблизительный объём кэша: считается при первом обращении
+        # и уточняется при каждом вытеснении
+        self.total_bytes = None
+
+    def entry_dir(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def read(self, entry_dir):
+        """
+        Читает запись и отмечает обращение к ней.
+
+        :return: Словарь {формат: {'path': путь, 'bytes': размер}} или None
+        """
+
+        try:
+            with open(os.path.join(entry_dir, META_FILENAME)) as file:
+                meta = json.load(file)
+            os.utime(entry_dir)
+        except (OSError, ValueError):
+            return None
+        return {image_format: {'path': os.path.join(entry_dir, image_format), 'bytes': size}
+                for image_format, size in meta.items()}
+
+    def get_or_render(self, key, render):
+        """
+        Возвращает запись из кэша, при промахе строит её вызовом render().
+
+        :param key: Ключ записи
+        :param render: Функция без аргументов, возвращающая {формат: bytes}
+        :return: (словарь вариантов как в read, True при попадании в кэш)
+        """
+
+        entry_dir = self.entry_dir(key)
+        variants = self.read(entry_dir)
+        if variants is not None:
+            return variants, True
+
+        os.makedirs(entry_dir, exist_ok=True)
+        with locked(os.path.join(entry_dir, LOCK_FILENAME)):
+            variants = self.read(entry_dir)
+            if variants is not None:
+                return variants, True
+
+            contents = render()
+            # Каталог мог быть удалён вытеснением, пока ожидалась блокировка
+            os.makedirs(entry_dir, exist_ok=True)
+            for image_format, content in contents.items():
+                self.write_file(entry_dir, image_format, content)
+            self.write_file(entry_dir, META_FILENAME, json.dumps(
+                {image_format: len(content) for image_format, content in contents.items()}
+            ).encode())
+
+        variants = self.read(entry_dir)
+        self.add_bytes(sum(len(content) for content in contents.values()), keep=entry_dir)
+        return variants, False
+
+    @staticmethod
+    def write_file(entry_dir, name, content):
+        """Атомарная запись файла: читатели видят либо старую, либо полную версию."""
+
+        fd, temp_path = tempfile.mkstemp(dir=entry_dir)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, os.path.join(entry_dir, name))
+
+    def iter_entries(self):
+        """
+        Записи кэша.
+
+        :return: Генератор (время обращения, размер, путь к каталогу)
+        """
+
+        if not os.path.isdir(self.root):
+            return
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    size = sum(item.stat().st_size for item in os.scandir(entry.path))
+                    yield entry.stat().st_mtime, size, entry.path
+                except OSError:
+                    continue
+
+    def add_bytes(self, size, keep=None):
+        """
+        Учитывает новые данные и вытесняет старые записи при превышении лимита.
+
+        :param size: Объём записанных данных
+        :param keep: Каталог записи, которую нельзя вытеснять (только что построенная)
+        """
+
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self.iter_entries())
+        else:
+            self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict(keep)
+
+    def evict(self, keep=None):
+        """
+        Удаляет давно не использованные записи, пока объём кэша превышает
+        EVICTION_LOW_WATER от лимита. Записи, которые сейчас строятся, пропускаются.
+
+        :param keep: Каталог записи, которую нельзя вытеснять
+        :return: Количество удалённых записей
+        """
+
+        entries = sorted(self.iter_entries())
+        total = sum(size for _, size, _ in entries)
+        low_water = self.max_bytes * EVICTION_LOW_WATER
+        removed = 0
+
+        for _, size, entry_dir in entries:
+            if total <= low_water:
+                break
+            if entry_dir == keep:
+                continue
+            with locked(os.path.join(entry_dir, LOCK_FILENAME), blocking=False) as acquired:
+                if not acquired:
+                    continue
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            removed += 1
+
+        self.total_bytes = total
+        return removed
+
+
+_cache = None
+
+
+def get_thumbnail_cache():
+    """Кэш миниатюр процесса, настроенный по THUMBNAIL_CACHE_DIR и THUMBNAIL_CACHE_MAX_BYTES."""
+
+    global _cache
+    if (_cache is None or _cache.root != settings.THUMBNAIL_CACHE_DIR
+            or _cache.max_bytes != settings.THUMBNAIL_CACHE_MAX_BYTES):
+        _cache = ThumbnailDiskCache()
+    return _cache
@@ -3,9 +3,10 @@ from django_rest_passwordreset.views import reset_password_request_token, reset_
 
 from backend.views import (PartnerUpdate, RegisterAccount, LoginAccount,
                            CategoryView, ShopView, ProductInfoView, BasketView,
-                           AccountDetails, ContactView, OrderView, PartnerState,
-                           PartnerOrders, ConfirmAccount, ImportFromAdmin,
-                           download_csv_view, TestErrorView)
+                           AccountDetails, ContactView, OrderView, OrderDetailView, PartnerState,
+                           PartnerOrders, PartnerOrdersFeed, PartnerExport, ConfirmAccount,
+                           ImportFromAdmin, download_csv_view, invoice_download_view,
+                           thumbnail_view, TestErrorView)
 
 
 app_name = 'backend'
@@ -14,6 +15,9 @@ urlpatterns = [
     path('partner/tasks/<str:task_id>', PartnerUpdate.as_view(), name='task-status'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
+    path('partner/orders/feed', PartnerOrdersFeed.as_view(), name='partner-orders-feed'),
+    path('partner/export', PartnerExport.as_view(), name='partner-export'),
+    path('partner/export/<str:task_id>', PartnerExport.as_view(), name='partner-export-download'),
     path('user/register', RegisterAccount.as_view(), name='user-register'),
     path('user/register/confirm', ConfirmAccount.as_view(), name='user-register-confirm'),
     path('user/details', AccountDetails.as_view(), name='user-details'),
@@ -26,7 +30,11 @@ urlpatterns = [
     path('products', ProductInfoView.as_view(), name='products'),
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrderView.as_view(), name='order'),
+    path('order/<int:order_id>', OrderDetailView.as_view(), name='order-detail'),
     path('download_csv', download_csv_view, name='download-csv'),
+    path('invoice/<int:order_id>', invoice_download_view, name='order-invoice'),
+    path('thumbnails/<str:kind>/<int:object_id>/<int:width>x<int:height>', thumbnail_view,
+         name='thumbnail'),
     path('import-from-admin', ImportFromAdmin.as_view(), name='import-from-admin'),
     path('import-from-admin/tasks/<str:task_id>', ImportFromAdmin.as_view(), name='task-status-admin'),
     path('test-error/', TestErrorView.as_view(), name='test-error'),
@@ -1,9 +1,11 @@
-from .partner_views import PartnerUpdate, PartnerOrders, PartnerState
+from .partner_views import (PartnerUpdate, PartnerOrders, PartnerOrdersFeed,
+                            PartnerState, PartnerExport)
 from .user_views import (RegisterAccount, ConfirmAccount,
                          AccountDetails, LoginAccount, ContactView)
 from .basket_views import BasketView
-from .shops_views import CategoryView, ShopView, ProductInfoView, OrderView
-from .admin_export_views import download_csv_view
+from .shops_views import CategoryView, ShopView, ProductInfoView, OrderView, OrderDetailView
+from .admin_export_views import download_csv_view, invoice_download_view
 from .admin_import_views import ImportFromAdmin
+from .media_views import media_view, thumbnail_view
 from .social_auth_views import yandex_oauth_callback
 from .check_hawk_views import TestErrorView
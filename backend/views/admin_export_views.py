@@ -1,7 +1,12 @@
-from django.http import HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
 from django.views.decorators.http import require_GET
 from celery.result import AsyncResult
 from django.utils.safestring import mark_safe
+from backend.excel_utils import get_invoice_file
+from backend.export_utils import EXPORT_FORMATS, is_artifact_expired
+from backend.models import Order
 
 
 def get_task_status_html(current_url):
@@ -51,10 +56,94 @@ def get_task_status_html(current_url):
 """)
 
 
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range с одним диапазоном байт.
+
+    :param header: Значение заголовка, например "bytes=0-499"
+    :param size: Размер файла
+    :return: Кортеж (start, end) включительно, None если заголовок
+             не поддерживается, или ValueError если диапазон недостижим
+    """
+
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+
+    start, _, end = ranges.strip().partition('-')
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            # суффиксный диапазон: последние N байт
+            start = max(size - int(end), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= size:
+        raise ValueError('Диапазон вне файла')
+    return start, end
+
+
+def iter_file_range(file, start, length, chunk_size=FileResponse.block_size):
+    """Читает из файла length байт начиная с позиции start блоками."""
+
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def artifact_response(request, artifact):
+    """
+    Отдаёт файл экспорта из хранилища потоком.
+    Поддерживает запросы части файла (заголовок Range).
+    """
+
+    _, content_type = EXPORT_FORMATS[artifact['format']]
+    filename = artifact['filename']
+    file = default_storage.open(artifact['path'], 'rb')
+    size = artifact['size']
+    byte_range = None
+
+    if 'HTTP_RANGE' in request.META:
+        try:
+            byte_range = parse_range_header(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=True, filename=filename,
+                                content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(iter_file_range(file, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = f'"{artifact["checksum"]}"'
+    return response
+
+
+@staff_member_required
 @require_GET
 def download_csv_view(request):
     """
-    Позволяет пользователю скачать готовый Excel-файл
+    Позволяет администратору скачать готовый файл экспорта
     после завершения фоновой задачи обработки данных.
     Если файл ещё не готов, информирует о текущем статусе выполнения.
     """
@@ -65,20 +154,38 @@ def download_csv_view(request):
 
     result = AsyncResult(task_id)
 
-    if result.ready():
+    if result.failed():
+        return HttpResponse('Произошла ошибка при формировании файла',
+                            status=500)
+    elif result.ready():
         try:
-            csv_data = result.get()
-            response = HttpResponse(
-                csv_data,
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            response['Content-Disposition'] = 'attachment; filename="products_export.xlsx"'
-            return response
+            artifact = result.get()
         except Exception as e:
             return HttpResponse(f'Ошибка при получении данных: {str(e)}',
                                 status=500)
-    elif result.failed():
-        return HttpResponse('Произошла ошибка при формировании файла',
-                            status=500)
+        if not isinstance(artifact, dict) or 'path' not in artifact:
+            return HttpResponse('Файл не найден', status=404)
+        if is_artifact_expired(artifact) or not default_storage.exists(artifact['path']):
+            return HttpResponse('Срок хранения файла истёк', status=410)
+        return artifact_response(request, artifact)
     return HttpResponse(get_task_status_html(request.get_full_path()),
                         status=202)
+
+
+@staff_member_required
+@require_GET
+def invoice_download_view(request, order_id):
+    """
+    Позволяет администратору скачать накладную заказа.
+    Файл формируется только при первом запросе или после изменения заказа.
+    """
+
+    order = Order.objects.filter(id=order_id).exclude(
+        state='basket'
+    ).select_related('user', 'contact').first()
+    if not order:
+        return HttpResponse('Заказ не найден', status=404)
+
+    return FileResponse(default_storage.open(get_invoice_file(order, order.user), 'rb'),
+                        as_attachment=True, filename=f'invoice_{order.id}.xlsx',
+                        content_type=EXPORT_FORMATS['xlsx'][1])
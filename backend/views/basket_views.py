@@ -1,5 +1,6 @@
-from django.db import transaction
-from django.db.models import Sum, F, Prefetch
+from cacheops.invalidation import invalidate_dict
+from django.db import connection, transaction
+from django.db.models import F, Prefetch
 from django.http import JsonResponse
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -7,6 +8,51 @@ from backend.models import ProductInfo, Order, OrderItem
 from backend.permissions import IsAuthenticated
 from backend.serializers import OrderItemSerializer, OrderSerializer
 
+# Удаляет позиции корзины и возвращает их количество на склад одним запросом:
+# удалённые строки группируются по товару и присоединяются к ProductInfo.
+DELETE_AND_RESTOCK_SQL = f"""
+    WITH deleted AS (
+        DELETE FROM {OrderItem._meta.db_table}
+        WHERE order_id = %s AND id = ANY(%s)
+        RETURNING *
+    ),
+    restocked AS (
+        UPDATE {ProductInfo._meta.db_table} AS product_info
+        SET quantity = product_info.quantity + returned.quantity
+        FROM (
+            SELECT product_info_id, SUM(quantity) AS quantity
+            FROM deleted
+            GROUP BY product_info_id
+        ) AS returned
+        WHERE product_info.id = returned.product_info_id
+        RETURNING product_info.*
+    )
+    SELECT (SELECT json_agg(deleted) FROM deleted),
+           (SELECT json_agg(restocked) FROM restocked)
+"""
+
+
+def delete_and_restock(order_id, item_ids):
+    """
+    Удаляет позиции заказа и возвращает товары на склад.
+
+    :param order_id: ID заказа (корзины)
+    :param item_ids: Список ID позиций для удаления
+    :return: Количество удалённых позиций
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(DELETE_AND_RESTOCK_SQL, [order_id, list(item_ids)])
+        deleted, restocked = cursor.fetchone()
+
+    # запрос минует ORM, поэтому кэш cacheops сбрасываем вручную
+    for row in deleted or []:
+        invalidate_dict(OrderItem, row)
+    for row in restocked or []:
+        invalidate_dict(ProductInfo, row)
+
+    return len(deleted or [])
+
 
 class BasketView(APIView):
     """
@@ -31,8 +77,6 @@ class BasketView(APIView):
                          'product_info__product_parameters__parameter'
                      )
                      )
-        ).annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))
         )
 
         serializer = OrderSerializer(baskets, many=True)
@@ -121,6 +165,9 @@ class BasketView(APIView):
                             objects_created += 1
                         else:
                             raise ValueError(serializer.errors)
+
+                    # суммы корзины пересчитываются один раз на запрос
+                    basket.update_totals()
                     return JsonResponse({'Status': True,
                                          'Создано объектов': objects_created},
                                         status=201)
@@ -160,19 +207,9 @@ class BasketView(APIView):
                                          'Errors': 'Корзина не найдена'},
                                         status=404)
 
-                # получаем все позиции для удаления с информацией о товарах
-                order_items = OrderItem.objects.filter(order_id=basket.id,
-                                                       id__in=items_list
-                                                       ).select_related('product_info')
-
-                # возвращаем товары на склад
-                for item in order_items:
-                    ProductInfo.objects.filter(id=item.product_info_id).update(
-                        quantity=F('quantity') + item.quantity
-                    )
-
-                # удаляем позиции
-                deleted_count, _ = order_items.delete()
+                # удаляем позиции и возвращаем товары на склад
+                deleted_count = delete_and_restock(basket.id, items_list)
+                basket.update_totals()
 
                 # если не удалили ни одного элемента, хотя запрос был
                 if deleted_count == 0:
@@ -213,7 +250,7 @@ class BasketView(APIView):
                         continue
 
                     try:
-                        Order.objects.get(user_id=request.user.id, state='basket')
+                        basket = Order.objects.get(user_id=request.user.id, state='basket')
                     except Order.DoesNotExist:
                         errors.append('У вас нет активной корзины')
                         continue
@@ -260,6 +297,9 @@ class BasketView(APIView):
                     # если были ошибки, откатываем транзакцию и возвращаем ошибки
                     raise ValueError(errors)
 
+                if objects_updated:
+                    basket.update_totals()
+
                 return JsonResponse({'Status': True,
                                      'Обновлено объектов': objects_updated},
                                     status=200)
@@ -0,0 +1,166 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import stat
+from urllib.parse import quote
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET, require_safe
+from django.views.static import was_modified_since
+from backend.image_storage import content_digest
+from backend.image_utils import (FALLBACK_THUMBNAIL_FORMAT, SHARED_THUMBNAILS_DIR,
+                                 THUMBNAIL_FORMATS, THUMBNAIL_TARGETS, accepted_image_formats,
+                                 choose_variant, render_variants, thumbnail_variants,
+                                 thumbnails_version)
+from backend.media_utils import image_media_directories
+from backend.thumbnail_cache import get_thumbnail_cache
+
+# Файлы под хэшем содержимого никогда не меняются
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Каталоги миниатюр: для ссылки на JPEG-вариант формат выбирается по заголовку Accept
+THUMBNAIL_DIRS = (f'{SHARED_THUMBNAILS_DIR}/',
+                  *(f'{target.image_field_name}/thumbnails/' for target in THUMBNAIL_TARGETS.values()))
+ALTERNATIVE_THUMBNAIL_EXTENSIONS = tuple(f'.{image_format}' for image_format in THUMBNAIL_FORMATS
+                                         if image_format != FALLBACK_THUMBNAIL_FORMAT)
+
+
+@require_GET
+def thumbnail_view(request, kind, object_id, width, height):
+    """
+    Миниатюра изображения товара (kind=product) или аватара (kind=user)
+    допустимого размера из THUMBNAIL_ALLOWED_SIZES.
+
+    Миниатюра строится при первом запросе во всех форматах и хранится
+    в дисковом кэше; клиенту отдаётся самый маленький из принимаемых
+    им форматов (заголовок Accept). Адрес не меняется при замене
+    изображения, поэтому браузер проверяет актуальность по ETag.
+    """
+
+    target = THUMBNAIL_TARGETS.get(kind)
+    if target is None:
+        return JsonResponse({'Status': False, 'Errors': 'Неизвестный тип изображения'},
+                            status=404)
+    if (width, height) not in settings.THUMBNAIL_ALLOWED_SIZES:
+        return JsonResponse({'Status': False, 'Errors': 'Недопустимый размер миниатюры'},
+                            status=400)
+
+    image_name = (target.model.objects.filter(id=object_id)
+                  .values_list(target.image_field_name, flat=True).first())
+    if not image_name:
+        return JsonResponse({'Status': False, 'Errors': 'Изображение не найдено'}, status=404)
+
+    # Имя файла оригинала входит в ключ: после замены изображения строится новая запись
+    key = f'{kind}:{object_id}:{image_name}:{width}x{height}:{thumbnails_version([(width, height)])}'
+
+    def render():
+        with default_storage.open(image_name, 'rb') as file:
+            return render_variants(file.read(), (width, height))
+
+    accepted = accepted_image_formats(request.META.get('HTTP_ACCEPT'))
+    try:
+        # Запись может быть вытеснена между чтением из кэша и открытием файла:
+        # тогда она строится заново
+        for attempt in range(2):
+            variants, hit = get_thumbnail_cache().get_or_render(key, render)
+            image_format, variant = choose_variant(variants, accepted)
+            etag = f'"{hashlib.sha1(key.encode()).hexdigest()}-{image_format}"'
+            if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+                response = HttpResponseNotModified()
+                break
+            try:
+                response = FileResponse(open(variant['path'], 'rb'),
+                                        content_type=THUMBNAIL_FORMATS[image_format][1])
+            except FileNotFoundError:
+                if attempt:
+                    raise
+                continue
+            response['X-Thumbnail-Cache'] = 'HIT' if hit else 'MISS'
+            break
+    except OSError:
+        return JsonResponse({'Status': False, 'Errors': 'Изображение недоступно'}, status=404)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, no-cache'
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def send_media_file(full_path, name, content_type):
+    """
+    Ответ с файлом из MEDIA_ROOT. Если задан MEDIA_SERVE_BACKEND, файл
+    передаёт фронтенд-сервер (X-Accel-Redirect для nginx, X-Sendfile для
+    Apache/lighttpd), и воркер приложения не занят чтением файла.
+
+    :param full_path: Абсолютный путь к файлу
+    :param name: Путь файла относительно MEDIA_ROOT
+    :param content_type: MIME-тип ответа
+    :return: HttpResponse
+    """
+
+    backend = settings.MEDIA_SERVE_BACKEND
+    if backend == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(f'{settings.MEDIA_ACCEL_REDIRECT_PREFIX}{name}')
+    elif backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    return response
+
+
+@require_safe
+def media_view(request, path):
+    """
+    Отдаёт файл из MEDIA_ROOT.
+
+    Изображения и миниатюры (см. image_media_directories) доступны всем,
+    остальные файлы - только персоналу. Для миниатюр выбирается самый
+    маленький из принимаемых клиентом форматов. Файлы под хэшем содержимого
+    кэшируются навсегда (immutable), остальные - на MEDIA_CACHE_MAX_AGE секунд.
+    """
+
+    name = posixpath.normpath(path)
+    public = name.startswith(tuple(image_media_directories()))
+    if (name != path or name.startswith(('..', '/'))
+            or not (public or request.user.is_staff)):
+        return JsonResponse({'Status': False, 'Errors': 'Файл не найден'}, status=404)
+
+    image_format = None
+    if name.startswith(THUMBNAIL_DIRS) and not name.endswith(ALTERNATIVE_THUMBNAIL_EXTENSIONS):
+        image_format, variant = choose_variant(thumbnail_variants(name),
+                                               accepted_image_formats(request.META.get('HTTP_ACCEPT')))
+        if variant:
+            name = variant['path']
+
+    full_path = os.path.join(settings.MEDIA_ROOT, name)
+    try:
+        file_stat = os.stat(full_path)
+    except OSError:
+        file_stat = None
+    if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+        return JsonResponse({'Status': False, 'Errors': 'Файл не найден'}, status=404)
+
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), file_stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        if image_format:
+            content_type = THUMBNAIL_FORMATS[image_format][1]
+        else:
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        response = send_media_file(full_path, name, content_type)
+
+    response['Last-Modified'] = http_date(file_stat.st_mtime)
+    if not public:
+        response['Cache-Control'] = 'private, no-cache'
+    elif content_digest(name):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response['Cache-Control'] = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+    if image_format:
+        patch_vary_headers(response, ('Accept',))
+    return response
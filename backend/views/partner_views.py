@@ -1,13 +1,22 @@
+from datetime import timedelta
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.core.validators import URLValidator
-from django.db.models import Sum, F, Q, Prefetch
+from django.db.models import Prefetch, Q
 from django.http import JsonResponse
+from django.utils import timezone
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from backend.models import Shop, Order, OrderItem, ProductParameter
+from backend.models import Shop, ShopOrder, OrderItem, ProductParameter
+from backend.pagination import (OrderCursorPagination,
+                                encode_feed_cursor, decode_feed_cursor)
 from backend.permissions import IsShopUser, IsAuthenticated
-from backend.serializers import ShopSerializer, PartnerOrderSerializer
-from backend.tasks import do_import
+from backend.serializers import (ShopSerializer, PartnerOrderSerializer,
+                                 PartnerFeedSerializer)
+from backend.export_utils import EXPORT_WRITERS, is_artifact_expired, parse_export_filters
+from backend.tasks import do_import, export_products
+from backend.views.admin_export_views import artifact_response
 from celery.result import AsyncResult
 from django.urls import reverse
 from django.core.cache import cache
@@ -142,26 +151,19 @@ class PartnerOrders(APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        Получение списка заказов для магазина,
-        только заказы, где есть товары этого магазина
+        Получение списка заказов для магазина (постранично),
+        только поставки этого магазина
         """
 
-        user_id = request.user.id
+        shop_id = Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True).first()
 
-        order_ids = Order.objects.filter(
-            ordered_items__product_info__shop__user_id=user_id
-        ).exclude(state='basket').distinct().values_list('id', flat=True)
-
-        orders = Order.objects.filter(id__in=order_ids).annotate(
-            partner_sum=Sum(
-                F('ordered_items__quantity') * F('ordered_items__product_info__price'),
-                filter=Q(ordered_items__product_info__shop__user_id=user_id)
-            )
+        shop_orders = ShopOrder.objects.filter(
+            shop_id=shop_id
+        ).select_related(
+            'order__contact'
         ).prefetch_related(
-            Prefetch('ordered_items',
-                     queryset=OrderItem.objects.filter(
-                         product_info__shop__user_id=user_id
-                     ).select_related(
+            Prefetch('items',
+                     queryset=OrderItem.objects.select_related(
                          'product_info__shop',
                          'product_info__product__category'
                      ).prefetch_related(
@@ -170,7 +172,143 @@ class PartnerOrders(APIView):
                                   )
                      )
                      )
-        ).select_related('contact')
+        )
 
-        serializer = PartnerOrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(shop_orders, request, view=self)
+        serializer = PartnerOrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class PartnerOrdersFeed(APIView):
+    """Класс для инкрементальной синхронизации заказов магазина."""
+
+    permission_classes = [IsAuthenticated, IsShopUser]
+    default_limit = 100
+    max_limit = 500
+
+    def get(self, request, *args, **kwargs):
+        """
+        Получение поставок магазина, созданных или изменённых
+        после позиции, переданной в курсоре. Изменения моложе
+        PARTNER_FEED_LAG секунд не отдаются, пока не зафиксированы
+        все транзакции, которые могли записать более раннее время.
+        """
+
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', self.default_limit)),
+                               self.max_limit))
+        except (TypeError, ValueError):
+            return JsonResponse({'Status': False,
+                                 'Errors': 'Параметр "limit" должен быть числом.'},
+                                status=400)
+
+        shop_id = Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True).first()
+
+        # курсоры всегда разные, поэтому кэшировать ленту бессмысленно
+        shop_orders = ShopOrder.objects.nocache().filter(
+            shop_id=shop_id,
+            updated_at__lt=timezone.now() - timedelta(seconds=settings.PARTNER_FEED_LAG)
+        ).select_related('order').prefetch_related(
+            Prefetch('items',
+                     queryset=OrderItem.objects.nocache().select_related('product_info'))
+        ).order_by('updated_at', 'id')
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                updated_at, last_id = decode_feed_cursor(cursor)
+            except ValueError as error:
+                return JsonResponse({'Status': False,
+                                     'Errors': str(error)},
+                                    status=400)
+            shop_orders = shop_orders.filter(
+                Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=last_id)
+            )
+
+        page = list(shop_orders[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        if page:
+            cursor = encode_feed_cursor(page[-1].updated_at, page[-1].id)
+
+        return Response({'orders': PartnerFeedSerializer(page, many=True).data,
+                         'cursor': cursor,
+                         'has_more': has_more})
+
+
+class PartnerExport(APIView):
+    """Класс для выгрузки каталога магазина в файл."""
+
+    permission_classes = [IsAuthenticated, IsShopUser]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Запускает выгрузку товаров своего магазина.
+        Поддерживаются фильтры category_id, price_min, price_max, updated_since
+        и формат format: xlsx, csv (gzip) или jsonl.
+        """
+
+        file_format = request.data.get('format', 'xlsx')
+        if file_format not in EXPORT_WRITERS:
+            return JsonResponse({'Status': False,
+                                 'Errors': f'Поддерживаемые форматы: {", ".join(EXPORT_WRITERS)}'},
+                                status=400)
+
+        shop_id = Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True).first()
+        if shop_id is None:
+            return JsonResponse({'Status': False,
+                                 'Errors': 'Магазин не найден'},
+                                status=404)
+
+        try:
+            filters = parse_export_filters({
+                'category_id': request.data.get('category_id'),
+                'price_min': request.data.get('price_min'),
+                'price_max': request.data.get('price_max'),
+                'updated_since': request.data.get('updated_since'),
+            })
+        except ValueError as error:
+            return JsonResponse({'Status': False,
+                                 'Errors': str(error)},
+                                status=400)
+        filters['shop_id'] = shop_id
+
+        task = export_products.delay(filters, file_format)
+        cache.set(f"export_owner_{task.id}", request.user.id, timeout=86400)
+        return JsonResponse({'Status': True,
+                             'task_id': task.id,
+                             'download_url': reverse('backend:partner-export-download',
+                                                     kwargs={'task_id': task.id})},
+                            status=202)
+
+    def get(self, request, task_id, *args, **kwargs):
+        """Скачивание готового файла выгрузки."""
+
+        if cache.get(f'export_owner_{task_id}') != request.user.id:
+            return JsonResponse({'Status': False,
+                                 'Error': 'Задачи не существует.'},
+                                status=404)
+
+        task = AsyncResult(task_id)
+        if task.failed():
+            return JsonResponse({'Status': False,
+                                 'Error': str(task.result),
+                                 'task_status': 'FAILED'},
+                                status=400)
+        if not task.ready():
+            return JsonResponse({'Status': True,
+                                 'task_status': 'PENDING'},
+                                status=202)
+
+        artifact = task.get()
+        if not isinstance(artifact, dict) or 'path' not in artifact:
+            return JsonResponse({'Status': False,
+                                 'Error': 'Задачи не существует.'},
+                                status=404)
+        if is_artifact_expired(artifact) or not default_storage.exists(artifact['path']):
+            return JsonResponse({'Status': False,
+                                 'Error': 'Срок хранения файла истёк'},
+                                status=410)
+        return artifact_response(request, artifact)
@@ -1,14 +1,17 @@
 from rest_framework.request import Request
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F, Prefetch
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Prefetch
+from django.utils import timezone
 from django.http import JsonResponse
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from backend.models import Shop, Category, ProductInfo, Order, OrderItem, ProductParameter
+from backend.pagination import OrderCursorPagination
 from backend.permissions import IsAuthenticated
 from backend.serializers import (CategorySerializer, ShopSerializer, Contact,
-                                 ProductInfoSerializer, OrderSerializer)
+                                 ProductInfoSerializer, OrderSerializer,
+                                 OrderSummarySerializer)
 from backend.signals import new_order
 
 
@@ -51,13 +54,45 @@ class ProductInfoView(APIView):
         return Response(serializer.data)
 
 
+def ordered_items_prefetch(with_parameters=True):
+    """
+    Формирует предзагрузку позиций заказа.
+
+    :param with_parameters: Загружать ли категории и параметры товаров
+    :return: Объект Prefetch для позиций заказа
+    """
+
+    if not with_parameters:
+        return Prefetch('ordered_items',
+                        queryset=OrderItem.objects.select_related(
+                            'product_info__product',
+                            'product_info__shop'
+                        ))
+
+    return Prefetch('ordered_items',
+                    queryset=OrderItem.objects.select_related(
+                        'product_info__product__category',
+                        'product_info__shop'
+                    ).prefetch_related(
+                        Prefetch('product_info__product_parameters',
+                                 queryset=ProductParameter.objects.select_related('parameter')
+                                 )
+                    )
+                    )
+
+
 class OrderView(APIView):
     """Класс для получения и размещения заказов пользователями."""
 
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        """Получение списка заказов пользователя (исключая корзину)."""
+        """
+        Получение списка заказов пользователя (исключая корзину) постранично.
+        С параметром summary=true возвращается краткий вид без параметров товаров.
+        """
+
+        summary = request.query_params.get('summary', '').lower() in ('1', 'true')
 
         orders = Order.objects.filter(
             user_id=request.user.id
@@ -66,22 +101,14 @@ class OrderView(APIView):
         ).select_related(
             'contact'
         ).prefetch_related(
-            Prefetch('ordered_items',
-                     queryset=OrderItem.objects.select_related(
-                         'product_info__product__category',
-                         'product_info__shop'
-                     ).prefetch_related(
-                         Prefetch('product_info__product_parameters',
-                                  queryset=ProductParameter.objects.select_related('parameter')
-                                  )
-                     )
-                     )
-        ).annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))
-        ).distinct()
-
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+            ordered_items_prefetch(with_parameters=not summary)
+        )
+
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        serializer_class = OrderSummarySerializer if summary else OrderSerializer
+        serializer = serializer_class(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, *args, **kwargs):
         """Оформление заказа из корзины покупок."""
@@ -110,9 +137,17 @@ class OrderView(APIView):
                     return JsonResponse({'Status': False,
                                          'Errors': 'Контакт не найден'},
                                         status=404)
-                is_updated = Order.objects.filter(user_id=request.user.id,
-                                                  id=order_id).update(contact_id=contact_id,
-                                                                      state='new')
+                with transaction.atomic():
+                    is_updated = Order.objects.filter(user_id=request.user.id,
+                                                      id=order_id,
+                                                      state='basket').update(contact_id=contact_id,
+                                                                             state='new',
+                                                                             updated_at=timezone.now())
+                    if is_updated:
+                        order.split_by_shops()
+                        new_order.send(sender=self.__class__,
+                                       user_id=request.user.id,
+                                       order_id=order.id)
 
             except IntegrityError as error:
                 return JsonResponse({'Status': False,
@@ -120,8 +155,35 @@ class OrderView(APIView):
                                     status=400)
             else:
                 if is_updated:
-                    new_order.send(sender=self.__class__, user_id=request.user.id)
                     return JsonResponse({'Status': True}, status=200)
         return JsonResponse({'Status': False,
                              'Errors': 'Необходимые поля отсутствуют.'},
                             status=400)
+
+
+class OrderDetailView(APIView):
+    """Класс для получения одного заказа пользователя."""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, order_id, *args, **kwargs):
+        """Получение заказа пользователя со всеми позициями."""
+
+        order = Order.objects.filter(
+            user_id=request.user.id,
+            id=order_id
+        ).exclude(
+            state='basket'
+        ).select_related(
+            'contact'
+        ).prefetch_related(
+            ordered_items_prefetch()
+        ).first()
+
+        if not order:
+            return JsonResponse({'Status': False,
+                                 'Errors': 'Заказ не найден'},
+                                status=404)
+
+        serializer = OrderSerializer(order)
+        return Response(serializer.data)
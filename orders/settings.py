@@ -34,6 +34,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# В тестах превышение бюджета запросов задачи - ошибка, в работе - предупреждение в лог
+QUERY_BUDGET_STRICT = 'test' in sys.argv
+
 if 'test' in sys.argv:
     SILKY_META = False
     SILKY_ANALYZE_QUERIES = False
@@ -155,6 +158,27 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Миниатюры имеют детерминированные имена и перезаписываются на месте,
+# поэтому для них отдельное хранилище без переименования дубликатов.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'thumbnails': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'allow_overwrite': True},
+    },
+    # Оригиналы изображений хранятся под хэшем содержимого, одинаковые файлы - один раз
+    'images': {
+        'BACKEND': 'backend.image_storage.ContentAddressedStorage',
+    },
+}
+# Через сколько секунд после освобождения последней ссылки файл изображения можно удалить
+IMAGE_GC_DELAY = int(os.getenv("IMAGE_GC_DELAY", 24 * 60 * 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -170,6 +194,15 @@ EMAIL_PORT = os.getenv("EMAIL_PORT")
 EMAIL_USE_TLS = True
 SERVER_EMAIL = EMAIL_HOST_USER
 
+# Очередь исходящих писем: размер порции, задержка объединения писем (сек),
+# число попыток, базовая задержка повторной отправки (сек) и время (сек),
+# после которого письма, забранные упавшим воркером, отправляются снова
+EMAIL_OUTBOX_BATCH_SIZE = 200
+EMAIL_COALESCE_DELAY = 30
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_DELAY = 60
+EMAIL_CLAIM_TIMEOUT = 10 * 60
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 40,
@@ -219,6 +252,56 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Moscow'
+CELERY_BEAT_SCHEDULE = {
+    'cleanup-export-artifacts': {
+        'task': 'cleanup_export_artifacts',
+        'schedule': 3600,
+    },
+    'send-outbox-emails': {
+        'task': 'send_outbox_emails',
+        'schedule': 60,
+    },
+    'collect-unused-images': {
+        'task': 'collect_unused_images',
+        'schedule': 3600,
+    },
+    'collect-orphaned-media': {
+        'task': 'collect_orphaned_media',
+        'schedule': 24 * 3600,
+    },
+}
+
+# Лента заказов партнёра отдаёт только изменения старше этой задержки (сек):
+# updated_at присваивается до фиксации транзакции, и долгая транзакция
+# может записать время раньше уже выданного курсора
+PARTNER_FEED_LAG = int(os.getenv("PARTNER_FEED_LAG", 5))
+
+# Файлы экспорта: каталог в хранилище и срок хранения (в секундах)
+EXPORT_ARTIFACTS_DIR = 'exports'
+EXPORT_ARTIFACT_TTL = int(os.getenv("EXPORT_ARTIFACT_TTL", 24 * 60 * 60))
+
+# Количество процессов для пакетного формирования накладных (None - по числу ядер)
+INVOICE_WORKERS = int(os.getenv("INVOICE_WORKERS", 0)) or None
+
+# Миниатюры по запросу: допустимые размеры и дисковый кэш
+THUMBNAIL_ALLOWED_SIZES = [(50, 50), (100, 100), (150, 150), (200, 200),
+                           (300, 300), (400, 400), (600, 600)]
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", os.path.join(BASE_DIR, 'thumbnail_cache'))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# Отдача медиафайлов: '' - самим приложением, 'x-accel-redirect' - через nginx
+# (internal-location с префиксом MEDIA_ACCEL_REDIRECT_PREFIX), 'x-sendfile' - через Apache/lighttpd.
+# Файлы с обычными именами кэшируются браузером на MEDIA_CACHE_MAX_AGE секунд.
+MEDIA_SERVE_BACKEND = os.getenv("MEDIA_SERVE_BACKEND", "")
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Загрузка изображений товаров по ссылкам из прайса: потоки, одновременные запросы
+# к одному хосту, таймаут (в секундах) и наибольший размер файла
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", 8))
+IMAGE_FETCH_PER_HOST = int(os.getenv("IMAGE_FETCH_PER_HOST", 2))
+IMAGE_FETCH_TIMEOUT = 10
+IMAGE_FETCH_MAX_BYTES = 20 * 1024 * 1024
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -318,6 +401,10 @@ CACHEOPS = {
 
     # Не кешировать вообще
     'migrations.*': {'ops': (), 'timeout': 0},
+    # Очередь писем меняется постоянно
+    'backend.outgoingemail': {'ops': (), 'timeout': 0},
+    # Счётчики ссылок на файлы изображений обновляются через update()
+    'backend.imageblob': {'ops': (), 'timeout': 0},
 }
 
 SILKY_PYTHON_PROFILER = True
@@ -19,7 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
-from backend.views import yandex_oauth_callback
+from backend.views import media_view, yandex_oauth_callback
 
 
 urlpatterns = [
@@ -38,10 +38,12 @@ urlpatterns = [
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
 
     path('silk/', include('silk.urls', namespace='silk')),
+
+    # Медиафайлы с проверкой доступа; передачу файла выполняет фронтенд-сервер
+    # (см. MEDIA_SERVE_BACKEND)
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', media_view, name='media'),
 ]
 
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL,
                           document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
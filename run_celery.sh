@@ -1 +1 @@
-celery -A orders worker -c 1 -l info -P gevent
\ No newline at end of file
+celery -A orders worker -B -c 1 -l info -P gevent
\ No newline at end of file
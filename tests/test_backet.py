@@ -1,3 +1,4 @@
+from unittest.mock import patch
 from backend.models import Category, Shop, Product, ProductInfo, OrderItem, Order
 from rest_framework.test import APITestCase, APIClient
 from rest_framework.authtoken.models import Token
@@ -115,3 +116,123 @@ class BasketViewTests(APITestCase):
                                       format='json')
         self.assertEqual(response.status_code, 200)
         self.assertFalse(OrderItem.objects.filter(id=order_item.id).exists())
+
+    def test_delete_basket_items_returns_stock(self):
+        """Позитивный тест: удаление нескольких позиций возвращает товар на склад"""
+
+        second_info = ProductInfo.objects.create(product=self.product,
+                                                 shop=self.shop,
+                                                 external_id=54321,
+                                                 price=50,
+                                                 price_rrc=60,
+                                                 quantity=7)
+        order = Order.objects.create(user=self.user, state='basket')
+        first_item = OrderItem.objects.create(order=order,
+                                              product_info=self.product_info,
+                                              quantity=3)
+        second_item = OrderItem.objects.create(order=order,
+                                               product_info=second_info,
+                                               quantity=2)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.delete(self.url,
+                                      data={'items': f'{first_item.id},{second_item.id}'},
+                                      format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['Удалено объектов'], 2)
+        self.assertFalse(OrderItem.objects.filter(order=order).exists())
+
+        self.product_info.refresh_from_db()
+        second_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, 13)
+        self.assertEqual(second_info.quantity, 9)
+
+    def test_delete_basket_items_foreign_item(self):
+        """Негативный тест: позиции чужой корзины не удаляются"""
+
+        other_user = User.objects.create_user(email='other@example.com',
+                                              password='testpassword',
+                                              is_active=True)
+        other_order = Order.objects.create(user=other_user, state='basket')
+        other_item = OrderItem.objects.create(order=other_order,
+                                              product_info=self.product_info,
+                                              quantity=1)
+        Order.objects.create(user=self.user, state='basket')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        response = self.client.delete(self.url,
+                                      data={'items': str(other_item.id)},
+                                      format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(OrderItem.objects.filter(id=other_item.id).exists())
+        self.product_info.refresh_from_db()
+        self.assertEqual(self.product_info.quantity, 10)
+
+    def test_basket_price_snapshot_and_totals(self):
+        """Позитивный тест: цена фиксируется при резервировании, сумма хранится в заказе"""
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        items = [{'product_info': self.product_info.id, 'quantity': 3}]
+        response = self.client.post(self.url,
+                                    data={'items': items},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+
+        # партнёр меняет цену после резервирования
+        ProductInfo.objects.filter(id=self.product_info.id).update(price=500)
+
+        order = Order.objects.get(user=self.user, state='basket')
+        item = order.ordered_items.get()
+        self.assertEqual(item.price, 100)
+        self.assertEqual(order.total_sum, 300)
+        self.assertEqual(order.shop_totals, {str(self.shop.id): 300})
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()[0]['total_sum'], 300)
+
+        response = self.client.delete(self.url,
+                                      data={'items': str(item.id)},
+                                      format='json')
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual(order.total_sum, 0)
+        self.assertEqual(order.shop_totals, {})
+
+    def test_totals_recalculated_once_per_request(self):
+        """Позитивный тест: суммы пересчитываются один раз на запрос, а не на каждую позицию"""
+
+        infos = [ProductInfo.objects.create(product=self.product, shop=self.shop,
+                                            external_id=100 + number, price=10 * number,
+                                            price_rrc=120, quantity=10)
+                 for number in range(1, 4)]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+        with patch.object(Order, 'update_totals', autospec=True,
+                          side_effect=Order.update_totals) as update_totals:
+            response = self.client.post(self.url,
+                                        data={'items': [{'product_info': info.id, 'quantity': 1}
+                                                        for info in infos]},
+                                        format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(update_totals.call_count, 1)
+
+            items = Order.objects.get(user=self.user, state='basket').ordered_items.all()
+            response = self.client.put(self.url,
+                                       data={'items': [{'id': item.id, 'quantity': 2}
+                                                       for item in items]},
+                                       format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(update_totals.call_count, 2)
+
+        self.assertEqual(Order.objects.get(user=self.user, state='basket').total_sum, 120)
+
+    def test_totals_after_product_info_delete(self):
+        """Позитивный тест: удаление товара магазина пересчитывает суммы затронутых заказов"""
+
+        order = Order.objects.create(user=self.user, state='basket')
+        OrderItem.objects.create(order=order, product_info=self.product_info, quantity=2)
+        order.update_totals()
+
+        self.product_info.delete()
+
+        order.refresh_from_db()
+        self.assertEqual(order.total_sum, 0)
+        self.assertEqual(order.shop_totals, {})
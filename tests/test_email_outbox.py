@@ -0,0 +1,192 @@
+import os
+import socketserver
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import patch
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from backend.email_utils import claim_outbox_batch, queue_email, send_outbox_batch
+from backend.models import OutgoingEmail
+from backend.tasks import send_outbox_emails
+from tests.utils import TemporaryMediaMixin
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-сервер: принимает письма и отклоняет адреса из server.rejected."""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            if command == 'EHLO':
+                self.reply('250 localhost')
+            elif command == 'RCPT':
+                rejected = any(address in line for address in self.server.rejected)
+                self.reply('550 Rejected' if rejected else '250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.messages += 1
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = 0
+        self.rejected = set()
+
+
+@override_settings(EMAIL_HOST_USER='shop@example.com')
+class EmailOutboxTests(TemporaryMediaMixin, TestCase):
+    """Тесты очереди исходящих писем."""
+
+    def test_queue_email_per_recipient(self):
+        """Позитивный тест: письмо ставится в очередь для каждого получателя"""
+
+        queue_email('Тема', 'Текст', ['a@example.com', 'b@example.com'])
+
+        self.assertEqual(OutgoingEmail.objects.filter(status='pending').count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_status_changes_coalesced(self):
+        """Позитивный тест: быстрые смены статуса заказа дают одно письмо"""
+
+        for state in ('confirmed', 'assembled', 'sent'):
+            queue_email(f'Статус заказа: {state}', state, ['user@example.com'],
+                        coalesce_key='order_state:1')
+        queue_email('Статус заказа: sent', 'sent', ['user@example.com'],
+                    coalesce_key='order_state:2')
+
+        emails = OutgoingEmail.objects.filter(coalesce_key='order_state:1')
+        self.assertEqual(emails.count(), 1)
+        self.assertEqual(emails.get().subject, 'Статус заказа: sent')
+        self.assertGreater(emails.get().send_after, timezone.now())
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+    def test_send_batch_with_attachment(self):
+        """Позитивный тест: отправка готовых писем с вложением"""
+
+        queue_email('Накладная', 'Текст', ['admin@example.com'],
+                    attachment=b'PK data', attachment_name='invoice_1.xlsx')
+        queue_email('Отложенное', 'Текст', ['user@example.com'], coalesce_key='order_state:1')
+        attachment_path = OutgoingEmail.objects.get(to='admin@example.com').attachment.path
+
+        result = send_outbox_emails()
+
+        self.assertEqual(result, {'sent': 1, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'invoice_1.xlsx')
+        self.assertEqual(mail.outbox[0].from_email, 'shop@example.com')
+        self.assertEqual(OutgoingEmail.objects.filter(status='sent').count(), 1)
+        self.assertEqual(OutgoingEmail.objects.filter(status='pending').count(), 1)
+        self.assertFalse(os.path.exists(attachment_path))
+        self.assertFalse(OutgoingEmail.objects.get(to='admin@example.com').attachment)
+
+    def test_sending_scheduled_once(self):
+        """Позитивный тест: задача отправки ставится, только если очередь была пуста"""
+
+        with patch('backend.tasks.send_outbox_emails.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                queue_email('Первое', 'Текст', ['a@example.com', 'b@example.com'])
+            with self.captureOnCommitCallbacks(execute=True):
+                queue_email('Второе', 'Текст', ['c@example.com'])
+            with self.captureOnCommitCallbacks(execute=True):
+                queue_email('Статус', 'Текст', ['d@example.com'], coalesce_key='order_state:1')
+
+        delay.assert_called_once_with()
+
+    def test_claimed_emails_not_claimed_twice(self):
+        """Позитивный тест: забранные письма не выдаются повторно до истечения срока"""
+
+        queue_email('Тема', 'Текст', ['a@example.com', 'b@example.com'])
+
+        self.assertEqual(len(claim_outbox_batch(10)), 2)
+        self.assertEqual(OutgoingEmail.objects.filter(status='sending').count(), 2)
+        self.assertEqual(claim_outbox_batch(10), [])
+
+        OutgoingEmail.objects.update(send_after=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_outbox_batch(10)), 2)
+
+    def test_unavailable_server_returns_emails(self):
+        """Негативный тест: при недоступном SMTP-сервере письма возвращаются в очередь"""
+
+        queue_email('Тема', 'Текст', ['a@example.com'])
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.open',
+                   side_effect=OSError('Connection refused')):
+            with self.assertRaises(OSError):
+                send_outbox_batch(10)
+
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ('pending', 0))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                   EMAIL_HOST='127.0.0.1', EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+                   EMAIL_USE_TLS=False, EMAIL_OUTBOX_BATCH_SIZE=500)
+class EmailOutboxSMTPTests(TemporaryMediaMixin, TestCase):
+    """Тесты отправки очереди через локальный SMTP-сервер."""
+
+    def setUp(self):
+        self.server = SMTPStandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.smtp_settings = override_settings(EMAIL_PORT=self.server.server_address[1])
+        self.smtp_settings.enable()
+        self.addCleanup(self.smtp_settings.disable)
+
+    def test_batch_uses_one_connection(self):
+        """Позитивный тест: порция писем уходит через одно SMTP-соединение"""
+
+        OutgoingEmail.objects.bulk_create(
+            OutgoingEmail(to=f'user{number}@example.com', from_email='shop@example.com',
+                          subject='Статус заказа', body='Текст', send_after=timezone.now())
+            for number in range(1000)
+        )
+
+        started = time.monotonic()
+        result = send_outbox_emails()
+        per_minute = 1000 / (time.monotonic() - started) * 60
+
+        self.assertEqual(result, {'sent': 1000, 'failed': 0})
+        self.assertEqual(self.server.messages, 1000)
+        self.assertEqual(self.server.connections, 2)
+        self.assertGreater(per_minute, 1000)
+
+    def test_failed_email_retried_with_backoff(self):
+        """Негативный тест: отклонённое письмо откладывается, затем помечается ошибкой"""
+
+        self.server.rejected.add('bad@example.com')
+        queue_email('Тема', 'Текст', ['bad@example.com', 'good@example.com'],
+                    from_email='shop@example.com')
+
+        self.assertEqual(send_outbox_batch(10), (1, 1))
+        email = OutgoingEmail.objects.get(to='bad@example.com')
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.send_after, timezone.now() + timedelta(seconds=50))
+
+        with override_settings(EMAIL_MAX_ATTEMPTS=2):
+            OutgoingEmail.objects.filter(id=email.id).update(send_after=timezone.now())
+            send_outbox_batch(10)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+        self.assertIn('Rejected', email.last_error)
@@ -0,0 +1,250 @@
+import csv
+import gzip
+import json
+import os
+from datetime import timedelta
+from io import BytesIO
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from django.utils import timezone
+from openpyxl import load_workbook
+from backend.export_utils import cleanup_export_artifacts, parse_export_filters
+from backend.models import (Shop, Category, Product, ProductInfo, User,
+                            Parameter, ProductParameter)
+from backend.tasks import export_products
+from tests.utils import TemporaryMediaMixin
+
+
+class ExportProductsTests(TemporaryMediaMixin, APITestCase):
+    """Тесты экспорта товаров в файл хранилища и его скачивания."""
+
+    def setUp(self):
+        cache.clear()
+        self.shop_user = User.objects.create_user(email='shop@example.com',
+                                                  password='testpassword',
+                                                  is_active=True,
+                                                  type='shop')
+        self.shop = Shop.objects.create(name='Test Shop', user=self.shop_user)
+        other_shop = Shop.objects.create(name='Other Shop')
+        category = Category.objects.create(name='Test Category')
+        self.ids = []
+        for number in range(1, 4):
+            product = Product.objects.create(name=f'Product {number}', category=category)
+            product_info = ProductInfo.objects.create(product=product,
+                                                      shop=self.shop,
+                                                      external_id=number,
+                                                      price=100 * number,
+                                                      price_rrc=120,
+                                                      quantity=10)
+            self.ids.append(product_info.id)
+        self.other_id = ProductInfo.objects.create(product=product,
+                                                   shop=other_shop,
+                                                   external_id=1,
+                                                   price=100,
+                                                   price_rrc=120,
+                                                   quantity=10).id
+        self.url = reverse('backend:download-csv') + '?task_id=test-task'
+        self.staff = User.objects.create_user(email='admin@example.com', password='testpassword',
+                                              is_active=True, is_staff=True)
+
+    def download(self, artifact, login=True, **headers):
+        if login:
+            self.client.force_login(self.staff)
+        with patch('backend.views.admin_export_views.AsyncResult') as result:
+            result.return_value.failed.return_value = False
+            result.return_value.ready.return_value = True
+            result.return_value.get.return_value = artifact
+            return self.client.get(self.url, **headers)
+
+    def test_export_returns_metadata(self):
+        """Позитивный тест: задача сохраняет файл и возвращает его метаданные"""
+
+        artifact = export_products({'ids': self.ids})
+
+        self.assertEqual(set(artifact), {'path', 'filename', 'format', 'size', 'checksum', 'expires_at'})
+        self.assertTrue(artifact['path'].startswith('exports/'))
+        self.assertEqual(artifact['size'], default_storage.size(artifact['path']))
+
+        with default_storage.open(artifact['path']) as file:
+            rows = list(load_workbook(file).active.iter_rows(values_only=True))
+        self.assertEqual(rows[0][0], 'ID')
+        self.assertEqual([row[0] for row in rows[1:]], self.ids)
+
+    def test_download_full_file(self):
+        """Позитивный тест: файл отдаётся целиком потоком"""
+
+        artifact = export_products({'ids': self.ids})
+        response = self.download(artifact)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('filename="products_export.xlsx"', response['Content-Disposition'])
+        content = b''.join(response.streaming_content)
+        self.assertEqual(len(content), artifact['size'])
+        load_workbook(BytesIO(content))
+
+    def test_download_range(self):
+        """Позитивный тест: отдаётся запрошенная часть файла"""
+
+        artifact = export_products({'ids': self.ids})
+        response = self.download(artifact, HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f"bytes 10-19/{artifact['size']}")
+        with default_storage.open(artifact['path']) as file:
+            expected = file.read()[10:20]
+        self.assertEqual(b''.join(response.streaming_content), expected)
+
+    def test_download_range_not_satisfiable(self):
+        """Негативный тест: диапазон за пределами файла"""
+
+        artifact = export_products({'ids': self.ids})
+        response = self.download(artifact, HTTP_RANGE=f"bytes={artifact['size']}-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f"bytes */{artifact['size']}")
+
+    def test_download_expired(self):
+        """Негативный тест: файл с истёкшим сроком хранения не отдаётся"""
+
+        artifact = export_products({'ids': self.ids})
+        artifact['expires_at'] = (timezone.now() - timedelta(minutes=1)).isoformat()
+
+        self.assertEqual(self.download(artifact).status_code, 410)
+
+    def test_download_forbidden_or_missing(self):
+        """Негативный тест: скачивание без прав персонала и по задаче без файла"""
+
+        artifact = export_products({'ids': self.ids})
+
+        response = self.download(artifact, login=False)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/admin/login/', response['Location'])
+
+        self.assertEqual(self.download(None).status_code, 404)
+        self.assertEqual(self.download('unexpected').status_code, 404)
+
+    @override_settings(EXPORT_ARTIFACT_TTL=60)
+    def test_cleanup_expired_artifacts(self):
+        """Позитивный тест: удаляются только просроченные файлы"""
+
+        old = export_products({'ids': self.ids})
+        fresh = export_products({'ids': self.ids})
+        old_time = (timezone.now() - timedelta(minutes=5)).timestamp()
+        os.utime(default_storage.path(old['path']), (old_time, old_time))
+
+        self.assertEqual(cleanup_export_artifacts(), 1)
+        self.assertFalse(default_storage.exists(old['path']))
+        self.assertTrue(default_storage.exists(fresh['path']))
+
+    def test_export_parameters_without_extra_queries(self):
+        """Позитивный тест: число запросов не зависит от количества параметров"""
+
+        for number in range(5):
+            parameter = Parameter.objects.create(name=f'Param {number}')
+            for product_info_id in self.ids:
+                ProductParameter.objects.create(product_info_id=product_info_id,
+                                                parameter=parameter,
+                                                value=str(number))
+
+        with self.assertNumQueries(2):
+            artifact = export_products({'ids': self.ids}, 'jsonl')
+
+        with default_storage.open(artifact['path']) as file:
+            items = [json.loads(line) for line in file]
+        self.assertEqual(items[0]['parameters']['Param 4'], '4')
+
+    def test_export_by_filters(self):
+        """Позитивный тест: выборка по магазину, цене и дате изменения"""
+
+        artifact = export_products({'shop_id': self.shop.id, 'price_min': 200}, 'jsonl')
+        with default_storage.open(artifact['path']) as file:
+            items = [json.loads(line) for line in file]
+        self.assertEqual([item['id'] for item in items], self.ids[1:])
+        self.assertEqual(items[0]['shop'], 'Test Shop')
+
+        future = (timezone.now() + timedelta(minutes=1)).isoformat()
+        artifact = export_products(parse_export_filters({'updated_since': future}), 'jsonl')
+        self.assertEqual(artifact['size'], 0)
+
+    def test_export_csv_gzip(self):
+        """Позитивный тест: CSV сжимается gzip"""
+
+        artifact = export_products({'price_max': 100}, 'csv')
+        self.assertTrue(artifact['path'].endswith('.csv.gz'))
+        with default_storage.open(artifact['path']) as file:
+            rows = list(csv.reader(gzip.decompress(file.read()).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0][0], 'id')
+        self.assertEqual([int(row[0]) for row in rows[1:]], [self.ids[0], self.other_id])
+
+        response = self.download(artifact)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+
+    def test_parse_export_filters_invalid(self):
+        """Негативный тест: некорректные значения фильтров"""
+
+        with self.assertRaises(ValueError):
+            parse_export_filters({'price_min': 'abc'})
+        with self.assertRaises(ValueError):
+            parse_export_filters({'updated_since': 'yesterday'})
+
+    def test_partner_export(self):
+        """Позитивный тест: партнёр выгружает только свой каталог"""
+
+        token = Token.objects.create(user=self.shop_user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        with patch('backend.views.partner_views.export_products.delay') as delay:
+            delay.return_value.id = 'partner-task'
+            response = self.client.post(reverse('backend:partner-export'),
+                                        {'format': 'jsonl', 'price_max': 250},
+                                        format='json')
+
+        self.assertEqual(response.status_code, 202)
+        filters, file_format = delay.call_args.args
+        self.assertEqual(filters, {'shop_id': self.shop.id, 'price_max': 250})
+        self.assertEqual(file_format, 'jsonl')
+
+        artifact = export_products(filters, file_format)
+        with patch('backend.views.partner_views.AsyncResult') as result:
+            result.return_value.failed.return_value = False
+            result.return_value.ready.return_value = True
+            result.return_value.get.return_value = artifact
+            download = self.client.get(response.json()['download_url'])
+
+        self.assertEqual(download.status_code, 200)
+        items = [json.loads(line) for line in b''.join(download.streaming_content).splitlines()]
+        self.assertEqual([item['id'] for item in items], self.ids[:2])
+
+    def test_partner_export_not_export_task(self):
+        """Негативный тест: через выгрузку нельзя получить результат задачи импорта"""
+
+        token = Token.objects.create(user=self.shop_user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        url = reverse('backend:partner-export-download', kwargs={'task_id': 'import-task'})
+        cache.set('task_owner_import-task', self.shop_user.id)
+
+        with patch('backend.views.partner_views.AsyncResult') as result:
+            result.return_value.failed.return_value = False
+            result.return_value.ready.return_value = True
+            result.return_value.get.return_value = None
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+            cache.set('export_owner_import-task', self.shop_user.id)
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_partner_export_invalid_format(self):
+        """Негативный тест: неподдерживаемый формат выгрузки"""
+
+        token = Token.objects.create(user=self.shop_user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        for file_format in ('pdf', 'zip'):
+            response = self.client.post(reverse('backend:partner-export'),
+                                        {'format': file_format}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('zip', response.json()['Errors'])
@@ -0,0 +1,75 @@
+from io import BytesIO
+from unittest.mock import patch
+from PIL import Image
+from django.core.files import File
+from django.test import TestCase
+from backend.image_storage import content_digest
+from backend.models import Category, ImageBlob, Product, User
+from backend.serializers import ProductSerializer
+from backend.tasks import generate_product_thumbnails, generate_user_thumbnails
+from tests.utils import TemporaryMediaMixin, image_file
+
+
+@patch('backend.signals.generate_product_thumbnails.delay')
+@patch('backend.signals.generate_user_thumbnails.delay')
+class ImageProcessingTests(TemporaryMediaMixin, TestCase):
+    """Тесты фоновой обработки загруженных изображений."""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+
+    def test_upload_stored_as_is_until_processed(self, *mocks):
+        """Позитивный тест: оригинал сохраняется без обработки и обрабатывается задачей"""
+
+        product = Product.objects.create(name='Product', category=self.category,
+                                         image=image_file('orange', (2000, 1500), 'photo.png'))
+        raw_name = product.image.name
+
+        self.assertEqual(product.image_state, 'processing')
+        self.assertTrue(raw_name.endswith('.png'))
+        self.assertEqual(ProductSerializer(product).data['image_state'], 'processing')
+
+        result = generate_product_thumbnails(product.id, image_name=raw_name)
+
+        self.assertEqual(result['status'], 'success')
+        product.refresh_from_db()
+        self.assertEqual(product.image_state, 'ready')
+        self.assertTrue(product.image.name.endswith('.jpg'))
+        with Image.open(product.image.path) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', (800, 600)))
+        self.assertEqual(set(product.thumbnails), {'400x400', '200x200', '100x100'})
+        self.assertTrue(product.thumbnails_source.endswith(content_digest(product.image.name)))
+        self.assertEqual(ImageBlob.objects.get(name=raw_name).ref_count, 0)
+        self.assertEqual(ImageBlob.objects.get(name=product.image.name).ref_count, 1)
+
+    def test_avatar_processing_and_state_reset(self, *mocks):
+        """Позитивный тест: аватар уменьшается, удаление аватара сбрасывает состояние"""
+
+        user = User.objects.create(email='test@example.com',
+                                   avatar=image_file('orange', (300, 600), 'photo.png'))
+        generate_user_thumbnails(user.id, image_name=user.avatar.name)
+
+        user.refresh_from_db()
+        self.assertEqual(user.avatar_state, 'ready')
+        with Image.open(user.avatar.path) as img:
+            self.assertEqual(img.size, (250, 500))
+
+        user.avatar = image_file('orange', (100, 100), 'photo.png')
+        user.save(update_fields=['avatar'])
+        self.assertEqual(User.objects.get(id=user.id).avatar_state, 'processing')
+
+        user.avatar = None
+        user.save()
+        self.assertEqual(User.objects.get(id=user.id).avatar_state, 'ready')
+
+    def test_broken_upload_marked_failed(self, *mocks):
+        """Негативный тест: оригинал, который не удалось обработать, отмечается ошибкой"""
+
+        product = Product.objects.create(name='Product', category=self.category,
+                                         image=File(BytesIO(b'not an image'), name='broken.jpg'))
+
+        result = generate_product_thumbnails(product.id)
+
+        self.assertEqual((result['status'], result['reason']),
+                         ('error', 'Не удалось обработать изображение'))
+        self.assertEqual(Product.objects.get(id=product.id).image_state, 'failed')
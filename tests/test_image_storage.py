@@ -0,0 +1,139 @@
+import os
+from datetime import timedelta
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from backend.image_storage import content_digest, get_image_storage
+from backend.image_utils import (PRODUCT_THUMBNAIL_SIZES, collect_unused_images,
+                                 generate_and_save_thumbnails, save_thumbnails)
+from backend.models import Category, ImageBlob, Product
+from tests.utils import TemporaryMediaMixin, image_file
+
+
+@override_settings(IMAGE_GC_DELAY=3600)
+@patch('backend.signals.generate_product_thumbnails.delay')
+class ContentAddressedImagesTests(TemporaryMediaMixin, TestCase):
+    """Тесты хранения изображений под хэшем содержимого."""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+
+    def create_product(self, color, name='first.jpg'):
+        return Product.objects.create(name=f'Product {color}', category=self.category,
+                                      image=image_file(color, name=name))
+
+    def test_identical_uploads_share_files_and_thumbnails(self, mock_delay):
+        """Позитивный тест: одинаковые загрузки хранятся и обрабатываются один раз"""
+
+        first = self.create_product('red', 'first.jpg')
+        second = self.create_product('red', 'second.jpg')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(content_digest(first.image.name))
+        self.assertEqual(ImageBlob.objects.get(name=first.image.name).ref_count, 2)
+
+        with patch('backend.image_utils.save_thumbnails', wraps=save_thumbnails) as render:
+            generate_and_save_thumbnails(first, 'image', 'thumbnails',
+                                         PRODUCT_THUMBNAIL_SIZES, 'thumbnails_source')
+            generate_and_save_thumbnails(second, 'image', 'thumbnails',
+                                         PRODUCT_THUMBNAIL_SIZES, 'thumbnails_source')
+
+        self.assertEqual(render.call_count, 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.thumbnails, second.thumbnails)
+        self.assertEqual(first.thumbnails_source, second.thumbnails_source)
+
+    def test_missing_shared_thumbnails_regenerated(self, mock_delay):
+        """Негативный тест: пропавшие файлы общих миниатюр строятся заново"""
+
+        first = self.create_product('red', 'first.jpg')
+        second = self.create_product('red', 'second.jpg')
+        thumbnails = generate_and_save_thumbnails(first, 'image', 'thumbnails',
+                                                  PRODUCT_THUMBNAIL_SIZES, 'thumbnails_source')
+        path = self.media_path(thumbnails['100x100']['jpeg']['path'])
+        os.remove(path)
+
+        with patch('backend.image_utils.save_thumbnails', wraps=save_thumbnails) as render:
+            generate_and_save_thumbnails(second, 'image', 'thumbnails',
+                                         PRODUCT_THUMBNAIL_SIZES, 'thumbnails_source')
+
+        self.assertEqual(render.call_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_reference_counting(self, mock_delay):
+        """Позитивный тест: замена и удаление изображения освобождают ссылку"""
+
+        first = self.create_product('red')
+        second = self.create_product('red')
+        name = first.image.name
+
+        first.image = image_file('blue')
+        first.save()
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+        self.assertEqual(ImageBlob.objects.get(name=first.image.name).ref_count, 1)
+
+        second.delete()
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 0)
+
+    def test_shared_thumbnails_kept_on_image_change(self, mock_delay):
+        """Позитивный тест: замена изображения у одного товара не удаляет общие миниатюры"""
+
+        first = self.create_product('red')
+        second = self.create_product('red')
+        generate_and_save_thumbnails(first, 'image', 'thumbnails',
+                                     PRODUCT_THUMBNAIL_SIZES, 'thumbnails_source')
+        first.refresh_from_db()
+        path = first.thumbnails['100x100']['jpeg']['path']
+
+        first.image = image_file('blue')
+        first.save()
+
+        self.assertTrue(os.path.exists(self.media_path(path)))
+        generate_and_save_thumbnails(second, 'image', 'thumbnails',
+                                     PRODUCT_THUMBNAIL_SIZES, 'thumbnails_source')
+        second.refresh_from_db()
+        self.assertEqual(second.thumbnails['100x100']['jpeg']['path'], path)
+
+    def test_collect_unused_images_after_delay(self, mock_delay):
+        """Позитивный тест: файлы без ссылок удаляются только после задержки"""
+
+        product = self.create_product('green')
+        generate_and_save_thumbnails(product, 'image', 'thumbnails',
+                                     PRODUCT_THUMBNAIL_SIZES, 'thumbnails_source')
+        product.refresh_from_db()
+        image_path = product.image.path
+        thumbnail_path = self.media_path(product.thumbnails['100x100']['jpeg']['path'])
+        name = product.image.name
+        product.delete()
+
+        self.assertEqual(collect_unused_images(), 0)
+        self.assertTrue(os.path.exists(image_path))
+
+        ImageBlob.objects.filter(name=name).update(
+            updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(collect_unused_images(), 1)
+        self.assertFalse(os.path.exists(image_path))
+        self.assertFalse(os.path.exists(thumbnail_path))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_reuploaded_unused_image_kept(self, mock_delay):
+        """Негативный тест: повторно загруженный файл без ссылок не удаляется сборщиком"""
+
+        product = self.create_product('black')
+        name = product.image.name
+        product.delete()
+        ImageBlob.objects.filter(name=name).update(updated_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(get_image_storage().save('products/again.jpg', image_file('black')), name)
+        self.assertEqual(collect_unused_images(), 0)
+        self.assertTrue(get_image_storage().exists(name))
+
+    def test_referenced_images_are_kept(self, mock_delay):
+        """Негативный тест: файлы, на которые есть ссылки, не удаляются"""
+
+        product = self.create_product('white')
+        ImageBlob.objects.update(updated_at=timezone.now() - timedelta(days=30))
+
+        self.assertEqual(collect_unused_images(), 0)
+        self.assertTrue(os.path.exists(product.image.path))
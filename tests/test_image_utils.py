@@ -1,13 +1,23 @@
-from io import BytesIO
+import os
+from io import BytesIO, StringIO
 from unittest.mock import Mock, patch
 from PIL import Image
-from django.core.files.base import ContentFile
-from django.test import TestCase
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
 
-from backend.image_utils import generate_and_save_thumbnails
+from backend.image_utils import (SUPPORTED_THUMBNAIL_FORMATS, THUMBNAIL_FORMATS,
+                                 accepted_image_formats, choose_variant,
+                                 generate_and_save_thumbnails, get_variants,
+                                 iter_thumbnail_paths, iter_thumbnails, open_reduced)
+from backend.serializers import serialize_thumbnails
+from tests.utils import TemporaryMediaMixin, image_bytes
 
+# Оригинал с соотношением сторон 4:3, крупнее всех миниатюр
+ORIGINAL_SIZE = (2000, 1500)
 
-class GenerateAndSaveThumbnailsTestCase(TestCase):
+
+class GenerateAndSaveThumbnailsTestCase(TemporaryMediaMixin, TestCase):
     """Тесты для функции generate_and_save_thumbnails."""
 
     def setUp(self):
@@ -15,186 +25,192 @@ class GenerateAndSaveThumbnailsTestCase(TestCase):
         self.mock_instance = Mock()
         self.mock_instance.id = 1
         self.mock_instance.__class__.objects = Mock()
-
-        # Создание временного изображение для тестов
-        self.test_image = Image.new('RGB', (100, 100), color='red')
-        self.buffer = BytesIO()
-        self.test_image.save(self.buffer, format='JPEG')
-        self.buffer.seek(0)
-
-    def tearDown(self):
-        """Очистка после тестов"""
-        if hasattr(self, 'buffer'):
-            self.buffer.close()
-
-    @patch('backend.image_utils.default_storage')
-    @patch('backend.image_utils.Image.open')
-    def test_generate_thumbnails_success(self, mock_image_open, mock_storage):
-        """Тест успешной генерации миниатюр"""
-
-        mock_image = Mock()
-        mock_image.copy.return_value = mock_image
-        mock_image_open.return_value = mock_image
-
-        mock_storage.exists.return_value = False
-        mock_storage.save.return_value = 'test_path.jpg'
+        self.mock_instance.image_field = self.make_field(image_bytes(size=ORIGINAL_SIZE))
+
+    def make_field(self, data, name='products/test_image.jpg'):
+        """Поле изображения, открывающее переданное содержимое"""
+
+        field = Mock()
+        field.name = name
+        field.open.return_value = BytesIO(data)
+        return field
+
+    def generate(self, sizes):
+        return generate_and_save_thumbnails(self.mock_instance,
+                                            'image_field',
+                                            'thumbnails_field',
+                                            sizes)
+
+    def test_generate_thumbnails_success(self):
+        """Позитивный тест: миниатюры всех размеров сохраняются и записываются в модель"""
+
+        result = self.generate([(50, 50), (400, 400), (200, 200)])
+
+        self.assertEqual(list(result), ['400x400', '200x200', '50x50'])
+        self.assertEqual(result['200x200']['jpeg']['path'],
+                         'image_field/thumbnails/1/200x200_test_image.jpg')
+        self.assertEqual(result['200x200']['webp']['path'],
+                         'image_field/thumbnails/1/200x200_test_image.webp')
+        for size, variants in result.items():
+            self.assertEqual(list(variants), SUPPORTED_THUMBNAIL_FORMATS)
+            for image_format, variant in variants.items():
+                path = self.media_path(variant['path'])
+                self.assertEqual(os.path.getsize(path), variant['bytes'])
+                with Image.open(path) as img:
+                    self.assertEqual(img.format, THUMBNAIL_FORMATS[image_format][0])
+                    self.assertEqual(img.width, int(size.split('x')[0]))
+                    self.assertEqual(img.height, round(img.width * 3 / 4))
+        self.mock_instance.__class__.objects.filter().invalidated_update.assert_called_once_with(
+            thumbnails_field=result)
+
+    def test_no_original_image(self):
+        """Негативный тест: оригинальное изображение отсутствует"""
 
         mock_image_field = Mock()
-        mock_image_field.name = 'test_image.jpg'
-        mock_image_field.path = '/path/to/test_image.jpg'
-        getattr(self.mock_instance, 'image_field').return_value = mock_image_field
+        mock_image_field.__bool__ = Mock(return_value=False)
         self.mock_instance.image_field = mock_image_field
 
-        sizes = [(50, 50), (25, 25)]
+        self.assertEqual(self.generate([(50, 50)]), {})
+        self.mock_instance.__class__.objects.filter().invalidated_update.assert_not_called()
 
-        result = generate_and_save_thumbnails(self.mock_instance,
-                                              'image_field',
-                                              'thumbnails_field',
-                                              sizes)
+    def test_existing_thumbnails_overwritten(self):
+        """Позитивный тест: повторная генерация перезаписывает файлы без переименования"""
 
-        self.assertEqual(len(result), 2)
-        self.assertIn('50x50', result)
-        self.assertIn('25x25', result)
+        first = self.generate([(50, 50)])
+        self.mock_instance.image_field = self.make_field(image_bytes(size=(200, 100)))
+        second = self.generate([(50, 50)])
 
-        self.assertEqual(mock_storage.save.call_count, 2)
-        mock_storage.exists.assert_called()
-        self.mock_instance.__class__.objects.filter().update.assert_called_once()
+        self.assertEqual(list(iter_thumbnail_paths(first)), list(iter_thumbnail_paths(second)))
+        with Image.open(self.media_path(second['50x50']['jpeg']['path'])) as img:
+            self.assertEqual(img.size, (50, 25))
+        self.assertEqual(len(os.listdir(self.media_path('image_field/thumbnails/1'))),
+                         len(SUPPORTED_THUMBNAIL_FORMATS))
 
-    @patch('backend.image_utils.default_storage')
-    def test_no_original_image(self, mock_storage):
-        """Тест, когда оригинальное изображение отсутствует"""
+    def test_failed_size_skipped(self):
+        """Негативный тест: ошибка сохранения одного размера не прерывает остальные"""
 
-        mock_image_field = Mock()
-        mock_image_field.__bool__ = Mock(return_value=False)
-        self.mock_instance.image_field = mock_image_field
+        storage = FileSystemStorage(location=self.media_root, allow_overwrite=True)
+        save = storage.save
 
-        result = generate_and_save_thumbnails(self.mock_instance,
-                                              'image_field',
-                                              'thumbnails_field',
-                                              [(50, 50)])
+        def failing_save(name, content):
+            if '/200x200_' in name or name.endswith('/100x100_test_image.webp'):
+                raise OSError('Disk error')
+            return save(name, content)
 
-        self.assertEqual(result, {})
-        mock_storage.save.assert_not_called()
+        storage.save = failing_save
+        with patch('backend.image_utils.get_thumbnail_storage', return_value=storage):
+            result = self.generate([(400, 400), (200, 200), (100, 100)])
 
-    @patch('backend.image_utils.default_storage')
-    @patch('backend.image_utils.Image.open')
-    def test_thumbnails_already_exist(self, mock_image_open, mock_storage):
-        """Тест, когда миниатюры уже существуют"""
+        self.assertEqual(list(result), ['400x400', '100x100'])
+        self.assertNotIn('webp', result['100x100'])
+        self.assertIn('jpeg', result['100x100'])
 
-        mock_image = Mock()
-        mock_image_open.return_value = mock_image
+    def test_general_exception_handling(self):
+        """Негативный тест: повреждённый файл оригинала"""
 
-        mock_image_field = Mock()
-        mock_image_field.name = 'test_image.jpg'
-        mock_image_field.path = '/path/to/test_image.jpg'
-        self.mock_instance.image_field = mock_image_field
+        self.mock_instance.image_field = self.make_field(b'not an image')
 
-        mock_storage.exists.return_value = True
+        self.assertEqual(self.generate([(50, 50)]), {})
+        self.mock_instance.__class__.objects.filter().invalidated_update.assert_not_called()
 
-        sizes = [(50, 50)]
+    def test_image_with_alpha_channel(self):
+        """Позитивный тест: PNG с прозрачностью сохраняется в JPEG"""
 
-        result = generate_and_save_thumbnails(self.mock_instance,
-                                              'image_field',
-                                              'thumbnails_field',
-                                              sizes)
+        self.mock_instance.image_field = self.make_field(
+            image_bytes(size=(300, 300), image_format='PNG'), name='avatars/avatar.png')
 
-        self.assertEqual(len(result), 1)
-        mock_storage.save.assert_not_called()
-        mock_storage.exists.assert_called()
+        result = self.generate([(100, 100)])
 
-    @patch('backend.image_utils.default_storage')
-    @patch('backend.image_utils.Image.open')
-    def test_image_processing_exception(self, mock_image_open, mock_storage):
-        """Тест обработки исключения при обработке изображения"""
+        with Image.open(self.media_path(result['100x100']['jpeg']['path'])) as img:
+            self.assertEqual((img.mode, img.size), ('RGB', (100, 100)))
 
-        mock_image = Mock()
-        mock_image.copy.side_effect = Exception('Processing error')
-        mock_image_open.return_value = mock_image
 
-        mock_image_field = Mock()
-        mock_image_field.name = 'test_image.jpg'
-        mock_image_field.path = '/path/to/test_image.jpg'
-        self.mock_instance.image_field = mock_image_field
+class ThumbnailPipelineTestCase(TestCase):
+    """Тесты однократного декодирования и каскада миниатюр."""
 
-        mock_storage.exists.return_value = False
+    def test_open_reduced_decodes_at_lower_scale(self):
+        """Позитивный тест: JPEG декодируется уменьшенным, но не меньше запаса"""
 
-        sizes = [(50, 50)]
+        img = open_reduced(BytesIO(image_bytes(size=(4000, 3000))), (400, 400))
 
-        result = generate_and_save_thumbnails(self.mock_instance,
-                                              'image_field',
-                                              'thumbnails_field',
-                                              sizes)
-        self.assertEqual(result, {})
+        self.assertLess(img.width, 4000)
+        self.assertGreaterEqual(img.width, 800)
+        self.assertGreaterEqual(img.height, 600)
 
-    @patch('backend.image_utils.default_storage')
-    @patch('backend.image_utils.Image.open')
-    def test_general_exception_handling(self, mock_image_open, mock_storage):
-        """Тест обработки общего исключения"""
+    def test_cascade_from_previous_size(self):
+        """Позитивный тест: изображение открывается один раз, размеры идут по убыванию"""
 
-        mock_image_open.side_effect = Exception('General error')
+        with patch('backend.image_utils.Image.open', wraps=Image.open) as mock_open:
+            sizes = [(size, img.size)
+                     for size, img in iter_thumbnails(BytesIO(image_bytes(size=ORIGINAL_SIZE)),
+                                                      [(100, 100), (400, 400), (200, 200)])]
 
-        mock_image_field = Mock()
-        mock_image_field.name = 'test_image.jpg'
-        mock_image_field.path = '/path/to/test_image.jpg'
-        self.mock_instance.image_field = mock_image_field
+        mock_open.assert_called_once()
+        self.assertEqual(sizes, [((400, 400), (400, 300)),
+                                 ((200, 200), (200, 150)),
+                                 ((100, 100), (100, 75))])
 
-        result = generate_and_save_thumbnails(self.mock_instance,
-                                              'image_field',
-                                              'thumbnails_field',
-                                              [(50, 50)])
+    def test_benchmark_command(self):
+        """Позитивный тест: бенчмарк выводит экономию на изображение"""
 
-        self.assertEqual(result, {})
+        out = StringIO()
+        call_command('benchmark_thumbnails', '--width', '1200', '--height', '900',
+                     '--repeat', '1', stdout=out)
 
-    @patch('backend.image_utils.default_storage')
-    @patch('backend.image_utils.Image.open')
-    def test_thumbnail_generation_quality(self, mock_image_open, mock_storage):
-        """Тест проверки качества генерации миниатюр"""
+        self.assertIn('Экономия на изображение', out.getvalue())
 
-        mock_image = Mock()
-        mock_image.copy.return_value = mock_image
-        mock_image_open.return_value = mock_image
 
-        mock_storage.exists.return_value = False
+class ThumbnailFormatNegotiationTestCase(TemporaryMediaMixin, TestCase):
+    """Тесты выбора формата миниатюры по заголовку Accept."""
 
-        mock_image_field = Mock()
-        mock_image_field.name = 'test_image.jpg'
-        mock_image_field.path = '/path/to/test_image.jpg'
-        self.mock_instance.image_field = mock_image_field
+    variants = {'jpeg': {'path': 'a.jpg', 'bytes': 3000},
+                'webp': {'path': 'a.webp', 'bytes': 2000},
+                'avif': {'path': 'a.avif', 'bytes': 1500}}
 
-        sizes = [(50, 50)]
+    def test_accepted_formats(self):
+        """Позитивный тест: форматы из Accept браузера, JPEG принимается всегда"""
 
-        generate_and_save_thumbnails(self.mock_instance,
-                                     'image_field',
-                                     'thumbnails_field',
-                                     sizes)
+        self.assertEqual(accepted_image_formats('image/avif,image/webp,image/apng,*/*;q=0.8'),
+                         {'jpeg', 'webp', 'avif'})
+        self.assertEqual(accepted_image_formats('image/webp;q=0.9, image/avif;q=0'),
+                         {'jpeg', 'webp'})
+        self.assertEqual(accepted_image_formats(None), {'jpeg'})
 
-        mock_storage.save.assert_called_once()
-        args, kwargs = mock_storage.save.call_args
-        self.assertTrue(isinstance(args[1], ContentFile))
+    def test_smallest_accepted_variant(self):
+        """Позитивный тест: выбирается самый маленький из принимаемых форматов"""
 
-    @patch('backend.image_utils.default_storage')
-    @patch('backend.image_utils.Image.open')
-    def test_multiple_sizes_processing(self, mock_image_open, mock_storage):
-        """Тест обработки нескольких размеров"""
+        self.assertEqual(choose_variant(self.variants, {'jpeg', 'webp', 'avif'})[0], 'avif')
+        self.assertEqual(choose_variant(self.variants, {'jpeg', 'webp'})[0], 'webp')
+        self.assertEqual(choose_variant(self.variants, {'jpeg'})[0], 'jpeg')
 
-        mock_image = Mock()
-        mock_image.copy.return_value = mock_image
-        mock_image_open.return_value = mock_image
+        variants = dict(self.variants, webp={'path': 'a.webp', 'bytes': 5000})
+        self.assertEqual(choose_variant(variants, {'jpeg', 'webp'})[0], 'jpeg')
 
-        mock_storage.exists.return_value = False
-        mock_storage.save.return_value = 'test_path.jpg'
+    def test_legacy_thumbnail_path(self):
+        """Позитивный тест: миниатюра, сохранённая строкой пути, считается JPEG"""
 
-        mock_image_field = Mock()
-        mock_image_field.name = 'test_image.jpg'
-        mock_image_field.path = '/path/to/test_image.jpg'
-        self.mock_instance.image_field = mock_image_field
+        self.assertEqual(get_variants('a.jpg'), {'jpeg': {'path': 'a.jpg'}})
+        self.assertEqual(list(iter_thumbnail_paths({'100x100': 'a.jpg',
+                                                    '50x50': self.variants})),
+                         ['a.jpg', 'a.jpg', 'a.webp', 'a.avif'])
+
+    def test_serializer_picks_accepted_format(self):
+        """Позитивный тест: сериализатор отдаёт самый маленький принимаемый формат"""
 
-        sizes = [(100, 100), (50, 50), (25, 25)]
+        mock_instance = Mock(id=2)
+        mock_instance.__class__.objects = Mock()
+        mock_instance.image_field.name = 'products/test_image.jpg'
+        mock_instance.image_field.open.return_value = BytesIO(image_bytes(size=ORIGINAL_SIZE))
+        thumbnails = generate_and_save_thumbnails(mock_instance, 'image_field',
+                                                  'thumbnails_field', [(100, 100)])
+        variants = thumbnails['100x100']
+        smallest = min(variants, key=lambda name: variants[name]['bytes'])
 
-        result = generate_and_save_thumbnails(self.mock_instance,
-                                              'image_field',
-                                              'thumbnails_field',
-                                              sizes)
+        browser = RequestFactory().get('/', HTTP_ACCEPT='image/avif,image/webp,*/*')
+        legacy = RequestFactory().get('/', HTTP_ACCEPT='application/json')
 
-        self.assertEqual(len(result), 3)
-        self.assertEqual(mock_storage.save.call_count, 3)
+        result = serialize_thumbnails(thumbnails, browser)['100x100']
+        self.assertEqual(result['format'], smallest)
+        self.assertTrue(result['url'].endswith(variants[smallest]['path']))
+        self.assertEqual(set(result['formats']), set(SUPPORTED_THUMBNAIL_FORMATS))
+        self.assertEqual(serialize_thumbnails(thumbnails, legacy)['100x100']['format'], 'jpeg')
@@ -0,0 +1,236 @@
+import os
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from zipfile import ZipFile
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from unittest.mock import patch
+from openpyxl import load_workbook
+from backend.excel_utils import (StreamingSheetWriter, generate_invoice_excel,
+                                 get_invoice_file, get_invoice_lines, get_invoices_data,
+                                 write_invoices_archive)
+from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact
+from tests.utils import TemporaryMediaMixin
+
+
+User = get_user_model()
+
+
+class InvoiceTestCase(TestCase):
+    """Заказ из трёх магазинов для тестов накладных."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@example.com',
+                                             password='testpassword',
+                                             is_active=True)
+        self.contact = Contact.objects.create(user=self.user,
+                                              city='Test City',
+                                              street='Test Street',
+                                              phone='+1234567890')
+        category = Category.objects.create(name='Test Category')
+        self.order = Order.objects.create(user=self.user, state='new', contact=self.contact)
+
+        for shop_number in range(1, 4):
+            shop = Shop.objects.create(name=f'Shop {shop_number}')
+            for product_number in range(1, 3):
+                product = Product.objects.create(name=f'Product {shop_number}-{product_number}',
+                                                 category=category)
+                product_info = ProductInfo.objects.create(product=product,
+                                                          shop=shop,
+                                                          external_id=product_number,
+                                                          price=10 * shop_number,
+                                                          price_rrc=20,
+                                                          quantity=10)
+                OrderItem.objects.create(order=self.order,
+                                         product_info=product_info,
+                                         quantity=product_number)
+
+
+class InvoiceExcelTests(InvoiceTestCase):
+    """Тесты формирования накладной."""
+
+    def test_invoice_lines_single_query(self):
+        """Позитивный тест: позиции всех магазинов получаются одним запросом"""
+
+        with self.assertNumQueries(1):
+            shops_lines = get_invoice_lines(self.order.id)
+
+        self.assertEqual([shop_name for shop_name, _ in shops_lines],
+                         ['Shop 1', 'Shop 2', 'Shop 3'])
+        self.assertEqual(len(shops_lines[0][1]), 2)
+
+        with self.assertNumQueries(0):
+            generate_invoice_excel(self.order, self.user, shops_lines)
+
+    def test_invoice_totals(self):
+        """Позитивный тест: итоги по магазинам и общая сумма"""
+
+        excel_data = generate_invoice_excel(self.order, self.user,
+                                            get_invoice_lines(self.order.id))
+        ws = load_workbook(BytesIO(excel_data)).active
+
+        rows = [tuple(cell.value for cell in row) for row in ws.iter_rows()]
+        shop_totals = [row[4] for row in rows if row[1] == 'Итого по магазину:']
+        self.assertEqual(shop_totals, [30, 60, 90])
+        self.assertEqual(rows[-1][3:], ('ОБЩАЯ СУММА:', 180))
+        self.assertEqual(ws['A1'].value, f'НАКЛАДНАЯ №{self.order.id}')
+
+    def test_invoice_written_to_file(self):
+        """Позитивный тест: накладная пишется сразу в файл с объединёнными ячейками"""
+
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'invoice.xlsx')
+            result = generate_invoice_excel(self.order, self.user,
+                                            get_invoice_lines(self.order.id),
+                                            output=path)
+            self.assertEqual(result, path)
+            ws = load_workbook(path).active
+
+        merged = {str(cell_range) for cell_range in ws.merged_cells.ranges}
+        self.assertIn('A1:E1', merged)
+        self.assertEqual(len(merged), 4)
+        self.assertEqual(ws['C10'].border.left.style, 'thin')
+        self.assertGreater(ws.column_dimensions['B'].width,
+                           ws.column_dimensions['C'].width)
+
+
+class InvoiceBatchTests(InvoiceTestCase):
+    """Тесты пакетного формирования накладных."""
+
+    def setUp(self):
+        super().setUp()
+        self.second_order = Order.objects.create(user=self.user, state='sent')
+        OrderItem.objects.create(order=self.second_order,
+                                 product_info=ProductInfo.objects.first(),
+                                 quantity=3)
+
+    def test_invoices_data_two_queries(self):
+        """Позитивный тест: данные всех накладных загружаются двумя запросами"""
+
+        with self.assertNumQueries(2):
+            invoices = get_invoices_data([self.order.id, self.second_order.id])
+
+        (order, user, shops_lines), (second, _, second_lines) = invoices
+        self.assertEqual(order.contact.city, 'Test City')
+        self.assertEqual(user.email, 'user@example.com')
+        self.assertEqual(len(shops_lines), 3)
+        self.assertIsNone(second.contact)
+        self.assertEqual(second_lines[0][1][0].quantity, 3)
+
+    def test_archive_with_process_pool(self):
+        """Позитивный тест: накладные формируются в пуле процессов и пишутся в ZIP"""
+
+        archive = BytesIO()
+        count = write_invoices_archive([self.order.id, self.second_order.id], archive, workers=2)
+
+        self.assertEqual(count, 2)
+        with ZipFile(archive) as zip_file:
+            self.assertEqual(sorted(zip_file.namelist()),
+                             sorted([f'invoice_{self.order.id}.xlsx',
+                                     f'invoice_{self.second_order.id}.xlsx']))
+            ws = load_workbook(BytesIO(zip_file.read(f'invoice_{self.order.id}.xlsx'))).active
+        rows = list(ws.iter_rows(values_only=True))
+        self.assertEqual(rows[-1][3:], ('ОБЩАЯ СУММА:', 180))
+
+    def test_generate_invoices_command(self):
+        """Позитивный тест: команда формирует архив за период"""
+
+        today = self.order.dt.date().isoformat()
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'invoices.zip')
+            call_command('generate_invoices', '--date-from', today, '--date-to', today,
+                         '--workers', '1', '--output', path, stdout=StringIO())
+            with ZipFile(path) as zip_file:
+                self.assertEqual(len(zip_file.namelist()), 2)
+
+        with self.assertRaises(CommandError):
+            call_command('generate_invoices')
+
+
+class InvoiceFileCacheTests(TemporaryMediaMixin, InvoiceTestCase):
+    """Тесты сохранения сформированных накладных."""
+
+    @patch('backend.excel_utils.generate_invoice_excel', wraps=generate_invoice_excel)
+    def test_invoice_generated_once(self, mock_generate):
+        """Позитивный тест: повторный запрос отдаёт сохранённый файл"""
+
+        first = get_invoice_file(self.order, self.user)
+        second = get_invoice_file(self.order, self.user)
+
+        self.assertEqual(first, second)
+        mock_generate.assert_called_once()
+        with default_storage.open(first) as file:
+            self.assertEqual(load_workbook(file).active['A1'].value,
+                             f'НАКЛАДНАЯ №{self.order.id}')
+
+    def test_order_change_invalidates_invoice(self):
+        """Позитивный тест: изменение заказа даёт новый файл, старый удаляется"""
+
+        first = get_invoice_file(self.order, self.user)
+        item = OrderItem.objects.filter(order=self.order).first()
+        item.quantity += 1
+        item.save()
+
+        second = get_invoice_file(self.order, self.user)
+        self.assertNotEqual(first, second)
+        self.assertFalse(default_storage.exists(first))
+
+        self.order.delete()
+        self.assertFalse(default_storage.exists(second))
+
+    def test_admin_download(self):
+        """Позитивный тест: администратор скачивает накладную"""
+
+        admin = User.objects.create_superuser(email='admin@example.com',
+                                              password='testpassword')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('backend:order-invoice', args=[self.order.id]))
+
+        self.assertEqual(response.status_code, 200)
+        load_workbook(BytesIO(b''.join(response.streaming_content)))
+
+    @patch('backend.admin.generate_invoices_archive.delay')
+    def test_admin_action_all_filtered_orders(self, mock_delay):
+        """Позитивный тест: при выборе всех заказов в задачу передаются ID отфильтрованных"""
+
+        Order.objects.create(user=self.user, state='confirmed', contact=self.contact)
+        admin = User.objects.create_superuser(email='admin@example.com',
+                                              password='testpassword')
+        self.client.force_login(admin)
+        mock_delay.return_value.id = 'invoices-task'
+        url = reverse('admin:backend_order_changelist') + '?state__exact=new'
+        response = self.client.post(url,
+                                    {'action': 'generate_invoices',
+                                     'select_across': '1',
+                                     '_selected_action': [self.order.id]},
+                                    follow=True)
+
+        self.assertEqual(response.status_code, 200)
+        mock_delay.assert_called_once_with({'ids': [self.order.id]})
+
+
+class StreamingSheetWriterTests(TestCase):
+    """Тесты потоковой записи листа Excel."""
+
+    def test_rows_after_sample_are_streamed(self):
+        """Позитивный тест: ширина по первым строкам, остальные строки не теряются"""
+
+        writer = StreamingSheetWriter('Лист', columns=2, sample_size=2)
+        writer.append(['a', 'bbbb'])
+        writer.append(['aaaaaaaa', 'b'])
+        row_num = writer.append(['c', 'c' * 50])
+        self.assertEqual(row_num, 3)
+
+        excel_file = BytesIO()
+        writer.save(excel_file)
+        ws = load_workbook(BytesIO(excel_file.getvalue())).active
+
+        self.assertEqual(ws.max_row, 3)
+        self.assertEqual(ws['B3'].value, 'c' * 50)
+        self.assertAlmostEqual(ws.column_dimensions['A'].width, 12)
+        self.assertAlmostEqual(ws.column_dimensions['B'].width, 7.2)
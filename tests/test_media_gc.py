@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from backend.media_utils import collect_orphaned_media, iter_media_files, iter_orphaned_media
+from backend.models import Category, Product, User
+from backend.tasks import generate_product_thumbnails
+from tests.utils import TemporaryMediaMixin, image_file
+
+
+@override_settings(IMAGE_GC_DELAY=3600)
+class CollectOrphanedMediaTests(TemporaryMediaMixin, TestCase):
+    """Тесты удаления файлов изображений без ссылок из БД."""
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+        category = Category.objects.create(name='Test Category')
+        with patch('backend.signals.generate_product_thumbnails.delay'):
+            self.product = Product.objects.create(name='Product', category=category,
+                                                  image=image_file('red'))
+        generate_product_thumbnails(self.product.id)
+        self.product.refresh_from_db()
+
+        # Миниатюры в старом формате: путь строкой
+        self.write_media_file('avatar/thumbnails/1/50x50_legacy.jpg')
+        with patch('backend.signals.generate_user_thumbnails.delay'):
+            self.user = User.objects.create(email='test@example.com')
+        User.objects.filter(id=self.user.id).update(
+            avatar_thumbnails={'50x50': 'avatar/thumbnails/1/50x50_legacy.jpg'})
+
+        self.orphans = [
+            self.write_media_file('products/ab/' + 'ab' * 32 + '.jpg', b'x' * 300),
+            self.write_media_file('image/thumbnails/7/400x400_old.jpg', b'x' * 200),
+            self.write_media_file(os.path.dirname(self.product.thumbnails['100x100']['jpeg']['path'])
+                                  + '/300x300.jpg', b'x' * 50),
+        ]
+        self.export = self.write_media_file('exports/products.xlsx')
+        old = time.time() - 7200
+        for directory, _, names in os.walk(self.media_root):
+            for name in names:
+                os.utime(os.path.join(directory, name), (old, old))
+        self.young = self.write_media_file('products/cd/' + 'cd' * 32 + '.jpg')
+
+    def test_orphans_deleted_referenced_kept(self):
+        """Позитивный тест: удаляются только старые файлы без ссылок, объём подсчитывается"""
+
+        stats = collect_orphaned_media(batch_size=2)
+
+        self.assertEqual((stats['deleted'], stats['bytes']), (3, 550))
+        for path in self.orphans:
+            self.assertFalse(os.path.exists(path))
+        for path in (self.export, self.young, self.product.image.path,
+                     self.media_path('avatar/thumbnails/1/50x50_legacy.jpg'),
+                     self.media_path(self.product.thumbnails['400x400']['webp']['path'])):
+            self.assertTrue(os.path.exists(path), path)
+
+        self.assertEqual(collect_orphaned_media()['deleted'], 0)
+
+    def test_blob_thumbnails_kept(self):
+        """Позитивный тест: общие миниатюры сохраняются, пока есть запись ImageBlob"""
+
+        thumbnail = self.media_path(self.product.thumbnails['100x100']['jpeg']['path'])
+        self.product.delete()
+
+        collect_orphaned_media()
+
+        self.assertTrue(os.path.exists(thumbnail))
+
+    def test_dry_run_command(self):
+        """Позитивный тест: команда с --dry-run только подсчитывает файлы без ссылок"""
+
+        out = StringIO()
+        call_command('collect_orphaned_media', '--dry-run', stdout=out)
+
+        self.assertIn('найдено без ссылок: 3', out.getvalue())
+        for path in self.orphans:
+            self.assertTrue(os.path.exists(path))
+
+    def test_clear_products_thumbnails(self):
+        """Позитивный тест: сброс миниатюр товара очищает поле thumbnails"""
+
+        self.product.clear_products_thumbnails()
+
+        self.assertEqual(Product.objects.get(id=self.product.id).thumbnails, {})
+
+
+class StreamingDifferenceTests(TestCase):
+    """Тесты слияния отсортированных потоков путей."""
+
+    def test_walk_order_matches_path_order(self):
+        """Позитивный тест: обход каталогов выдаёт пути в порядке сравнения строк"""
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        for path in ('media/a/x', 'media/a-b', 'media/a.c', 'media/b'):
+            os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+            open(os.path.join(root, path), 'w').close()
+
+        paths = [path for path, _ in iter_media_files(root, ['media/'])]
+
+        self.assertEqual(paths, sorted(paths))
+        self.assertEqual(len(paths), 4)
+
+    def test_difference(self):
+        """Позитивный тест: разность учитывает повторы и пути только из БД"""
+
+        files = ((path, None) for path in ('a', 'b', 'c', 'e'))
+        referenced = iter(['0', 'b', 'b', 'd', 'e'])
+
+        self.assertEqual([path for path, _ in iter_orphaned_media(files, referenced)], ['a', 'c'])
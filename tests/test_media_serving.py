@@ -0,0 +1,89 @@
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.utils.http import http_date
+from backend.models import Category, Product, User
+from tests.utils import TemporaryMediaMixin, image_file
+
+
+@override_settings(MEDIA_SERVE_BACKEND='')
+class MediaViewTests(TemporaryMediaMixin, TestCase):
+    """Тесты отдачи медиафайлов."""
+
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        with patch('backend.signals.generate_product_thumbnails.delay'):
+            self.product = Product.objects.create(name='Test Product', category=category,
+                                                  image=image_file('blue', (300, 200)))
+        self.image_url = f'/media/{self.product.image.name}'
+
+    def test_content_hashed_original_is_immutable(self):
+        """Позитивный тест: файл под хэшем содержимого отдаётся с immutable и 304 по дате"""
+
+        response = self.client.get(self.image_url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        with open(self.product.image.path, 'rb') as file:
+            self.assertEqual(b''.join(response.streaming_content), file.read())
+
+        cached = self.client.get(self.image_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+
+    @override_settings(MEDIA_SERVE_BACKEND='x-accel-redirect',
+                       MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect(self):
+        """Позитивный тест: передача файла делегируется nginx через X-Accel-Redirect"""
+
+        response = self.client.get(self.image_url)
+
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.product.image.name}')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(MEDIA_SERVE_BACKEND='x-sendfile')
+    def test_sendfile(self):
+        """Позитивный тест: передача файла делегируется через X-Sendfile"""
+
+        response = self.client.get(self.image_url)
+
+        self.assertEqual(response['X-Sendfile'], self.product.image.path)
+
+    def test_thumbnail_format_negotiation(self):
+        """Позитивный тест: для миниатюры выбирается меньший из принимаемых форматов"""
+
+        directory = 'thumbnails/ab/' + 'ab' * 32
+        self.write_media_file(f'{directory}/100x100.jpg', b'j' * 100)
+        self.write_media_file(f'{directory}/100x100.webp', b'w' * 50)
+
+        webp = self.client.get(f'/media/{directory}/100x100.jpg', HTTP_ACCEPT='image/webp,*/*')
+        jpeg = self.client.get(f'/media/{directory}/100x100.jpg', HTTP_ACCEPT='image/*')
+
+        self.assertEqual(webp['Content-Type'], 'image/webp')
+        self.assertEqual(b''.join(webp.streaming_content), b'w' * 50)
+        self.assertEqual(jpeg['Content-Type'], 'image/jpeg')
+        self.assertIn('Accept', webp['Vary'])
+        self.assertNotIn('immutable', webp['Cache-Control'])
+
+    def test_private_files_for_staff_only(self):
+        """Негативный тест: файлы вне каталогов изображений доступны только персоналу"""
+
+        self.write_media_file('exports/products.csv', b'data')
+
+        self.assertEqual(self.client.get('/media/exports/products.csv').status_code, 404)
+
+        staff = User.objects.create(email='admin@example.com', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/media/exports/products.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_invalid_paths(self):
+        """Негативный тест: выход за пределы MEDIA_ROOT и отсутствующие файлы"""
+
+        self.assertEqual(self.client.get('/media/products/../../orders/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/products/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/products/').status_code, 404)
+        self.assertEqual(self.client.post(self.image_url).status_code, 405)
+        self.assertEqual(self.client.get(self.image_url,
+                                         HTTP_IF_MODIFIED_SINCE=http_date(0)).status_code, 200)
@@ -1,14 +1,19 @@
-from backend.models import Contact, Order
+from unittest.mock import patch
+from django.test import override_settings
+from backend.models import (Contact, Order, OrderItem, OutgoingEmail, Shop,
+                            Category, Product, ProductInfo)
 from rest_framework.test import APITestCase, APIClient
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from backend.tasks import send_new_order_notifications
+from tests.utils import TemporaryMediaMixin
 
 
 User = get_user_model()
 
 
-class OrderViewTests(APITestCase):
+class OrderViewTests(TemporaryMediaMixin, APITestCase):
     def setUp(self):
         self.client = APIClient()
         self.url = reverse('backend:order')
@@ -30,7 +35,7 @@ class OrderViewTests(APITestCase):
         Order.objects.create(user=self.user, state='new')
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_create_order_valid_data(self):
         """Позитивный тест: оформление заказа из корзины"""
@@ -48,3 +53,105 @@ class OrderViewTests(APITestCase):
         response = self.client.post(self.url, {'id': self.order.id}, format='json')
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json()['Errors'], 'Необходимые поля отсутствуют.')
+
+    def _create_placed_order(self):
+        shop = Shop.objects.get_or_create(name='Test Shop')[0]
+        category = Category.objects.get_or_create(name='Test Category')[0]
+        product = Product.objects.get_or_create(name='Test Product', category=category)[0]
+        product_info = ProductInfo.objects.get_or_create(product=product,
+                                                         shop=shop,
+                                                         external_id=1,
+                                                         defaults={'price': 100,
+                                                                   'price_rrc': 120,
+                                                                   'quantity': 10})[0]
+        order = Order.objects.create(user=self.user, state='new', contact=self.contact)
+        OrderItem.objects.create(order=order, product_info=product_info, quantity=2)
+        order.update_totals()
+        return order
+
+    def test_get_orders_pagination(self):
+        """Позитивный тест: история заказов выдаётся постранично по дате"""
+
+        orders = [self._create_placed_order() for _ in range(3)]
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual([order['id'] for order in response.data['results']],
+                         [orders[2].id, orders[1].id])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([order['id'] for order in response.data['results']],
+                         [orders[0].id])
+        self.assertIsNone(response.data['next'])
+
+    def test_get_orders_summary(self):
+        """Позитивный тест: краткий вид истории без параметров товаров"""
+
+        self._create_placed_order()
+        response = self.client.get(self.url, {'summary': 'true'})
+        order_data = response.data['results'][0]
+        self.assertEqual(order_data['total_sum'], 200)
+        item = order_data['ordered_items'][0]
+        self.assertEqual(item['product'], 'Test Product')
+        self.assertEqual(item['shop'], 'Test Shop')
+        self.assertEqual(item['price'], 100)
+        self.assertNotIn('product_parameters', item)
+
+    def test_get_order_detail(self):
+        """Позитивный тест: получение одного заказа"""
+
+        order = self._create_placed_order()
+        response = self.client.get(reverse('backend:order-detail',
+                                           kwargs={'order_id': order.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], order.id)
+        self.assertIn('product_parameters', response.data['ordered_items'][0]['product_info'])
+
+    def test_get_order_detail_not_found(self):
+        """Негативный тест: корзина и чужие заказы недоступны через детальный просмотр"""
+
+        response = self.client.get(reverse('backend:order-detail',
+                                           kwargs={'order_id': self.order.id}))
+        self.assertEqual(response.status_code, 404)
+
+    @patch('backend.signals.send_new_order_notifications.delay')
+    def test_create_order_enqueues_notifications_after_commit(self, mock_delay):
+        """Позитивный тест: уведомления о заказе ставятся одной задачей после фиксации"""
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(self.url,
+                                        {'id': str(self.order.id), 'contact': str(self.contact.id)},
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+        mock_delay.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        mock_delay.assert_called_once_with(self.order.id)
+
+    @patch('backend.tasks.send_outbox_emails.delay')
+    @patch('backend.tasks.queue_email')
+    def test_new_order_notifications_task(self, mock_queue_email, mock_delay):
+        """Позитивный тест: задача ставит в очередь уведомление покупателю и накладную"""
+
+        order = self._create_placed_order()
+        send_new_order_notifications(order.id)
+
+        self.assertEqual(mock_queue_email.call_count, 2)
+        mock_delay.assert_called_once_with()
+        user_email, invoice_email = mock_queue_email.call_args_list
+        self.assertEqual(user_email.kwargs['to'], [self.user.email])
+        kwargs = invoice_email.kwargs
+        self.assertEqual(kwargs['attachment_name'], f'invoice_{order.id}.xlsx')
+        self.assertIn('Итого к оплате: 200 руб.', kwargs['message'])
+        self.assertTrue(kwargs['attachment'].startswith(b'PK'))
+
+    @override_settings(EMAIL_HOST_USER='shop@example.com', QUERY_BUDGET_STRICT=True)
+    @patch('backend.tasks.send_outbox_emails.delay')
+    def test_new_order_notifications_within_query_budget(self, mock_delay):
+        """Позитивный тест: с настоящей очередью писем задача укладывается в бюджет запросов"""
+
+        order = self._create_placed_order()
+        # при превышении NOTIFICATION_QUERY_BUDGET задача выбрасывает QueryBudgetExceeded
+        send_new_order_notifications(order.id)
+
+        self.assertEqual(OutgoingEmail.objects.filter(status='pending').count(), 2)
+        mock_delay.assert_called_once_with()
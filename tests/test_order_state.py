@@ -0,0 +1,95 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from backend.admin import OrderAdminForm
+from backend.models import Order, Shop, ShopOrder, OutgoingEmail
+from backend.order_utils import transition_orders
+from backend.tasks import send_order_state_notifications
+
+
+User = get_user_model()
+
+
+class OrderStateTransitionTests(TestCase):
+    """Тесты массовой смены статуса заказов."""
+
+    def setUp(self):
+        cache.clear()
+        self.first = User.objects.create_user(email='first@example.com',
+                                              password='testpassword',
+                                              is_active=True)
+        self.second = User.objects.create_user(email='second@example.com',
+                                               password='testpassword',
+                                               is_active=True)
+        self.orders = [Order.objects.create(user=user, state=state)
+                       for user, state in ((self.first, 'new'),
+                                           (self.first, 'confirmed'),
+                                           (self.second, 'new'),
+                                           (self.second, 'delivered'))]
+
+    @patch('backend.order_utils.send_order_state_notifications.delay')
+    def test_transition_orders(self, mock_delay):
+        """Позитивный тест: допустимые переходы применяются, по задаче на пользователя"""
+
+        shop = Shop.objects.create(name='Test Shop')
+        shop_order = ShopOrder.objects.create(order=self.orders[0], shop=shop)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            changed, skipped = transition_orders(Order.objects.all(), 'canceled')
+
+        self.assertEqual((changed, skipped), (3, 1))
+        states = dict(Order.objects.values_list('id', 'state'))
+        self.assertEqual(states[self.orders[3].id], 'delivered')
+        self.assertEqual(states[self.orders[1].id], 'canceled')
+        shop_order.refresh_from_db()
+        self.assertEqual(shop_order.updated_at, Order.objects.get(id=self.orders[0].id).updated_at)
+
+        self.assertEqual(mock_delay.call_count, 2)
+        calls = {call.args[0]: call.args[1] for call in mock_delay.call_args_list}
+        self.assertEqual(calls['first@example.com'],
+                         [(self.orders[0].id, 'canceled'), (self.orders[1].id, 'canceled')])
+
+    @patch('backend.order_utils.send_order_state_notifications.delay')
+    def test_transition_queries_do_not_grow(self, mock_delay):
+        """Позитивный тест: число запросов не зависит от количества заказов"""
+
+        Order.objects.bulk_create(Order(user=self.first, state='new') for _ in range(50))
+
+        with self.assertNumQueries(6):
+            changed, _ = transition_orders(Order.objects.all(), 'confirmed')
+        self.assertEqual(changed, 52)
+
+    def test_notification_contains_all_changes(self):
+        """Позитивный тест: одно письмо со всеми изменениями пользователя"""
+
+        send_order_state_notifications('first@example.com',
+                                       [(1, 'sent'), (2, 'canceled')])
+
+        email = OutgoingEmail.objects.get()
+        self.assertIn('Заказ №1: Заказ отправлен', email.body)
+        self.assertIn('Заказ №2: Заказ отменен', email.body)
+
+    def test_admin_form_rejects_invalid_transition(self):
+        """Негативный тест: недопустимый переход в форме администратора"""
+
+        form = OrderAdminForm(instance=self.orders[3], data={'state': 'new'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('state', form.errors)
+
+    @patch('backend.order_utils.send_order_state_notifications.delay')
+    def test_admin_action(self, mock_delay):
+        """Позитивный тест: действие администратора меняет статус выбранных заказов"""
+
+        admin = User.objects.create_superuser(email='admin@example.com',
+                                              password='testpassword')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:backend_order_changelist'),
+                                    {'action': 'mark_confirmed',
+                                     '_selected_action': [self.orders[0].id, self.orders[3].id]},
+                                    follow=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get(id=self.orders[0].id).state, 'confirmed')
+        self.assertEqual(Order.objects.get(id=self.orders[3].id).state, 'delivered')
@@ -0,0 +1,133 @@
+from datetime import timedelta
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIClient
+from rest_framework.authtoken.models import Token
+from django.contrib.auth import get_user_model
+from backend.models import (Shop, ShopOrder, Category, Product, ProductInfo, Order,
+                            OrderItem, Contact)
+
+
+User = get_user_model()
+
+
+@override_settings(PARTNER_FEED_LAG=0)
+class PartnerOrdersFeedTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('backend:partner-orders-feed')
+        self.shop_user = User.objects.create_user(email='shop@example.com',
+                                                  password='testpassword',
+                                                  is_active=True,
+                                                  type='shop')
+        self.shop_token = Token.objects.create(user=self.shop_user)
+        self.buyer = User.objects.create_user(email='user@example.com',
+                                              password='testpassword',
+                                              is_active=True)
+        self.shop = Shop.objects.create(name='Test Shop', user=self.shop_user, state=True)
+        self.category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Test Product', category=self.category)
+        self.product_info = ProductInfo.objects.create(product=self.product,
+                                                       shop=self.shop,
+                                                       external_id=12345,
+                                                       price=100,
+                                                       price_rrc=120,
+                                                       quantity=100)
+        self.contact = Contact.objects.create(user=self.buyer,
+                                              city='Test City',
+                                              street='Test Street',
+                                              phone='+1234567890')
+        self.orders = [self._place_order(quantity) for quantity in (1, 2, 3)]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.shop_token.key)
+
+    def _place_order(self, quantity):
+        order = Order.objects.create(user=self.buyer, state='new', contact=self.contact)
+        OrderItem.objects.create(order=order, product_info=self.product_info, quantity=quantity)
+        order.update_totals()
+        order.split_by_shops()
+        return order
+
+    def test_feed_returns_compact_lines(self):
+        """Позитивный тест: лента содержит компактные данные о позициях"""
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['orders']), 3)
+        self.assertFalse(response.data['has_more'])
+        self.assertIsNotNone(response.data['cursor'])
+
+        order_data = response.data['orders'][0]
+        self.assertEqual(order_data['id'], self.orders[0].id)
+        self.assertEqual(order_data['items'], [{'product_info': self.product_info.id,
+                                                'external_id': 12345,
+                                                'quantity': 1,
+                                                'price': 100}])
+
+    def test_feed_cursor_returns_only_changes(self):
+        """Позитивный тест: по курсору возвращаются только изменённые заказы"""
+
+        response = self.client.get(self.url, {'limit': 2})
+        self.assertEqual(len(response.data['orders']), 2)
+        self.assertTrue(response.data['has_more'])
+
+        response = self.client.get(self.url, {'cursor': response.data['cursor']})
+        self.assertEqual([order['id'] for order in response.data['orders']],
+                         [self.orders[2].id])
+        cursor = response.data['cursor']
+
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual(response.data['orders'], [])
+        self.assertEqual(response.data['cursor'], cursor)
+
+        self.orders[0].state = 'confirmed'
+        self.orders[0].save()
+
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual(len(response.data['orders']), 1)
+        self.assertEqual(response.data['orders'][0]['id'], self.orders[0].id)
+        self.assertEqual(response.data['orders'][0]['state'], 'confirmed')
+
+    def test_feed_returns_changed_totals(self):
+        """Позитивный тест: пересчёт суммы заказа попадает в ленту"""
+
+        cursor = self.client.get(self.url).data['cursor']
+
+        OrderItem.objects.filter(order=self.orders[0]).update(quantity=5)
+        self.orders[0].update_totals()
+
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual([order['id'] for order in response.data['orders']],
+                         [self.orders[0].id])
+        self.assertEqual(response.data['orders'][0]['total_sum'], 500)
+
+    def test_feed_invalid_cursor(self):
+        """Негативный тест: повреждённый курсор"""
+
+        response = self.client.get(self.url, {'cursor': 'broken'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['Status'])
+
+    def test_feed_invalid_limit(self):
+        """Негативный тест: нечисловой limit; limit меньше 1 заменяется на 1"""
+
+        response = self.client.get(self.url, {'limit': 'ten'})
+        self.assertEqual(response.status_code, 400)
+
+        for limit in (0, -5):
+            response = self.client.get(self.url, {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['orders']), 1)
+            self.assertTrue(response.data['has_more'])
+
+    @override_settings(PARTNER_FEED_LAG=60)
+    def test_feed_skips_recent_changes(self):
+        """Позитивный тест: изменения моложе задержки ленты откладываются до следующего запроса"""
+
+        ShopOrder.objects.filter(order=self.orders[0]).update(
+            updated_at=timezone.now() - timedelta(minutes=5))
+
+        response = self.client.get(self.url)
+        self.assertEqual([order['id'] for order in response.data['orders']],
+                         [self.orders[0].id])
+        self.assertFalse(response.data['has_more'])
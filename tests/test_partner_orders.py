@@ -3,7 +3,8 @@ from rest_framework.test import APITestCase, APIClient
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import get_user_model
 from django.db.models import Sum, F
-from backend.models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact
+from backend.models import (Shop, ShopOrder, Category, Product, ProductInfo, Order, OrderItem,
+                            Contact)
 
 
 User = get_user_model()
@@ -42,6 +43,8 @@ class PartnerOrdersTests(APITestCase):
         self.order = Order.objects.create(user=self.regular_user, state='new', contact=self.contact)
 
         OrderItem.objects.create(order=self.order, product_info=self.product_info, quantity=2)
+        self.order.update_totals()
+        self.order.split_by_shops()
 
     def test_get_orders_as_shop(self):
         """Позитивный тест: получение заказов"""
@@ -49,10 +52,26 @@ class PartnerOrdersTests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.shop_token.key)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
         expected_total = OrderItem.objects.filter(
             order=self.order).aggregate(total=Sum(F('quantity') * F('product_info__price')))['total']
-        self.assertEqual(float(response.data[0]['total_sum']), float(expected_total))
+        self.assertEqual(float(response.data['results'][0]['total_sum']), float(expected_total))
+
+    def test_shop_order_total_follows_items(self):
+        """Позитивный тест: изменение и удаление позиции пересчитывает сумму поставки"""
+
+        item = OrderItem.objects.get(order=self.order)
+        item.quantity = 5
+        item.save()
+        self.order.update_totals()
+
+        shop_order = ShopOrder.objects.get(order=self.order)
+        self.assertEqual(shop_order.total_sum, 500)
+        self.assertEqual(Order.objects.get(id=self.order.id).total_sum, 500)
+
+        item.delete()
+        self.order.update_totals()
+        self.assertEqual(ShopOrder.objects.get(id=shop_order.id).total_sum, 0)
 
     def test_get_orders_unauthenticated(self):
         """Негативный тест: неавторизованный пользователь"""
@@ -80,7 +99,7 @@ class PartnerOrdersTests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + new_shop_token.key)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_exclude_basket_orders(self):
         """Позитивный тест: корзины не включаются в результаты"""
@@ -93,15 +112,15 @@ class PartnerOrdersTests(APITestCase):
                                  quantity=1)
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.shop_token.key)
         response = self.client.get(self.url)
-        self.assertEqual(len(response.data), 1)
-        self.assertNotEqual(response.data[0]['id'], basket_order.id)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotEqual(response.data['results'][0]['id'], basket_order.id)
 
     def test_order_serializer_fields(self):
         """Позитивный тест: проверка наличия основных полей в ответе"""
 
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.shop_token.key)
         response = self.client.get(self.url)
-        order_data = response.data[0]
+        order_data = response.data['results'][0]
         self.assertIn('id', order_data)
         self.assertIn('state', order_data)
         self.assertIn('dt', order_data)
@@ -120,3 +139,53 @@ class PartnerOrdersTests(APITestCase):
         product = product_info['product']
         self.assertIn('name', product)
         self.assertIn('category', product)
+
+    def test_multi_shop_order_split(self):
+        """Позитивный тест: магазин видит только свою поставку из общего заказа"""
+
+        other_shop = Shop.objects.create(name='Other Shop', state=True)
+        other_info = ProductInfo.objects.create(product=self.product,
+                                                shop=other_shop,
+                                                external_id=54321,
+                                                price=70,
+                                                price_rrc=80,
+                                                quantity=10)
+        order = Order.objects.create(user=self.regular_user, state='basket')
+        OrderItem.objects.create(order=order, product_info=self.product_info, quantity=1)
+        OrderItem.objects.create(order=order, product_info=other_info, quantity=3)
+        order.update_totals()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.regular_token.key)
+        response = self.client.post(reverse('backend:order'),
+                                    {'id': str(order.id), 'contact': str(self.contact.id)},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(order.shop_orders.count(), 2)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.shop_token.key)
+        response = self.client.get(self.url)
+        results = response.data['results']
+        self.assertEqual(len(results), 2)
+        shop_order = next(item for item in results if item['id'] == order.id)
+        self.assertEqual(shop_order['total_sum'], 100)
+        self.assertEqual(len(shop_order['ordered_items']), 1)
+        self.assertEqual(shop_order['ordered_items'][0]['product_info']['id'],
+                         self.product_info.id)
+
+    def test_orders_pagination(self):
+        """Позитивный тест: список заказов магазина выдаётся постранично"""
+
+        for _ in range(3):
+            order = Order.objects.create(user=self.regular_user, state='new')
+            OrderItem.objects.create(order=order, product_info=self.product_info, quantity=1)
+            order.update_totals()
+            order.split_by_shops()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.shop_token.key)
+        response = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
@@ -0,0 +1,33 @@
+from django.test import TestCase, override_settings
+from backend.models import Shop
+from backend.query_budget import QueryBudgetExceeded, query_budget, with_query_budget
+
+
+@with_query_budget(1)
+def count_shops_twice():
+    return Shop.objects.nocache().count() + Shop.objects.nocache().count()
+
+
+class QueryBudgetTests(TestCase):
+    """Тесты ограничения количества запросов задач."""
+
+    def test_within_budget(self):
+        """Позитивный тест: запросы в пределах бюджета"""
+
+        with query_budget(1, 'test') as counter:
+            Shop.objects.nocache().count()
+        self.assertEqual(counter.count, 1)
+
+    def test_exceeded_in_tests(self):
+        """Негативный тест: превышение бюджета в тестах - ошибка"""
+
+        with self.assertRaises(QueryBudgetExceeded):
+            count_shops_twice()
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_exceeded_in_production(self):
+        """Позитивный тест: в работе превышение только пишется в лог"""
+
+        with self.assertLogs('backend.query_budget', level='WARNING') as logs:
+            self.assertEqual(count_shops_twice(), 0)
+        self.assertIn('count_shops_twice', logs.output[0])
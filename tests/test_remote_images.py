@@ -0,0 +1,148 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from PIL import Image
+from django.test import TestCase, override_settings
+from backend.models import Category, Product, User
+from backend.remote_image_utils import fetch_product_images
+from backend.tasks import do_import
+from tests.utils import TemporaryMediaMixin, image_bytes
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Локальная замена сервера партнёра: отдаёт изображения с ETag и учитывает запросы."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('If-None-Match')))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(0.05)
+            body = server.files.get(self.path)
+            etag = f'"{self.path}"'
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+            elif self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(IMAGE_FETCH_WORKERS=6, IMAGE_FETCH_PER_HOST=2)
+@patch('backend.signals.generate_product_thumbnails.delay')
+class RemoteImagesTests(TemporaryMediaMixin, TestCase):
+    """Тесты загрузки изображений товаров по ссылкам из прайса."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.files = {f'/{number}.jpg': image_bytes(color, (640, 480))
+                             for number, color in enumerate(('red', 'green', 'blue', 'white'))}
+        self.server.files['/text.jpg'] = b'not an image'
+        self.server.requests = []
+        self.server.active = self.server.max_active = 0
+        category = Category.objects.create(name='Test Category')
+        self.products = [Product.objects.create(name=f'Product {number}', category=category)
+                         for number in range(6)]
+
+    def images(self, paths):
+        return [(product.id, f'{self.base_url}{path}') for product, path in zip(self.products, paths)]
+
+    def test_fetch_conditional_and_host_limit(self, mock_delay):
+        """Позитивный тест: изображения загружаются пулом, повторно - условным запросом"""
+
+        images = self.images(['/0.jpg', '/1.jpg', '/2.jpg', '/3.jpg'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = fetch_product_images(images)
+
+        self.assertEqual(stats, {'updated': 4, 'not_modified': 0, 'failed': 0})
+        self.assertLessEqual(self.server.max_active, 2)
+        self.assertEqual(mock_delay.call_count, 4)
+        product = Product.objects.get(id=self.products[0].id)
+        self.assertEqual(product.image_state, 'processing')
+        self.assertEqual(product.image_source['etag'], '"/0.jpg"')
+        with Image.open(product.image.path) as img:
+            self.assertEqual(img.size, (640, 480))
+
+        self.server.requests = []
+        stats = fetch_product_images(images)
+
+        self.assertEqual(stats, {'updated': 0, 'not_modified': 4, 'failed': 0})
+        self.assertTrue(all(etag == f'"{path}"' for path, etag in self.server.requests))
+        self.assertEqual(mock_delay.call_count, 4)
+
+    def test_failed_downloads(self, mock_delay):
+        """Негативный тест: ошибки HTTP и не изображения не прерывают загрузку остальных"""
+
+        stats = fetch_product_images(self.images(['/missing.jpg', '/text.jpg', '/0.jpg']))
+
+        self.assertEqual(stats, {'updated': 1, 'not_modified': 0, 'failed': 2})
+        self.assertFalse(Product.objects.get(id=self.products[1].id).image)
+
+    def test_import_schedules_fetch_after_commit(self, mock_delay):
+        """Позитивный тест: импорт ставит загрузку изображений после фиксации транзакции"""
+
+        user = User.objects.create(email='shop@example.com', type='shop')
+        source = f"""
+shop: Test Shop
+categories:
+  - id: 1
+    name: Test Category 1
+goods:
+  - id: 10
+    category: 1
+    model: model-a
+    name: With image
+    price: 100
+    price_rrc: 120
+    quantity: 1
+    image: {self.base_url}/0.jpg
+    parameters: {{}}
+  - id: 11
+    category: 1
+    model: model-b
+    name: Without image
+    price: 100
+    price_rrc: 120
+    quantity: 1
+    parameters: {{}}
+""".encode()
+
+        with patch('backend.tasks.fetch_product_images_task.delay') as mock_fetch:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                do_import(source, user.id)
+            mock_fetch.assert_not_called()
+            for callback in callbacks:
+                callback()
+
+        product = Product.objects.get(name='With image')
+        mock_fetch.assert_called_once_with([(product.id, f'{self.base_url}/0.jpg')])
@@ -0,0 +1,161 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+from unittest.mock import patch
+from PIL import Image
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from backend.image_utils import render_variants
+from backend.models import Category, Product
+from backend.thumbnail_cache import ThumbnailDiskCache, get_thumbnail_cache
+from tests.utils import TemporaryMediaMixin, image_file
+
+CACHE_DIR = tempfile.mkdtemp()
+
+
+@override_settings(THUMBNAIL_CACHE_DIR=CACHE_DIR)
+class ThumbnailEndpointTests(TemporaryMediaMixin, TestCase):
+    """Тесты получения миниатюр по запросу."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        with patch('backend.signals.generate_product_thumbnails.delay'):
+            self.product = Product.objects.create(name='Test Product', category=category,
+                                                  image=image_file('green', (900, 600)))
+
+    def url(self, size='300x300', kind='product', object_id=None):
+        width, height = size.split('x')
+        return reverse('backend:thumbnail', args=(kind, object_id or self.product.id,
+                                                  int(width), int(height)))
+
+    def test_render_once_then_cache_hit(self):
+        """Позитивный тест: миниатюра строится при первом запросе и отдаётся из кэша"""
+
+        with patch('backend.views.media_views.render_variants', wraps=render_variants) as render:
+            first = self.client.get(self.url())
+            second = self.client.get(self.url())
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual((first['X-Thumbnail-Cache'], second['X-Thumbnail-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(first['Content-Type'], 'image/jpeg')
+        self.assertEqual(second['Cache-Control'], 'public, no-cache')
+        self.assertIn('Accept', second['Vary'])
+        with Image.open(BytesIO(b''.join(second.streaming_content))) as img:
+            self.assertEqual(img.size, (300, 200))
+
+    def test_format_negotiation_and_not_modified(self):
+        """Позитивный тест: формат по заголовку Accept и ответ 304 по ETag"""
+
+        response = self.client.get(self.url(), HTTP_ACCEPT='image/webp,*/*')
+        self.assertIn(response['Content-Type'], ('image/webp', 'image/jpeg'))
+
+        cached = self.client.get(self.url(), HTTP_ACCEPT='image/webp,*/*',
+                                 HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_replaced_image_changes_etag(self):
+        """Позитивный тест: после замены изображения прежний ETag не подходит"""
+
+        response = self.client.get(self.url())
+        with patch('backend.signals.generate_product_thumbnails.delay'):
+            self.product.image = image_file('red', (900, 600), 'new.jpg')
+            self.product.save()
+
+        replaced = self.client.get(self.url(), HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(replaced.status_code, 200)
+        self.assertNotEqual(replaced['ETag'], response['ETag'])
+
+    def test_entry_evicted_before_open(self):
+        """Негативный тест: запись, вытесненная до открытия файла, строится заново"""
+
+        cache = get_thumbnail_cache()
+        get_or_render = cache.get_or_render
+        calls = []
+
+        def evicted(key, render):
+            variants, hit = get_or_render(key, render)
+            if not calls:
+                shutil.rmtree(cache.entry_dir(key))
+            calls.append(key)
+            return variants, hit
+
+        with patch.object(cache, 'get_or_render', side_effect=evicted):
+            response = self.client.get(self.url('200x200'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(response['X-Thumbnail-Cache'], 'MISS')
+
+    def test_invalid_requests(self):
+        """Негативный тест: недопустимый размер, неизвестный тип и объект без изображения"""
+
+        self.assertEqual(self.client.get(self.url('123x45')).status_code, 400)
+        self.assertEqual(self.client.get(self.url(kind='order')).status_code, 404)
+        self.assertEqual(self.client.get(self.url(object_id=999)).status_code, 404)
+
+
+class ThumbnailDiskCacheTests(TestCase):
+    """Тесты дискового кэша миниатюр."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_lru_eviction(self):
+        """Позитивный тест: при превышении лимита вытесняется давно не использованная запись"""
+
+        cache = ThumbnailDiskCache(self.root, max_bytes=2500)
+        render = lambda: {'jpeg': b'x' * 1000}
+
+        cache.get_or_render('second', render)
+        cache.get_or_render('first', render)
+        old = time.time() - 60
+        os.utime(cache.entry_dir('second'), (old, old))
+        cache.get_or_render('third', render)
+
+        self.assertTrue(os.path.exists(cache.entry_dir('first')))
+        self.assertFalse(os.path.exists(cache.entry_dir('second')))
+        self.assertLessEqual(sum(size for _, size, _ in cache.iter_entries()), 2250)
+
+    def test_eviction_frees_headroom(self):
+        """Позитивный тест: после вытеснения следующие промахи не обходят кэш"""
+
+        cache = ThumbnailDiskCache(self.root, max_bytes=10000)
+        for number in range(10):
+            cache.get_or_render(f'key {number}', lambda: {'jpeg': b'x' * 1000})
+
+        with patch.object(cache, 'evict', wraps=cache.evict) as evict:
+            cache.get_or_render('small', lambda: {'jpeg': b'x' * 100})
+
+        evict.assert_not_called()
+
+    def test_concurrent_cold_requests_render_once(self):
+        """Позитивный тест: одновременные запросы холодной записи строят её один раз"""
+
+        cache = ThumbnailDiskCache(self.root, max_bytes=10 ** 6)
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'jpeg': b'data'}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_render('key', render)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(hit for _, hit in results), [False, True, True, True, True])
@@ -0,0 +1,83 @@
+import os
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase
+from backend.image_utils import THUMBNAIL_TARGETS, backfill_thumbnails
+from backend.models import Category, Product, User
+from backend.tasks import generate_product_thumbnails
+from tests.utils import TemporaryMediaMixin, image_file
+
+
+@patch('backend.signals.generate_product_thumbnails.delay')
+@patch('backend.signals.generate_user_thumbnails.delay')
+class BackfillThumbnailsTests(TemporaryMediaMixin, TestCase):
+    """Тесты массовой генерации миниатюр."""
+
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        self.products = [Product.objects.create(name=f'Product {number}', category=category,
+                                                image=image_file(color))
+                         for number, color in enumerate(('red', 'green', 'blue'))]
+        Product.objects.create(name='Without image', category=category)
+
+    def test_backfill_and_skip_up_to_date(self, *mocks):
+        """Позитивный тест: миниатюры строятся один раз, повторный запуск их пропускает"""
+
+        target = THUMBNAIL_TARGETS['product']
+        self.assertEqual(backfill_thumbnails(target, workers=1, batch_size=2),
+                         {'updated': 3, 'skipped': 0, 'failed': 0})
+
+        product = Product.objects.get(id=self.products[0].id)
+        self.assertEqual(set(product.thumbnails), {'400x400', '200x200', '100x100'})
+        for variant in product.thumbnails['100x100'].values():
+            self.assertTrue(os.path.exists(self.media_path(variant['path'])))
+        self.assertEqual(len(product.thumbnails_source.split(':')[1]), 64)
+
+        self.assertEqual(backfill_thumbnails(target, workers=1),
+                         {'updated': 0, 'skipped': 3, 'failed': 0})
+
+    def test_size_set_change_and_missing_files(self, *mocks):
+        """Позитивный тест: новый набор размеров и пропавшие файлы перестраиваются"""
+
+        target = THUMBNAIL_TARGETS['product']
+        backfill_thumbnails(target, workers=1)
+        product = Product.objects.get(id=self.products[1].id)
+        os.remove(self.media_path(product.thumbnails['200x200']['jpeg']['path']))
+
+        self.assertEqual(backfill_thumbnails(target, workers=1),
+                         {'updated': 1, 'skipped': 2, 'failed': 0})
+
+        stats = backfill_thumbnails(target._replace(sizes=[(300, 300)]), workers=1)
+        self.assertEqual(stats['updated'], 3)
+        self.assertEqual(set(Product.objects.get(id=product.id).thumbnails), {'300x300'})
+
+    def test_task_result_skipped_by_backfill(self, *mocks):
+        """Позитивный тест: миниатюры, построенные задачей, считаются актуальными"""
+
+        generate_product_thumbnails(self.products[0].id)
+
+        stats = backfill_thumbnails(THUMBNAIL_TARGETS['product'], workers=1)
+        self.assertEqual((stats['updated'], stats['skipped']), (2, 1))
+
+    def test_missing_original(self, *mocks):
+        """Негативный тест: отсутствующий оригинал учитывается как ошибка"""
+
+        os.remove(self.products[2].image.path)
+
+        stats = backfill_thumbnails(THUMBNAIL_TARGETS['product'], workers=1)
+        self.assertEqual((stats['updated'], stats['failed']), (2, 1))
+
+    def test_command_with_process_pool(self, *mocks):
+        """Позитивный тест: команда обрабатывает товары и аватары в пуле процессов"""
+
+        user = User.objects.create(email='test@example.com', avatar=image_file('white'))
+
+        out = StringIO()
+        call_command('backfill_thumbnails', '--workers', '2', stdout=out)
+
+        self.assertIn('product: обновлено 3', out.getvalue())
+        self.assertIn('user: обновлено 1', out.getvalue())
+        self.assertIn('изображений в секунду', out.getvalue())
+        self.assertEqual(set(User.objects.get(id=user.id).avatar_thumbnails),
+                         {'200x200', '100x100', '50x50'})
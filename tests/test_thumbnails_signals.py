@@ -1,12 +1,12 @@
 from django.test import TestCase
+from django.utils import timezone
 from unittest.mock import patch
-from django.core.files import File
-from io import BytesIO
-from PIL import Image
 from backend.models import Product, User, Category
+from backend.tasks import generate_user_thumbnails
+from tests.utils import TemporaryMediaMixin, image_file
 
 
-class TestThumbnailsSignals(TestCase):
+class TestThumbnailsSignals(TemporaryMediaMixin, TestCase):
     """
     Тесты для сигналов обработки изображений товаров
     и аватаров пользователей.
@@ -21,11 +21,7 @@ class TestThumbnailsSignals(TestCase):
         - Создает тестового пользователя без аватара
         """
 
-        image = Image.new('RGB', (1000, 1000), color='red')
-        image_file = BytesIO()
-        image.save(image_file, 'JPEG')
-        image_file.seek(0)
-        self.image_file = File(image_file, name='test.jpg')
+        self.image_file = image_file(size=(1000, 1000))
         self.category = Category.objects.create(name="Test Category")
         self.product = Product.objects.create(name="Test Product",
                                               category=self.category)
@@ -41,9 +37,11 @@ class TestThumbnailsSignals(TestCase):
         """
 
         self.product.image = self.image_file
-        self.product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
         mock_delay.assert_called_once_with(self.product.id,
-                                           [(400, 400), (200, 200), (100, 100)])
+                                           [(400, 400), (200, 200), (100, 100)],
+                                           image_name=self.product.image.name)
 
     @patch('backend.signals.generate_product_thumbnails.delay')
     def test_process_product_image_on_save_image_changed(self, mock_delay):
@@ -56,16 +54,14 @@ class TestThumbnailsSignals(TestCase):
         - Проверяем что задача вызывалась дважды (по разу для каждого изображения)
         """
         self.product.image = self.image_file
-        self.product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
 
-        image2 = Image.new('RGB', (1000, 1000), color='blue')
-        image_file2 = BytesIO()
-        image2.save(image_file2, 'JPEG')
-        image_file2.seek(0)
-        image_file2 = File(image_file2, name='test2.jpg')
+        image_file2 = image_file('blue', (1000, 1000), 'test2.jpg')
 
         self.product.image = image_file2
-        self.product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
         self.assertEqual(mock_delay.call_count, 2)
 
     @patch('backend.signals.generate_user_thumbnails.delay')
@@ -78,9 +74,11 @@ class TestThumbnailsSignals(TestCase):
         """
 
         self.user.avatar = self.image_file
-        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
         mock_delay.assert_called_once_with(user_id=self.user.id,
-                                           sizes=[(200, 200), (100, 100), (50, 50)])
+                                           sizes=[(200, 200), (100, 100), (50, 50)],
+                                           image_name=self.user.avatar.name)
 
     @patch('backend.signals.generate_user_thumbnails.delay')
     def test_process_user_avatar_on_save_avatar_changed(self, mock_delay):
@@ -93,16 +91,14 @@ class TestThumbnailsSignals(TestCase):
         - Проверяем что задача вызывалась дважды (по разу для каждого аватара)
         """
         self.user.avatar = self.image_file
-        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
 
-        image2 = Image.new('RGB', (1000, 1000), color='blue')
-        image_file2 = BytesIO()
-        image2.save(image_file2, 'JPEG')
-        image_file2.seek(0)
-        image_file2 = File(image_file2, name='test2.jpg')
+        image_file2 = image_file('blue', (1000, 1000), 'test2.jpg')
 
         self.user.avatar = image_file2
-        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
         self.assertEqual(mock_delay.call_count, 2)
 
     @patch('backend.signals.generate_user_thumbnails.delay')
@@ -113,5 +109,66 @@ class TestThumbnailsSignals(TestCase):
         - Проверяем что задача на генерацию уменьшенных копий не вызывалась
         """
 
-        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        mock_delay.assert_not_called()
+
+    @patch('backend.signals.generate_user_thumbnails.delay')
+    def test_unrelated_user_saves_do_not_enqueue(self, mock_delay):
+        """
+        Негативный тест: сохранения без замены аватара задачу не ставят:
+        - Вход в систему (обновление last_login)
+        - Смена пароля
+        - Повторное сохранение загруженного из БД пользователя
+        """
+
+        self.user.avatar = self.image_file
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        mock_delay.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+            self.user.set_password('newpassword')
+            self.user.save()
+            User.objects.get(id=self.user.id).save()
+        mock_delay.assert_not_called()
+
+    @patch('backend.signals.generate_product_thumbnails.delay')
+    def test_unrelated_product_save_does_not_enqueue(self, mock_delay):
+        """Негативный тест: изменение названия товара не ставит задачу"""
+
+        self.product.image = self.image_file
+        self.product.save()
+
+        product = Product.objects.get(id=self.product.id)
+        product.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
         mock_delay.assert_not_called()
+
+    def test_task_skips_replaced_and_up_to_date_images(self):
+        """
+        Тест дедупликации задач:
+        - Задача для заменённого аватара пропускается
+        - Повторная задача для того же аватара пропускается
+        - Задача для необработанного оригинала после обработки пропускается
+        """
+
+        self.user.avatar = self.image_file
+        with patch('backend.signals.generate_user_thumbnails.delay'):
+            self.user.save()
+        raw_name = self.user.avatar.name
+
+        stale = generate_user_thumbnails(self.user.id, image_name='avatars/old.jpg')
+        first = generate_user_thumbnails(self.user.id, image_name=raw_name)
+        self.user.refresh_from_db()
+        second = generate_user_thumbnails(self.user.id, image_name=self.user.avatar.name)
+        retried = generate_user_thumbnails(self.user.id, image_name=raw_name)
+
+        self.assertEqual(stale['status'], 'skipped')
+        self.assertEqual(first['status'], 'success')
+        self.assertEqual(len(first['generated']), 3)
+        self.assertEqual((second['status'], second['reason']), ('skipped', 'Миниатюры актуальны'))
+        self.assertEqual((retried['status'], retried['reason']), ('skipped', 'Изображение заменено'))
@@ -1,14 +1,12 @@
 from django.test import TestCase
 from unittest.mock import patch
-from django.core.files import File
-from io import BytesIO
-from PIL import Image
 
 from backend.tasks import generate_product_thumbnails, generate_user_thumbnails
 from backend.models import Product, User, Category
+from tests.utils import TemporaryMediaMixin, image_file
 
 
-class TestGenerateThumbnailsTasks(TestCase):
+class TestGenerateThumbnailsTasks(TemporaryMediaMixin, TestCase):
     """Тесты для задач Celery по генерации уменьшенных копий изображений."""
 
     def setUp(self):
@@ -20,19 +18,15 @@ class TestGenerateThumbnailsTasks(TestCase):
         - Создает тестового пользователя с аватаром
         """
 
-        image = Image.new('RGB', (1000, 1000), color='red')
-        image_file = BytesIO()
-        image.save(image_file, 'JPEG')
-        image_file.seek(0)
         self.category = Category.objects.create(name="Test Category")
-        self.image_file = File(image_file, name='test.jpg')
+        self.image_file = image_file(size=(1000, 1000))
         self.product = Product.objects.create(name="Test Product",
                                               image=self.image_file,
                                               category=self.category)
         self.user = User.objects.create(email="test@example.com",
                                         avatar=self.image_file)
 
-    @patch('backend.tasks.generate_and_save_thumbnails')
+    @patch('backend.image_utils.generate_and_save_thumbnails')
     def test_generate_product_thumbnails_success(self, mock_generate):
         """
         Позитивный тест создания уменьшенных копий для продукта:
@@ -60,7 +54,7 @@ class TestGenerateThumbnailsTasks(TestCase):
         self.assertEqual(result['status'], 'error')
         self.assertEqual(result['reason'], 'Товар не найден')
 
-    @patch('backend.tasks.generate_and_save_thumbnails')
+    @patch('backend.image_utils.generate_and_save_thumbnails')
     def test_generate_user_thumbnails_success(self, mock_generate):
         """
         Позитивный тест создания уменьшенных копий аватара пользователя:
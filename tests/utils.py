@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from PIL import Image
+from django.core.files import File
+from django.test import override_settings
+
+
+def image_bytes(color='red', size=(600, 400), image_format='JPEG'):
+    """Содержимое файла изображения одного цвета."""
+
+    buffer = BytesIO()
+    Image.new('RGBA' if image_format == 'PNG' else 'RGB', size, color=color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def image_file(color='red', size=(600, 400), name='test.jpg'):
+    """Файл изображения для поля ImageField; формат (JPEG или PNG) определяется по имени."""
+
+    image_format = 'PNG' if name.endswith('.png') else 'JPEG'
+    return File(BytesIO(image_bytes(color, size, image_format)), name=name)
+
+
+class TemporaryMediaMixin:
+    """Подменяет MEDIA_ROOT временным каталогом, который удаляется после тестов класса."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        super().setUpClass()
+
+    def media_path(self, path):
+        """Абсолютный путь к файлу внутри MEDIA_ROOT."""
+
+        return os.path.join(self.media_root, path)
+
+    def write_media_file(self, path, content=b'x' * 100):
+        """Создаёт файл внутри MEDIA_ROOT вместе с каталогами и возвращает его путь."""
+
+        full_path = self.media_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as file:
+            file.write(content)
+        return full_path